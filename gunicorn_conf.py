@@ -0,0 +1,53 @@
+# Production launcher: gunicorn pre-forks uvicorn workers and restarts them
+# gracefully (SIGHUP reloads, max_requests recycles). Run with:
+#
+#   gunicorn server:app -c gunicorn_conf.py
+#
+# UvicornWorker uses loop="auto" and http="auto", so uvloop and httptools
+# are picked up automatically when installed.
+import asyncio
+import multiprocessing
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8001')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Async workers are CPU bound, one per core is enough
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+
+backlog = int(os.getenv("BACKLOG", 2048))
+keepalive = int(os.getenv("KEEPALIVE", 5))
+timeout = int(os.getenv("WORKER_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+
+# Recycle workers periodically; jitter keeps them from restarting together
+max_requests = int(os.getenv("MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", 1000))
+
+accesslog = None
+errorlog = "-"
+
+def on_starting(server):
+    # Create indexes and the default admin once in the master instead of
+    # in every worker's lifespan
+    from server import bootstrap
+    from utils.access_log import setup_logging, stop_logging
+    from utils.db import DB_NAME, connect
+
+    async def run():
+        client = connect("default")
+        try:
+            await bootstrap(client[DB_NAME])
+        finally:
+            client.close()
+
+    setup_logging()
+    try:
+        asyncio.run(run())
+    finally:
+        # The writer thread does not survive the fork; workers start their own
+        stop_logging()
+    os.environ["SKIP_BOOTSTRAP"] = "1"
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime
 
 class BookingCreate(BaseModel):
@@ -9,6 +9,9 @@ class BookingCreate(BaseModel):
     quantity: int = 1
     notes: Optional[str] = None
 
+class BookingBatchCreate(BaseModel):
+    items: List[BookingCreate]
+
 class BookingUpdate(BaseModel):
     status: Optional[str] = None
     start_date: Optional[str] = None
@@ -16,6 +19,14 @@ class BookingUpdate(BaseModel):
     quantity: Optional[int] = None
     notes: Optional[str] = None
 
+class BookingBulkStatusUpdate(BaseModel):
+    # Either explicit ids or filters (or both) select the bookings
+    status: str
+    ids: Optional[List[str]] = None
+    from_status: Optional[str] = None
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+
 class BookingResponse(BaseModel):
     id: str
     user_id: str
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime
 
 class PaymentCreate(BaseModel):
@@ -13,6 +13,15 @@ class PaymentUpdate(BaseModel):
     transaction_id: Optional[str] = None
     notes: Optional[str] = None
 
+class PaymentBulkStatusUpdate(BaseModel):
+    # Either explicit ids or filters (or both) select the payments
+    status: str
+    ids: Optional[List[str]] = None
+    from_status: Optional[str] = None
+    method: Optional[str] = None
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+
 class PaymentResponse(BaseModel):
     id: str
     booking_id: str
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime
 
 class ProductCreate(BaseModel):
@@ -20,6 +20,10 @@ class ProductUpdate(BaseModel):
     image: Optional[str] = None
     status: Optional[str] = None
 
+class StockShardsUpdate(BaseModel):
+    # 0 turns sharded stock off again
+    shards: int = Field(..., ge=0)
+
 class ProductResponse(BaseModel):
     id: str
     name: str
@@ -30,3 +34,13 @@ class ProductResponse(BaseModel):
     image: Optional[str] = None
     status: str
     created_at: Optional[datetime] = None
+
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+class ProductSearchResponse(BaseModel):
+    items: List[ProductResponse]
+    total: int
+    categories: List[FacetCount]
+    price_bands: List[FacetCount]
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, Request, Query
+from utils.auth_utils import require_admin
+from typing import Optional
+
+router = APIRouter()
+
+@router.get("/")
+async def get_audit_log(
+    request: Request,
+    entity_id: str,
+    entity: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    admin: dict = Depends(require_admin)
+):
+    db = request.app.state.db
+
+    # Newest first; served by the (entity_id, ts) index
+    query = {"entity_id": entity_id}
+    if entity:
+        query["entity"] = entity
+
+    entries = []
+    async for entry in db.audit_log.find(query).sort("ts", -1).limit(limit):
+        entries.append({
+            "id": str(entry["_id"]),
+            "entity": entry["entity"],
+            "entity_id": entry["entity_id"],
+            "action": entry["action"],
+            "actor": entry["actor"],
+            "data": entry.get("data", {}),
+            "ts": entry["ts"]
+        })
+
+    return entries
@@ -1,21 +1,36 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Request, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from models.user import UserCreate, UserLogin, UserResponse
-from utils.auth_utils import hash_password, verify_password, create_access_token, get_current_user
+from utils.auth_utils import hash_password, verify_password, password_needs_rehash, create_access_token, get_current_user
+from utils.rate_limit import enforce_auth_rate_limit, password_slot, password_slots
+from utils.audit import audit_log
 from datetime import datetime
 
 router = APIRouter()
 
+async def rehash_password(db, user_id, password: str, old_hash: str):
+    # Runs after the login response is sent. Skipped when password work is
+    # saturated; the next login will try again.
+    if password_slots.locked():
+        return
+    async with password_slots:
+        new_hash = await run_in_threadpool(hash_password, password)
+    # Only replace the hash we verified against
+    await db.users.update_one({"_id": user_id, "password": old_hash}, {"$set": {"password": new_hash}})
+
 @router.post("/register")
 async def register(user: UserCreate, request: Request):
     db = request.app.state.db
+    enforce_auth_rate_limit(request, user.email)
     
     # Check if user already exists
     existing = await db.users.find_one({"email": user.email})
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    # Hash password
-    hashed_password = hash_password(user.password)
+    # Hash password (off the event loop, capped so a burst can't starve other routes)
+    async with password_slot():
+        hashed_password = await run_in_threadpool(hash_password, user.password)
     
     # Create user
     user_doc = {
@@ -28,6 +43,7 @@ async def register(user: UserCreate, request: Request):
     
     result = await db.users.insert_one(user_doc)
     user_id = str(result.inserted_id)
+    await audit_log.record("user", user_id, "registered", user_id, {"role": user.role})
     
     # Create JWT token
     token = create_access_token({
@@ -47,18 +63,25 @@ async def register(user: UserCreate, request: Request):
     }
 
 @router.post("/login")
-async def login(credentials: UserLogin, request: Request):
+async def login(credentials: UserLogin, request: Request, background_tasks: BackgroundTasks):
     db = request.app.state.db
+    enforce_auth_rate_limit(request, credentials.email)
     
     # Find user
     user = await db.users.find_one({"email": credentials.email})
     if not user:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    # Verify password
-    if not verify_password(credentials.password, user["password"]):
+    # Verify password (off the event loop, capped so a burst can't starve other routes)
+    async with password_slot():
+        valid = await run_in_threadpool(verify_password, credentials.password, user["password"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
+    # Upgrade hashes made with a different bcrypt cost
+    if password_needs_rehash(user["password"]):
+        background_tasks.add_task(rehash_password, db, user["_id"], credentials.password, user["password"])
+    
     # Create JWT token
     token = create_access_token({
         "user_id": str(user["_id"]),
@@ -1,42 +1,67 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
-from models.booking import BookingCreate, BookingUpdate, BookingResponse
+from fastapi import APIRouter, HTTPException, Depends, Request, Header
+from models.booking import BookingCreate, BookingBatchCreate, BookingBulkStatusUpdate, BookingUpdate, BookingResponse
 from utils.auth_utils import get_current_user, require_admin
+from utils.audit import audit_log
+from utils.change_stream import notify_change
+from utils.idempotency import run_idempotent
+from utils.ids import ref_query, to_ref, to_date, date_str
+from utils.single_flight import single_flight, flight_key
+from utils.stock_counters import reserve_stock, reserve_shards, release_stock
+from utils.transitions import BOOKING_TRANSITIONS, BULK_STATUS_LIMIT, apply_status_transition, build_query
 from bson import ObjectId
+from pymongo import UpdateOne, ReturnDocument
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 router = APIRouter()
 
+# Fields needed to build a BookingResponse
+BOOKING_PROJECTION = {
+    "user_id": 1,
+    "product_id": 1,
+    "start_date": 1,
+    "end_date": 1,
+    "quantity": 1,
+    "total_price": 1,
+    "status": 1,
+    "notes": 1,
+    "created_at": 1
+}
+
 @router.get("/", response_model=List[BookingResponse])
 async def get_bookings(request: Request, current_user: dict = Depends(get_current_user)):
     db = request.app.state.db
-    bookings = []
     
     # Admin sees all, users see only their own
     query = {}
+    scope = "admin"
     if current_user["role"] != "admin":
-        query["user_id"] = current_user["user_id"]
+        query["user_id"] = ref_query(current_user["user_id"])
+        scope = current_user["user_id"]
     
-    async for booking in db.bookings.find(query):
-        # Get product name
-        product = await db.products.find_one({"_id": ObjectId(booking["product_id"])})
-        product_name = product["name"] if product else "Unknown"
-        
-        bookings.append({
-            "id": str(booking["_id"]),
-            "user_id": booking["user_id"],
-            "product_id": booking["product_id"],
-            "product_name": product_name,
-            "start_date": booking["start_date"],
-            "end_date": booking["end_date"],
-            "quantity": booking["quantity"],
-            "total_price": booking["total_price"],
-            "status": booking["status"],
-            "notes": booking.get("notes"),
-            "created_at": booking.get("created_at")
-        })
+    async def load_bookings():
+        bookings = []
+        async for booking in db.bookings.find(query):
+            # Get product name
+            product = await db.products.find_one({"_id": ObjectId(booking["product_id"])})
+            product_name = product["name"] if product else "Unknown"
+            
+            bookings.append({
+                "id": str(booking["_id"]),
+                "user_id": str(booking["user_id"]),
+                "product_id": str(booking["product_id"]),
+                "product_name": product_name,
+                "start_date": date_str(booking["start_date"]),
+                "end_date": date_str(booking["end_date"]),
+                "quantity": booking["quantity"],
+                "total_price": booking["total_price"],
+                "status": booking["status"],
+                "notes": booking.get("notes"),
+                "created_at": booking.get("created_at")
+            })
+        return bookings
     
-    return bookings
+    return await single_flight.do(flight_key(request, scope), load_bookings)
 
 @router.get("/{booking_id}", response_model=BookingResponse)
 async def get_booking(booking_id: str, request: Request, current_user: dict = Depends(get_current_user)):
@@ -51,7 +76,7 @@ async def get_booking(booking_id: str, request: Request, current_user: dict = De
         raise HTTPException(status_code=404, detail="Booking not found")
     
     # Check ownership
-    if current_user["role"] != "admin" and booking["user_id"] != current_user["user_id"]:
+    if current_user["role"] != "admin" and str(booking["user_id"]) != current_user["user_id"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
     # Get product name
@@ -60,11 +85,11 @@ async def get_booking(booking_id: str, request: Request, current_user: dict = De
     
     return {
         "id": str(booking["_id"]),
-        "user_id": booking["user_id"],
-        "product_id": booking["product_id"],
+        "user_id": str(booking["user_id"]),
+        "product_id": str(booking["product_id"]),
         "product_name": product_name,
-        "start_date": booking["start_date"],
-        "end_date": booking["end_date"],
+        "start_date": date_str(booking["start_date"]),
+        "end_date": date_str(booking["end_date"]),
         "quantity": booking["quantity"],
         "total_price": booking["total_price"],
         "status": booking["status"],
@@ -72,10 +97,7 @@ async def get_booking(booking_id: str, request: Request, current_user: dict = De
         "created_at": booking.get("created_at")
     }
 
-@router.post("/", response_model=BookingResponse)
-async def create_booking(booking: BookingCreate, request: Request, current_user: dict = Depends(get_current_user)):
-    db = request.app.state.db
-    
+async def insert_booking(db, booking: BookingCreate, current_user: dict):
     # Get product
     try:
         product = await db.products.find_one({"_id": ObjectId(booking.product_id)})
@@ -85,18 +107,22 @@ async def create_booking(booking: BookingCreate, request: Request, current_user:
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Check stock
-    if product["stock"] < booking.quantity:
+    # Check stock (a sharded product's stock field is only a snapshot)
+    if not product.get("stock_shards") and product["stock"] < booking.quantity:
+        raise HTTPException(status_code=400, detail="Insufficient stock")
+    
+    # Reserve stock; the guarded decrement fails instead of overselling
+    if not await reserve_stock(db, product, booking.quantity):
         raise HTTPException(status_code=400, detail="Insufficient stock")
     
     # Calculate total price (simplified: price * quantity)
     total_price = product["price"] * booking.quantity
     
     booking_doc = {
-        "user_id": current_user["user_id"],
-        "product_id": booking.product_id,
-        "start_date": booking.start_date,
-        "end_date": booking.end_date,
+        "user_id": to_ref(current_user["user_id"]),
+        "product_id": to_ref(booking.product_id),
+        "start_date": to_date(booking.start_date),
+        "end_date": to_date(booking.end_date),
         "quantity": booking.quantity,
         "total_price": total_price,
         "status": "pending",
@@ -104,13 +130,16 @@ async def create_booking(booking: BookingCreate, request: Request, current_user:
         "created_at": datetime.utcnow()
     }
     
-    result = await db.bookings.insert_one(booking_doc)
-    
-    # Update stock
-    await db.products.update_one(
-        {"_id": ObjectId(booking.product_id)},
-        {"$inc": {"stock": -booking.quantity}}
-    )
+    try:
+        result = await db.bookings.insert_one(booking_doc)
+    except BaseException:
+        await release_stock(db, product["_id"], booking.quantity)
+        raise
+    notify_change("bookings", "insert", result.inserted_id, booking_doc)
+    await audit_log.record("booking", result.inserted_id, "created", current_user["user_id"], {
+        "product_id": booking.product_id,
+        "quantity": booking.quantity
+    })
     
     return {
         "id": str(result.inserted_id),
@@ -126,6 +155,159 @@ async def create_booking(booking: BookingCreate, request: Request, current_user:
         "created_at": booking_doc["created_at"]
     }
 
+@router.post("/", response_model=BookingResponse)
+async def create_booking(
+    booking: BookingCreate,
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
+    db = request.app.state.db
+    
+    # A retry with the same Idempotency-Key gets the first response back
+    # instead of a second booking
+    return await run_idempotent(
+        db,
+        idempotency_key,
+        f"bookings:{current_user['user_id']}",
+        booking.dict(),
+        lambda: insert_booking(db, booking, current_user)
+    )
+
+@router.post("/batch", response_model=List[BookingResponse])
+async def create_booking_batch(batch: BookingBatchCreate, request: Request, current_user: dict = Depends(get_current_user)):
+    db = request.app.state.db
+    
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="No booking items provided")
+    
+    # Total quantity per product (the same product may appear on several lines)
+    quantities = {}
+    for item in batch.items:
+        try:
+            product_id = ObjectId(item.product_id)
+        except:
+            raise HTTPException(status_code=400, detail="Invalid product ID")
+        
+        if item.quantity < 1:
+            raise HTTPException(status_code=400, detail="Invalid quantity")
+        
+        quantities[product_id] = quantities.get(product_id, 0) + item.quantity
+    
+    async def checkout(session):
+        # Get all products in one query
+        products = {}
+        async for product in db.products.find({"_id": {"$in": list(quantities)}}, session=session):
+            products[product["_id"]] = product
+        
+        if len(products) != len(quantities):
+            raise HTTPException(status_code=404, detail="Product not found")
+        
+        # Reserve stock for every product; the stock guard turns an
+        # oversold line into a non-match, which aborts the whole batch
+        single = {
+            product_id: quantity for product_id, quantity in quantities.items()
+            if not products[product_id].get("stock_shards")
+        }
+        if single:
+            result = await db.products.bulk_write([
+                UpdateOne(
+                    {"_id": product_id, "stock": {"$gte": quantity}, "stock_shards": {"$exists": False}},
+                    {"$inc": {"stock": -quantity}}
+                )
+                for product_id, quantity in single.items()
+            ], ordered=False, session=session)
+            
+            if result.matched_count != len(single):
+                raise HTTPException(status_code=400, detail="Insufficient stock")
+        
+        for product_id, quantity in quantities.items():
+            if product_id in single:
+                continue
+            shards = products[product_id]["stock_shards"]
+            if not await reserve_shards(db, product_id, quantity, shards, session=session):
+                raise HTTPException(status_code=400, detail="Insufficient stock")
+        
+        created_at = datetime.utcnow()
+        booking_docs = []
+        for item in batch.items:
+            product = products[ObjectId(item.product_id)]
+            booking_docs.append({
+                "user_id": to_ref(current_user["user_id"]),
+                "product_id": to_ref(item.product_id),
+                "start_date": to_date(item.start_date),
+                "end_date": to_date(item.end_date),
+                "quantity": item.quantity,
+                "total_price": product["price"] * item.quantity,
+                "status": "pending",
+                "notes": item.notes,
+                "created_at": created_at
+            })
+        
+        await db.bookings.insert_many(booking_docs, session=session)
+        return products, booking_docs
+    
+    # All-or-nothing: any exception aborts the transaction, transient
+    # write conflicts with concurrent checkouts are retried
+    async with await db.client.start_session() as session:
+        products, booking_docs = await session.with_transaction(checkout)
+    
+    for product_id, product in products.items():
+        if product.get("stock_shards"):
+            # Published by the rebalancer instead of on every booking
+            continue
+        notify_change("products", "update", product_id, {
+            "stock": product["stock"] - quantities[product_id],
+            "status": product["status"]
+        })
+    for doc in booking_docs:
+        notify_change("bookings", "insert", doc["_id"], doc)
+        await audit_log.record("booking", doc["_id"], "created", current_user["user_id"], {
+            "product_id": str(doc["product_id"]),
+            "quantity": doc["quantity"]
+        })
+    
+    return [
+        {
+            "id": str(doc["_id"]),
+            "user_id": str(doc["user_id"]),
+            "product_id": str(doc["product_id"]),
+            "product_name": products[ObjectId(doc["product_id"])]["name"],
+            "start_date": date_str(doc["start_date"]),
+            "end_date": date_str(doc["end_date"]),
+            "quantity": doc["quantity"],
+            "total_price": doc["total_price"],
+            "status": doc["status"],
+            "notes": doc["notes"],
+            "created_at": doc["created_at"]
+        }
+        for doc in booking_docs
+    ]
+
+@router.post("/status")
+async def bulk_update_booking_status(body: BookingBulkStatusUpdate, request: Request, admin: dict = Depends(require_admin)):
+    db = request.app.state.db
+    
+    if not any(target == body.status for targets in BOOKING_TRANSITIONS.values() for target in targets):
+        raise HTTPException(status_code=400, detail="Invalid status")
+    if body.ids is None and not (body.from_status or body.created_after or body.created_before):
+        raise HTTPException(status_code=400, detail="Provide ids or filters")
+    if body.ids is not None and len(body.ids) > BULK_STATUS_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_STATUS_LIMIT} ids per request")
+    
+    query, invalid = build_query(body.ids, body.from_status, body.created_after, body.created_before)
+    results, changed, has_more = await apply_status_transition(
+        db.bookings, query, body.status, BOOKING_TRANSITIONS, {"user_id": 1}, body.ids
+    )
+    results.update(invalid)
+    
+    for doc in changed:
+        notify_change("bookings", "update", doc["_id"], {"user_id": doc["user_id"], "status": body.status})
+        await audit_log.record("booking", doc["_id"], "status_changed", admin["user_id"], {"from": doc["status"], "to": body.status})
+    
+    # has_more: more than BULK_STATUS_LIMIT matched; repeat the request for the rest
+    return {"status": body.status, "updated": len(changed), "has_more": has_more, "results": list(results.values())}
+
 @router.put("/{booking_id}", response_model=BookingResponse)
 async def update_booking(booking_id: str, booking: BookingUpdate, request: Request, current_user: dict = Depends(get_current_user)):
     db = request.app.state.db
@@ -135,23 +317,46 @@ async def update_booking(booking_id: str, booking: BookingUpdate, request: Reque
     except:
         raise HTTPException(status_code=400, detail="Invalid booking ID")
     
-    # Get existing booking
-    existing = await db.bookings.find_one({"_id": obj_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Booking not found")
-    
-    # Check ownership (users can only update their own, admins can update all)
-    if current_user["role"] != "admin" and existing["user_id"] != current_user["user_id"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    # Check ownership in the filter (users can only update their own, admins can update all)
+    query = {"_id": obj_id}
+    if current_user["role"] != "admin":
+        query["user_id"] = ref_query(current_user["user_id"])
     
     # Update only provided fields
     update_data = {k: v for k, v in booking.dict().items() if v is not None}
+    
+    # Expired bookings gave their stock back (see utils.sweeper), so they stay
+    # expired; a status change must be one BOOKING_TRANSITIONS allows
+    query["status"] = {"$ne": "expired"}
+    if "status" in update_data:
+        sources = [status for status, targets in BOOKING_TRANSITIONS.items() if update_data["status"] in targets]
+        if not sources:
+            raise HTTPException(status_code=400, detail="Invalid status")
+        query["status"] = {"$in": sources + [update_data["status"]], "$ne": "expired"}
+    
+    for field in ("start_date", "end_date"):
+        if field in update_data:
+            update_data[field] = to_date(update_data[field])
     update_data["updated_at"] = datetime.utcnow()
     
-    await db.bookings.update_one({"_id": obj_id}, {"$set": update_data})
+    # Update and get the updated booking in one round trip
+    updated = await db.bookings.find_one_and_update(
+        query,
+        {"$set": update_data},
+        projection=BOOKING_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        # Only the failure path pays for telling 404, 403 and 409 apart
+        existing = await db.bookings.find_one({"_id": obj_id}, {"user_id": 1, "status": 1})
+        if not existing:
+            raise HTTPException(status_code=404, detail="Booking not found")
+        if current_user["role"] != "admin" and str(existing["user_id"]) != current_user["user_id"]:
+            raise HTTPException(status_code=403, detail="Not authorized")
+        raise HTTPException(status_code=409, detail=f"Booking cannot be changed while {existing['status']}")
     
-    # Get updated booking
-    updated = await db.bookings.find_one({"_id": obj_id})
+    notify_change("bookings", "update", obj_id, updated)
+    await audit_log.record("booking", obj_id, "updated", current_user["user_id"], update_data)
     
     # Get product name
     product = await db.products.find_one({"_id": ObjectId(updated["product_id"])})
@@ -159,11 +364,11 @@ async def update_booking(booking_id: str, booking: BookingUpdate, request: Reque
     
     return {
         "id": str(updated["_id"]),
-        "user_id": updated["user_id"],
-        "product_id": updated["product_id"],
+        "user_id": str(updated["user_id"]),
+        "product_id": str(updated["product_id"]),
         "product_name": product_name,
-        "start_date": updated["start_date"],
-        "end_date": updated["end_date"],
+        "start_date": date_str(updated["start_date"]),
+        "end_date": date_str(updated["end_date"]),
         "quantity": updated["quantity"],
         "total_price": updated["total_price"],
         "status": updated["status"],
@@ -186,16 +391,27 @@ async def cancel_booking(booking_id: str, request: Request, current_user: dict =
         raise HTTPException(status_code=404, detail="Booking not found")
     
     # Check ownership
-    if current_user["role"] != "admin" and booking["user_id"] != current_user["user_id"]:
+    if current_user["role"] != "admin" and str(booking["user_id"]) != current_user["user_id"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    # Restore stock
-    await db.products.update_one(
-        {"_id": ObjectId(booking["product_id"])},
-        {"$inc": {"stock": booking["quantity"]}}
-    )
-    
-    # Delete booking
-    await db.bookings.delete_one({"_id": obj_id})
+    # Only a booking still holding its stock gives it back: expired and
+    # cleanup-cancelled ones already did. Deleting with that filter makes the
+    # check and the delete one atomic step, so concurrent cancels restore once.
+    held = await db.bookings.find_one_and_delete({
+        "_id": obj_id,
+        "status": {"$in": ["pending", "confirmed"]},
+        "stock_restored": {"$ne": True}
+    })
+    if held:
+        await release_stock(db, ObjectId(held["product_id"]), held["quantity"])
+    else:
+        result = await db.bookings.delete_one({"_id": obj_id})
+        if result.deleted_count == 0:
+            raise HTTPException(status_code=404, detail="Booking not found")
+    notify_change("bookings", "delete", obj_id, booking)
+    await audit_log.record("booking", obj_id, "cancelled", current_user["user_id"], {
+        "status": booking["status"],
+        "quantity": booking["quantity"]
+    })
     
     return {"message": "Booking cancelled successfully"}
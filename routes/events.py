@@ -0,0 +1,51 @@
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from utils.auth_utils import decode_token
+from utils.events import broadcaster
+from typing import Optional
+import asyncio
+import json
+import os
+
+router = APIRouter()
+
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", 15))
+
+async def get_stream_user(request: Request, token: Optional[str] = None):
+    # Browsers' EventSource can't send headers, so also accept ?token=
+    authorization = request.headers.get("authorization")
+    if authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return decode_token(token)
+
+@router.get("/")
+async def stream_events(request: Request, current_user: dict = Depends(get_stream_user)):
+    subscriber = broadcaster.subscribe(current_user["user_id"], current_user["role"] == "admin")
+
+    async def event_stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if event is None:
+                    # Fell too far behind; the client reconnects and refetches
+                    yield "event: dropped\ndata: {}\n\n"
+                    break
+
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, HTTPException, Depends, Request
+from utils.auth_utils import require_admin
+from bson import ObjectId
+
+router = APIRouter()
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, request: Request, admin: dict = Depends(require_admin)):
+    db = request.app.state.db
+
+    try:
+        job = await db.cleanup_jobs.find_one({"_id": ObjectId(job_id)})
+    except:
+        raise HTTPException(status_code=400, detail="Invalid job ID")
+
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {
+        "id": str(job["_id"]),
+        "kind": job["kind"],
+        "target_id": job["target_id"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "error": job.get("error"),
+        "created_at": job["created_at"],
+        "updated_at": job.get("updated_at"),
+        "finished_at": job.get("finished_at")
+    }
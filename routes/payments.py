@@ -1,13 +1,33 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
-from models.payment import PaymentCreate, PaymentUpdate, PaymentResponse
+from fastapi import APIRouter, HTTPException, Depends, Request, Header, UploadFile, File
+from models.payment import PaymentBulkStatusUpdate, PaymentCreate, PaymentUpdate, PaymentResponse
 from utils.auth_utils import get_current_user, require_admin
+from utils.audit import audit_log
+from utils.change_stream import notify_change
+from utils.idempotency import run_idempotent
+from utils.ids import TYPED_STORAGE, ref_query, refs_query
+from utils.reconciliation import ReconciliationError, reconcile_file
+from utils.transitions import BULK_STATUS_LIMIT, PAYMENT_TRANSITIONS, apply_status_transition, build_query, confirm_paid_bookings
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
-from typing import List
+from typing import List, Optional
+import csv
 import uuid
 
 router = APIRouter()
 
+# Fields needed to build a PaymentResponse
+PAYMENT_PROJECTION = {
+    "booking_id": 1,
+    "amount": 1,
+    "method": 1,
+    "status": 1,
+    "transaction_id": 1,
+    "notes": 1,
+    "created_at": 1
+}
+
 @router.get("/", response_model=List[PaymentResponse])
 async def get_payments(request: Request, current_user: dict = Depends(get_current_user)):
     db = request.app.state.db
@@ -19,14 +39,14 @@ async def get_payments(request: Request, current_user: dict = Depends(get_curren
     else:
         # Get user's bookings first
         user_bookings = []
-        async for booking in db.bookings.find({"user_id": current_user["user_id"]}):
-            user_bookings.append(str(booking["_id"]))
-        query = {"booking_id": {"$in": user_bookings}}
+        async for booking in db.bookings.find({"user_id": ref_query(current_user["user_id"])}, {"_id": 1}):
+            user_bookings.append(booking["_id"])
+        query = {"booking_id": refs_query(user_bookings)}
     
     async for payment in db.payments.find(query):
         payments.append({
             "id": str(payment["_id"]),
-            "booking_id": payment["booking_id"],
+            "booking_id": str(payment["booking_id"]),
             "amount": payment["amount"],
             "method": payment["method"],
             "status": payment["status"],
@@ -52,12 +72,12 @@ async def get_payment(payment_id: str, request: Request, current_user: dict = De
     # Check ownership for non-admin users
     if current_user["role"] != "admin":
         booking = await db.bookings.find_one({"_id": ObjectId(payment["booking_id"])})
-        if not booking or booking["user_id"] != current_user["user_id"]:
+        if not booking or str(booking["user_id"]) != current_user["user_id"]:
             raise HTTPException(status_code=403, detail="Not authorized")
     
     return {
         "id": str(payment["_id"]),
-        "booking_id": payment["booking_id"],
+        "booking_id": str(payment["booking_id"]),
         "amount": payment["amount"],
         "method": payment["method"],
         "status": payment["status"],
@@ -66,10 +86,7 @@ async def get_payment(payment_id: str, request: Request, current_user: dict = De
         "created_at": payment.get("created_at")
     }
 
-@router.post("/", response_model=PaymentResponse)
-async def create_payment(payment: PaymentCreate, request: Request, current_user: dict = Depends(get_current_user)):
-    db = request.app.state.db
-    
+async def insert_payment(db, payment: PaymentCreate, current_user: dict):
     # Check if booking exists
     try:
         booking = await db.bookings.find_one({"_id": ObjectId(payment.booking_id)})
@@ -80,19 +97,20 @@ async def create_payment(payment: PaymentCreate, request: Request, current_user:
         raise HTTPException(status_code=404, detail="Booking not found")
     
     # Check ownership
-    if current_user["role"] != "admin" and booking["user_id"] != current_user["user_id"]:
+    if current_user["role"] != "admin" and str(booking["user_id"]) != current_user["user_id"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    # Check if payment already exists
-    existing_payment = await db.payments.find_one({"booking_id": payment.booking_id})
-    if existing_payment:
-        raise HTTPException(status_code=400, detail="Payment already exists for this booking")
+    # Expired or cancelled bookings have given their stock back
+    if booking["status"] not in ("pending", "confirmed"):
+        raise HTTPException(status_code=409, detail=f"Cannot pay for a {booking['status']} booking")
     
     # Generate transaction ID
     transaction_id = f"TRX-{uuid.uuid4().hex[:12].upper()}"
     
     payment_doc = {
-        "booking_id": payment.booking_id,
+        # Always the ObjectId, whatever TYPED_STORAGE says: the unique index
+        # only sees duplicates of the same type
+        "booking_id": booking["_id"],
         "amount": payment.amount,
         "method": payment.method,
         "status": "pending",
@@ -101,7 +119,20 @@ async def create_payment(payment: PaymentCreate, request: Request, current_user:
         "created_at": datetime.utcnow()
     }
     
-    result = await db.payments.insert_one(payment_doc)
+    # One payment per booking, enforced by the unique index on booking_id.
+    # Until the typed-storage migration is done (TYPED_STORAGE), older
+    # payments may hold the id as a string, which the index can't match.
+    if not TYPED_STORAGE and await db.payments.find_one({"booking_id": ref_query(booking["_id"])}, {"_id": 1}):
+        raise HTTPException(status_code=400, detail="Payment already exists for this booking")
+    try:
+        result = await db.payments.insert_one(payment_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Payment already exists for this booking")
+    notify_change("payments", "insert", result.inserted_id, payment_doc)
+    await audit_log.record("payment", result.inserted_id, "created", current_user["user_id"], {
+        "booking_id": payment.booking_id,
+        "amount": payment.amount
+    })
     
     return {
         "id": str(result.inserted_id),
@@ -114,6 +145,80 @@ async def create_payment(payment: PaymentCreate, request: Request, current_user:
         "created_at": payment_doc["created_at"]
     }
 
+@router.post("/", response_model=PaymentResponse)
+async def create_payment(
+    payment: PaymentCreate,
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
+    db = request.app.state.db
+    
+    # A retry with the same Idempotency-Key gets the first response back
+    return await run_idempotent(
+        db,
+        idempotency_key,
+        f"payments:{current_user['user_id']}",
+        payment.dict(),
+        lambda: insert_payment(db, payment, current_user)
+    )
+
+@router.post("/reconcile")
+async def reconcile_payments(
+    request: Request,
+    file: UploadFile = File(...),
+    dry_run: bool = False,
+    admin: dict = Depends(require_admin)
+):
+    db = request.app.state.db
+    
+    # Settle payments in bulk from a bank/PSP CSV (transaction_id, amount
+    # and optionally status), instead of one PUT per payment
+    try:
+        return await reconcile_file(db, file.file, dry_run=dry_run, actor=admin["user_id"])
+    except (ReconciliationError, UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid settlement file: {e}")
+
+@router.post("/status")
+async def bulk_update_payment_status(body: PaymentBulkStatusUpdate, request: Request, admin: dict = Depends(require_admin)):
+    db = request.app.state.db
+    
+    if not any(target == body.status for targets in PAYMENT_TRANSITIONS.values() for target in targets):
+        raise HTTPException(status_code=400, detail="Invalid status")
+    if body.ids is None and not (body.from_status or body.method or body.created_after or body.created_before):
+        raise HTTPException(status_code=400, detail="Provide ids or filters")
+    if body.ids is not None and len(body.ids) > BULK_STATUS_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_STATUS_LIMIT} ids per request")
+    
+    query, invalid = build_query(body.ids, body.from_status, body.created_after, body.created_before)
+    if body.method:
+        query["method"] = body.method
+    results, changed, has_more = await apply_status_transition(
+        db.payments, query, body.status, PAYMENT_TRANSITIONS, {"booking_id": 1}, body.ids
+    )
+    results.update(invalid)
+    
+    for doc in changed:
+        notify_change("payments", "update", doc["_id"], {**doc, "status": body.status})
+        await audit_log.record("payment", doc["_id"], "status_changed", admin["user_id"], {"from": doc["status"], "to": body.status})
+    
+    # Completed payments confirm their bookings: one bulk_write for all of them
+    confirmed = []
+    if body.status == "completed" and changed:
+        confirmed = await confirm_paid_bookings(db, [doc["booking_id"] for doc in changed], admin["user_id"])
+        confirmed_set = set(confirmed)
+        for doc in changed:
+            results[str(doc["_id"])]["booking_confirmed"] = str(doc["booking_id"]) in confirmed_set
+    
+    return {
+        "status": body.status,
+        "updated": len(changed),
+        "bookings_confirmed": len(confirmed),
+        # More than BULK_STATUS_LIMIT matched; repeat the request for the rest
+        "has_more": has_more,
+        "results": list(results.values())
+    }
+
 @router.put("/{payment_id}", response_model=PaymentResponse)
 async def update_payment(payment_id: str, payment: PaymentUpdate, request: Request, admin: dict = Depends(require_admin)):
     db = request.app.state.db
@@ -123,30 +228,43 @@ async def update_payment(payment_id: str, payment: PaymentUpdate, request: Reque
     except:
         raise HTTPException(status_code=400, detail="Invalid payment ID")
     
-    # Get existing payment
-    existing = await db.payments.find_one({"_id": obj_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Payment not found")
-    
     # Update only provided fields
     update_data = {k: v for k, v in payment.dict().items() if v is not None}
     update_data["updated_at"] = datetime.utcnow()
     
-    await db.payments.update_one({"_id": obj_id}, {"$set": update_data})
+    # Update and get the updated payment in one round trip
+    updated = await db.payments.find_one_and_update(
+        {"_id": obj_id},
+        {"$set": update_data},
+        projection=PAYMENT_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    
+    notify_change("payments", "update", obj_id, updated)
+    await audit_log.record("payment", obj_id, "updated", admin["user_id"], update_data)
     
-    # If payment is confirmed, update booking status
+    # If payment is confirmed, update booking status. Only a pending booking:
+    # one the sweeper expired meanwhile has already released its stock.
     if payment.status == "completed":
-        await db.bookings.update_one(
-            {"_id": ObjectId(existing["booking_id"])},
-            {"$set": {"status": "confirmed"}}
+        booking = await db.bookings.find_one_and_update(
+            {"_id": ObjectId(updated["booking_id"]), "status": "pending"},
+            {"$set": {"status": "confirmed", "updated_at": datetime.utcnow()}},
+            projection={"user_id": 1, "status": 1},
+            return_document=ReturnDocument.AFTER
         )
-    
-    # Get updated payment
-    updated = await db.payments.find_one({"_id": obj_id})
+        if booking:
+            notify_change("bookings", "update", booking["_id"], booking)
+            await audit_log.record("booking", booking["_id"], "status_changed", admin["user_id"], {
+                "from": "pending",
+                "to": "confirmed",
+                "payment_id": payment_id
+            })
     
     return {
         "id": str(updated["_id"]),
-        "booking_id": updated["booking_id"],
+        "booking_id": str(updated["booking_id"]),
         "amount": updated["amount"],
         "method": updated["method"],
         "status": updated["status"],
@@ -169,4 +287,7 @@ async def delete_payment(payment_id: str, request: Request, admin: dict = Depend
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Payment not found")
     
+    notify_change("payments", "delete", obj_id)
+    await audit_log.record("payment", obj_id, "deleted", admin["user_id"])
+    
     return {"message": "Payment deleted successfully"}
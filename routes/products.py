@@ -1,31 +1,195 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
-from models.product import ProductCreate, ProductUpdate, ProductResponse
+from fastapi import APIRouter, HTTPException, Depends, Request, Query
+from models.product import ProductCreate, ProductUpdate, ProductResponse, ProductSearchResponse, StockShardsUpdate
 from utils.auth_utils import get_current_user, require_admin
+from utils.audit import audit_log
+from utils.cache import TTLCache, register_cache
+from utils.change_stream import notify_change
+from utils.cleanup import enqueue_cleanup
+from utils.single_flight import single_flight, flight_key
+from utils.stock_counters import (
+    MAX_STOCK_SHARDS,
+    adjust_sharded_stock,
+    disable_sharding,
+    enable_sharding,
+    in_stock_query,
+    live_stock,
+    with_live_stock
+)
 from bson import ObjectId
+from pymongo import ReturnDocument
 from datetime import datetime
-from typing import List
+from typing import List, Optional
+import os
 
 router = APIRouter()
 
+# Full catalog, cleared on product/stock writes from any worker
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", 30))
+product_cache = register_cache("products", TTLCache(ttl=PRODUCT_CACHE_TTL))
+
+# Fields needed to build a ProductResponse
+PRODUCT_PROJECTION = {
+    "name": 1,
+    "description": 1,
+    "category": 1,
+    "price": 1,
+    "stock": 1,
+    "image": 1,
+    "status": 1,
+    "stock_shards": 1,
+    "created_at": 1
+}
+
+# Sort options for product search ("relevance" needs a text query)
+SEARCH_SORTS = {
+    "relevance": {"score": -1, "_id": 1},
+    "newest": {"created_at": -1, "_id": 1},
+    "price_asc": {"price": 1, "_id": 1},
+    "price_desc": {"price": -1, "_id": 1},
+    "name": {"name": 1, "_id": 1}
+}
+
+# Lower boundaries of the price bands used for facet counts
+PRICE_BANDS = [0, 50000, 100000, 250000, 500000]
+
 @router.get("/", response_model=List[ProductResponse])
 async def get_products(request: Request, current_user: dict = Depends(get_current_user)):
     db = request.app.state.db
-    products = []
-    
-    async for product in db.products.find():
-        products.append({
-            "id": str(product["_id"]),
-            "name": product["name"],
-            "description": product["description"],
-            "category": product["category"],
-            "price": product["price"],
-            "stock": product["stock"],
-            "image": product.get("image"),
-            "status": product["status"],
-            "created_at": product.get("created_at")
-        })
-    
-    return products
+    
+    # Sharded products get their current stock on top of the cached list
+    products = product_cache.get("all")
+    if products is not None:
+        return await with_live_stock(db, products)
+    
+    async def load_products():
+        products = []
+        async for product in db.products.find():
+            products.append({
+                "id": str(product["_id"]),
+                "name": product["name"],
+                "description": product["description"],
+                "category": product["category"],
+                "price": product["price"],
+                "stock": product["stock"],
+                "image": product.get("image"),
+                "status": product["status"],
+                "stock_shards": product.get("stock_shards"),
+                "created_at": product.get("created_at")
+            })
+        
+        product_cache.set("all", products)
+        return products
+    
+    # Callers missing the cache together share one scan
+    products = await single_flight.do(flight_key(request, "all"), load_products)
+    return await with_live_stock(db, products)
+
+@router.get("/search", response_model=ProductSearchResponse)
+async def search_products(
+    request: Request,
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    status: Optional[str] = None,
+    in_stock: Optional[bool] = None,
+    sort: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: dict = Depends(get_current_user)
+):
+    db = request.app.state.db
+    
+    if sort is None:
+        sort = "relevance" if q else "newest"
+    if sort not in SEARCH_SORTS or (sort == "relevance" and not q):
+        raise HTTPException(status_code=400, detail="Invalid sort option")
+    
+    # Build filters ($text must be part of the first $match stage)
+    match = {}
+    if q:
+        match["$text"] = {"$search": q}
+    if category:
+        match["category"] = category
+    if status:
+        match["status"] = status
+    if min_price is not None or max_price is not None:
+        match["price"] = {}
+        if min_price is not None:
+            match["price"]["$gte"] = min_price
+        if max_price is not None:
+            match["price"]["$lte"] = max_price
+    if in_stock is not None:
+        match.update(await in_stock_query(db, in_stock))
+    
+    pipeline = [{"$match": match}]
+    if q:
+        pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
+    
+    # One round trip: the page, the total and both facets
+    pipeline.append(
+        {"$facet": {
+            "items": [
+                {"$sort": SEARCH_SORTS[sort]},
+                {"$skip": skip},
+                {"$limit": limit}
+            ],
+            "total": [{"$count": "count"}],
+            "categories": [
+                {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}}
+            ],
+            "price_bands": [
+                {"$bucket": {
+                    "groupBy": "$price",
+                    "boundaries": PRICE_BANDS + [float("inf")],
+                    "default": "other",
+                    "output": {"count": {"$sum": 1}}
+                }}
+            ]
+        }}
+    )
+    
+    # Identical concurrent searches share one aggregation
+    result = await single_flight.do(
+        flight_key(request, "all"),
+        lambda: db.products.aggregate(pipeline).to_list(length=1)
+    )
+    facets = result[0]
+    
+    price_bands = []
+    for band in facets["price_bands"]:
+        if band["_id"] == "other":
+            continue
+        index = PRICE_BANDS.index(band["_id"])
+        if index + 1 < len(PRICE_BANDS):
+            label = f"{PRICE_BANDS[index]}-{PRICE_BANDS[index + 1]}"
+        else:
+            label = f"{PRICE_BANDS[index]}+"
+        price_bands.append({"value": label, "count": band["count"]})
+    
+    return {
+        "items": [
+            {
+                "id": str(product["_id"]),
+                "name": product["name"],
+                "description": product["description"],
+                "category": product["category"],
+                "price": product["price"],
+                "stock": await live_stock(db, product),
+                "image": product.get("image"),
+                "status": product["status"],
+                "created_at": product.get("created_at")
+            }
+            for product in facets["items"]
+        ],
+        "total": facets["total"][0]["count"] if facets["total"] else 0,
+        "categories": [
+            {"value": str(c["_id"]), "count": c["count"]}
+            for c in facets["categories"]
+        ],
+        "price_bands": price_bands
+    }
 
 @router.get("/{product_id}", response_model=ProductResponse)
 async def get_product(product_id: str, request: Request, current_user: dict = Depends(get_current_user)):
@@ -45,7 +209,7 @@ async def get_product(product_id: str, request: Request, current_user: dict = De
         "description": product["description"],
         "category": product["category"],
         "price": product["price"],
-        "stock": product["stock"],
+        "stock": await live_stock(db, product),
         "image": product.get("image"),
         "status": product["status"],
         "created_at": product.get("created_at")
@@ -68,6 +232,8 @@ async def create_product(product: ProductCreate, request: Request, admin: dict =
     
     result = await db.products.insert_one(product_doc)
     product_doc["id"] = str(result.inserted_id)
+    notify_change("products", "insert", result.inserted_id, product_doc)
+    await audit_log.record("product", result.inserted_id, "created", admin["user_id"], {"stock": product.stock, "price": product.price})
     
     return {
         "id": str(result.inserted_id),
@@ -90,19 +256,26 @@ async def update_product(product_id: str, product: ProductUpdate, request: Reque
     except:
         raise HTTPException(status_code=400, detail="Invalid product ID")
     
-    # Get existing product
-    existing = await db.products.find_one({"_id": obj_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
     # Update only provided fields
     update_data = {k: v for k, v in product.dict().items() if v is not None}
     update_data["updated_at"] = datetime.utcnow()
     
-    await db.products.update_one({"_id": obj_id}, {"$set": update_data})
+    # A sharded product's stock lives in its shards
+    if "stock" in update_data and await adjust_sharded_stock(db, obj_id, update_data["stock"]):
+        del update_data["stock"]
     
-    # Get updated product
-    updated = await db.products.find_one({"_id": obj_id})
+    # Update and get the updated product in one round trip
+    updated = await db.products.find_one_and_update(
+        {"_id": obj_id},
+        {"$set": update_data},
+        projection=PRODUCT_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    notify_change("products", "update", obj_id, updated)
+    await audit_log.record("product", obj_id, "updated", admin["user_id"], product.dict(exclude_none=True))
     
     return {
         "id": str(updated["_id"]),
@@ -110,12 +283,42 @@ async def update_product(product_id: str, product: ProductUpdate, request: Reque
         "description": updated["description"],
         "category": updated["category"],
         "price": updated["price"],
-        "stock": updated["stock"],
+        "stock": await live_stock(db, updated),
         "image": updated.get("image"),
         "status": updated["status"],
         "created_at": updated.get("created_at")
     }
 
+@router.put("/{product_id}/stock-shards")
+async def set_stock_shards(product_id: str, body: StockShardsUpdate, request: Request, admin: dict = Depends(require_admin)):
+    db = request.app.state.db
+    
+    try:
+        obj_id = ObjectId(product_id)
+    except:
+        raise HTTPException(status_code=400, detail="Invalid product ID")
+    
+    if body.shards > MAX_STOCK_SHARDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_STOCK_SHARDS} stock shards are allowed")
+    
+    # Spread a hot product's stock over several counters (or fold it back)
+    if body.shards:
+        stock = await enable_sharding(db, obj_id, body.shards)
+        if stock is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+    else:
+        stock = await disable_sharding(db, obj_id)
+        if stock is None:
+            product = await db.products.find_one({"_id": obj_id}, {"stock": 1})
+            if not product:
+                raise HTTPException(status_code=404, detail="Product not found")
+            stock = product["stock"]
+    
+    notify_change("products", "update", obj_id, {"stock": stock})
+    await audit_log.record("product", obj_id, "stock_sharding_changed", admin["user_id"], {"shards": body.shards})
+    
+    return {"product_id": product_id, "shards": body.shards, "stock": stock}
+
 @router.delete("/{product_id}")
 async def delete_product(product_id: str, request: Request, admin: dict = Depends(require_admin)):
     db = request.app.state.db
@@ -130,4 +333,11 @@ async def delete_product(product_id: str, request: Request, admin: dict = Depend
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    return {"message": "Product deleted successfully"}
+    await db.stock_shards.delete_many({"product_id": obj_id})
+    notify_change("products", "delete", obj_id)
+    await audit_log.record("product", obj_id, "deleted", admin["user_id"])
+    
+    # Its bookings and payments are cancelled and archived in the background
+    job_id = await enqueue_cleanup(db, "product", product_id)
+    
+    return {"message": "Product deleted successfully", "cleanup_job_id": str(job_id)}
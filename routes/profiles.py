@@ -0,0 +1,21 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from utils.auth_utils import require_admin
+from utils.profiling import list_profiles, find_profile
+import os
+
+router = APIRouter()
+
+@router.get("/")
+async def get_profiles(admin: dict = Depends(require_admin)):
+    # Newest first; profiles are only captured with PROFILING_ENABLED=true
+    return await run_in_threadpool(list_profiles)
+
+@router.get("/{profile_id}")
+async def download_profile(profile_id: str, admin: dict = Depends(require_admin)):
+    path = find_profile(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    return FileResponse(path, filename=os.path.basename(path))
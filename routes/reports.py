@@ -1,33 +1,66 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from utils.access_log import APP_LOGGER
 from utils.auth_utils import require_admin
+from utils.archive import count_with_archive, find_with_archive
+from utils.cache import StaleWhileRevalidateCache
 from datetime import datetime, timedelta
 from bson import ObjectId
+import asyncio
+import logging
+import os
+import time
 
 router = APIRouter()
 
-@router.get("/stats")
-async def get_stats(request: Request, admin: dict = Depends(require_admin)):
-    db = request.app.state.db
-    
-    # Count totals
-    total_users = await db.users.count_documents({"role": "user"})
-    total_products = await db.products.count_documents({})
-    total_bookings = await db.bookings.count_documents({})
-    
-    # Count by status
-    pending_bookings = await db.bookings.count_documents({"status": "pending"})
-    confirmed_bookings = await db.bookings.count_documents({"status": "confirmed"})
-    completed_bookings = await db.bookings.count_documents({"status": "completed"})
-    
-    # Calculate total revenue
-    total_revenue = 0
-    async for payment in db.payments.find({"status": "completed"}):
-        total_revenue += payment.get("amount", 0)
-    
-    # Calculate pending revenue
-    pending_revenue = 0
-    async for payment in db.payments.find({"status": "pending"}):
-        pending_revenue += payment.get("amount", 0)
+logger = logging.getLogger(APP_LOGGER)
+
+# Reports may be up to REPORT_FRESH_TTL + REPORT_STALE_TTL seconds old;
+# stale entries are returned at once and refreshed in the background
+REPORT_FRESH_TTL = float(os.getenv("REPORT_FRESH_TTL", 60))
+REPORT_STALE_TTL = float(os.getenv("REPORT_STALE_TTL", 300))
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", 128))
+report_cache = StaleWhileRevalidateCache("reports", REPORT_FRESH_TTL, REPORT_STALE_TTL, REPORT_CACHE_SIZE)
+
+# Handlers read through app.state.report_db, which prefers secondaries
+# (see utils.db), so report scans stay off the primary serving checkouts
+
+def report_key(name: str) -> tuple:
+    # One cache entry per report. No report takes parameters, so query
+    # strings must not add entries: `?x=1` would miss the cache, rerun the
+    # full scan and push real entries out.
+    return (name,)
+
+async def sum_payments(db, status: str):
+    total = 0
+    async for payment in find_with_archive(db, "payments", {"status": status}, {"amount": 1}):
+        total += payment.get("amount", 0)
+    return total
+
+async def compute_stats(db):
+    # Independent counts and sums run concurrently on the shared pool
+    (
+        total_users,
+        total_products,
+        available_products,
+        unavailable_products,
+        total_bookings,
+        pending_bookings,
+        confirmed_bookings,
+        completed_bookings,
+        total_revenue,
+        pending_revenue
+    ) = await asyncio.gather(
+        db.users.count_documents({"role": "user"}),
+        db.products.count_documents({}),
+        db.products.count_documents({"status": "available"}),
+        db.products.count_documents({"status": "unavailable"}),
+        count_with_archive(db, "bookings", {}),
+        db.bookings.count_documents({"status": "pending"}),
+        db.bookings.count_documents({"status": "confirmed"}),
+        count_with_archive(db, "bookings", {"status": "completed"}),
+        sum_payments(db, "completed"),
+        sum_payments(db, "pending")
+    )
     
     return {
         "users": {
@@ -35,8 +68,8 @@ async def get_stats(request: Request, admin: dict = Depends(require_admin)):
         },
         "products": {
             "total": total_products,
-            "available": await db.products.count_documents({"status": "available"}),
-            "unavailable": await db.products.count_documents({"status": "unavailable"})
+            "available": available_products,
+            "unavailable": unavailable_products
         },
         "bookings": {
             "total": total_bookings,
@@ -51,10 +84,7 @@ async def get_stats(request: Request, admin: dict = Depends(require_admin)):
         }
     }
 
-@router.get("/revenue")
-async def get_revenue_data(request: Request, admin: dict = Depends(require_admin)):
-    db = request.app.state.db
-    
+async def compute_revenue(db):
     # Get revenue for last 12 months
     revenue_data = []
     
@@ -69,11 +99,12 @@ async def get_revenue_data(request: Request, admin: dict = Depends(require_admin
             month_end = month_end.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         
         # Calculate revenue for the month
+        # Older months are read from payments_archive as well once archived
         monthly_revenue = 0
-        async for payment in db.payments.find({
+        async for payment in find_with_archive(db, "payments", {
             "status": "completed",
             "created_at": {"$gte": month_start, "$lt": month_end}
-        }):
+        }, {"amount": 1}, since=month_start):
             monthly_revenue += payment.get("amount", 0)
         
         revenue_data.insert(0, {
@@ -83,10 +114,7 @@ async def get_revenue_data(request: Request, admin: dict = Depends(require_admin
     
     return revenue_data
 
-@router.get("/bookings-trend")
-async def get_bookings_trend(request: Request, admin: dict = Depends(require_admin)):
-    db = request.app.state.db
-    
+async def compute_bookings_trend(db):
     # Get bookings for last 30 days
     trend_data = []
     
@@ -96,9 +124,9 @@ async def get_bookings_trend(request: Request, admin: dict = Depends(require_adm
         day_end = day_start + timedelta(days=1)
         
         # Count bookings for the day
-        daily_bookings = await db.bookings.count_documents({
+        daily_bookings = await count_with_archive(db, "bookings", {
             "created_at": {"$gte": day_start, "$lt": day_end}
-        })
+        }, since=day_start)
         
         trend_data.insert(0, {
             "date": day_start.strftime("%Y-%m-%d"),
@@ -107,15 +135,12 @@ async def get_bookings_trend(request: Request, admin: dict = Depends(require_adm
     
     return trend_data
 
-@router.get("/popular-products")
-async def get_popular_products(request: Request, admin: dict = Depends(require_admin)):
-    db = request.app.state.db
-    
+async def compute_popular_products(db):
     # Aggregate bookings by product
     product_bookings = {}
     
-    async for booking in db.bookings.find():
-        product_id = booking["product_id"]
+    async for booking in find_with_archive(db, "bookings", {}, {"product_id": 1, "quantity": 1}):
+        product_id = str(booking["product_id"])
         if product_id not in product_bookings:
             product_bookings[product_id] = 0
         product_bookings[product_id] += booking.get("quantity", 1)
@@ -139,3 +164,68 @@ async def get_popular_products(request: Request, admin: dict = Depends(require_a
     popular.sort(key=lambda x: x["bookings"], reverse=True)
     
     return popular[:10]  # Return top 10
+
+# Compute functions for the reports
+REPORTS = {
+    "stats": compute_stats,
+    "revenue": compute_revenue,
+    "bookings-trend": compute_bookings_trend,
+    "popular-products": compute_popular_products
+}
+
+async def warm_report_cache(db):
+    for name, compute in REPORTS.items():
+        try:
+            await report_cache.refresh(report_key(name), lambda compute=compute: compute(db))
+        except Exception as e:
+            logger.warning("Could not warm %s report: %s", name, e)
+
+@router.get("/stats")
+async def get_stats(request: Request, admin: dict = Depends(require_admin)):
+    db = request.app.state.report_db
+    return await report_cache.get_or_compute(report_key("stats"), lambda: compute_stats(db))
+
+@router.get("/revenue")
+async def get_revenue_data(request: Request, admin: dict = Depends(require_admin)):
+    db = request.app.state.report_db
+    return await report_cache.get_or_compute(report_key("revenue"), lambda: compute_revenue(db))
+
+@router.get("/bookings-trend")
+async def get_bookings_trend(request: Request, admin: dict = Depends(require_admin)):
+    db = request.app.state.report_db
+    return await report_cache.get_or_compute(report_key("bookings-trend"), lambda: compute_bookings_trend(db))
+
+@router.get("/popular-products")
+async def get_popular_products(request: Request, admin: dict = Depends(require_admin)):
+    db = request.app.state.report_db
+    return await report_cache.get_or_compute(report_key("popular-products"), lambda: compute_popular_products(db))
+
+@router.get("/dashboard")
+async def get_dashboard(request: Request, response: Response, admin: dict = Depends(require_admin)):
+    db = request.app.state.report_db
+    
+    # All four reports in one request, computed concurrently
+    async def timed(name, compute):
+        start = time.perf_counter()
+        value = await report_cache.get_or_compute(report_key(name), lambda: compute(db))
+        return value, (time.perf_counter() - start) * 1000
+    
+    results = await asyncio.gather(*(timed(name, compute) for name, compute in REPORTS.items()))
+    
+    response.headers["Server-Timing"] = ", ".join(
+        f"{name};dur={duration:.1f}" for name, (_, duration) in zip(REPORTS, results)
+    )
+    return {name.replace("-", "_"): value for name, (value, _) in zip(REPORTS, results)}
+
+@router.post("/refresh")
+async def refresh_reports(request: Request, admin: dict = Depends(require_admin)):
+    db = request.app.state.report_db
+    
+    # Rebuild every cached report, plus any not cached yet
+    refreshed = await report_cache.refresh_all()
+    for name, compute in REPORTS.items():
+        key = report_key(name)
+        if key not in refreshed:
+            await report_cache.refresh(key, lambda compute=compute: compute(db))
+    
+    return {"message": "Reports refreshed", "entries": len(report_cache)}
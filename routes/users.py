@@ -1,12 +1,25 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
 from models.user import UserResponse, UserUpdate
 from utils.auth_utils import require_admin, hash_password
+from utils.audit import audit_log
+from utils.change_stream import notify_change
+from utils.cleanup import enqueue_cleanup
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
 from typing import List
 
 router = APIRouter()
 
+# Fields needed to build a UserResponse (never the password hash)
+USER_PROJECTION = {
+    "email": 1,
+    "name": 1,
+    "role": 1,
+    "created_at": 1
+}
+
 @router.get("/", response_model=List[UserResponse])
 async def get_users(request: Request, admin: dict = Depends(require_admin)):
     db = request.app.state.db
@@ -52,25 +65,28 @@ async def update_user(user_id: str, user: UserUpdate, request: Request, admin: d
     except:
         raise HTTPException(status_code=400, detail="Invalid user ID")
     
-    # Get existing user
-    existing = await db.users.find_one({"_id": obj_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Check if email is being changed and if it's already taken
-    if user.email and user.email != existing["email"]:
-        email_taken = await db.users.find_one({"email": user.email})
-        if email_taken:
-            raise HTTPException(status_code=400, detail="Email already taken")
-    
     # Update only provided fields
     update_data = {k: v for k, v in user.dict().items() if v is not None}
     update_data["updated_at"] = datetime.utcnow()
     
-    await db.users.update_one({"_id": obj_id}, {"$set": update_data})
+    # Update and get the updated user in one round trip; a taken email
+    # is caught by the unique index on users.email
+    try:
+        updated = await db.users.find_one_and_update(
+            {"_id": obj_id},
+            {"$set": update_data},
+            projection=USER_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already taken")
+    
+    if not updated:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    notify_change("users", "update", obj_id, updated)
     
-    # Get updated user
-    updated = await db.users.find_one({"_id": obj_id})
+    await audit_log.record("user", obj_id, "updated", admin["user_id"], update_data)
     
     return {
         "id": str(updated["_id"]),
@@ -98,4 +114,10 @@ async def delete_user(user_id: str, request: Request, admin: dict = Depends(requ
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return {"message": "User deleted successfully"}
+    notify_change("users", "delete", obj_id)
+    await audit_log.record("user", obj_id, "deleted", admin["user_id"])
+    
+    # Their bookings are cancelled (stock restored) and archived in the background
+    job_id = await enqueue_cleanup(db, "user", user_id)
+    
+    return {"message": "User deleted successfully", "cleanup_job_id": str(job_id)}
@@ -0,0 +1,135 @@
+# Requests/sec and latency of one endpoint on a running server, over
+# keep-alive connections, using only the standard library:
+#
+#   python -m scripts.bench_http http://localhost:8001/api/products/ [--connections 64] [--duration 30]
+#       [--header "Authorization: Bearer <token>"]
+#
+# To compare launchers, run the same command against `uvicorn server:app
+# --port 8001` and against `gunicorn server:app -c gunicorn_conf.py`.
+# scripts/load_test_auth.py drives it for POST requests.
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+class Connection:
+    # One HTTP/1.1 keep-alive connection; responses need a Content-Length
+
+    def __init__(self, url: str, headers: dict, method: str = "GET", body: bytes = b""):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {parts.netloc}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        self.head = "\r\n".join(lines)
+        self.body = body
+        self.reader = None
+        self.writer = None
+
+    def encode(self, extra_headers: dict = None, body: bytes = None) -> bytes:
+        head = self.head
+        for name, value in (extra_headers or {}).items():
+            head += f"\r\n{name}: {value}"
+        body = self.body if body is None else body
+        if body:
+            head += f"\r\nContent-Length: {len(body)}"
+        return (head + "\r\n\r\n").encode() + body
+
+    async def send(self, extra_headers: dict = None, body: bytes = None) -> int:
+        try:
+            return await self._send(extra_headers, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # The server closed the connection (e.g. a worker recycled by
+            # max_requests); reconnect on the next request
+            self.close()
+            self.writer = None
+            raise
+
+    async def _send(self, extra_headers: dict = None, body: bytes = None) -> int:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(self.encode(extra_headers, body))
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        length = 0
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        await self.reader.readexactly(length)
+        return int(status_line.split()[1])
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+async def bench(url: str, connections: int, duration: float, headers: dict = None,
+                method: str = "GET", body: bytes = b"", vary=None) -> dict:
+    # vary, if given, is called before every request and returns (headers,
+    # body) for that request only, e.g. a different X-Forwarded-For or email
+    latencies = []
+    statuses = {}
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        conn = Connection(url, headers or {}, method, body)
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    status = await conn.send(*(vary() if vary else ()))
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            conn.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) if latencies else 0,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] if latencies else 0,
+        "statuses": statuses,
+        "errors": errors
+    }
+
+def format_result(result: dict) -> str:
+    return (
+        f"{result['requests']} requests, {result['rps']:.0f} req/s, "
+        f"p50 {result['p50_ms']:.1f}ms, p99 {result['p99_ms']:.1f}ms, statuses {result['statuses']}, "
+        f"connection errors {result['errors']}"
+    )
+
+def parse_headers(values) -> dict:
+    headers = {}
+    for value in values or []:
+        name, _, content = value.partition(":")
+        headers[name.strip()] = content.strip()
+    return headers
+
+async def main():
+    parser = argparse.ArgumentParser(description="Requests/sec and latency of one endpoint")
+    parser.add_argument("url")
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--header", action="append", help="Extra request header, e.g. 'Authorization: Bearer ...'")
+    args = parser.parse_args()
+
+    result = await bench(args.url, args.connections, args.duration, parse_headers(args.header))
+    print(f"✅ {format_result(result)}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+# Catalog latency while /api/auth/login is flooded, to check that the auth
+# rate limits and the password hashing cap keep bcrypt work from starving
+# other routes. Run against a server you own (staging, not production):
+#
+#   python -m scripts.load_test_auth http://localhost:8001 --token <jwt> --email victim@example.com
+#       [--spread-emails "user{}@example.com" --spread-count 200] [--duration 15]
+#
+# Phases, each measuring GET /api/products/ at the same time:
+#   baseline     no login traffic
+#   single-ip    wrong passwords for --email from one client (expect 429s)
+#   many-ips     wrong passwords from a new X-Forwarded-For address per request
+#                (needs TRUST_PROXY_HEADERS=true), for existing accounts
+#                (--spread-emails) so most attempts reach bcrypt
+# Finally the real password for --email is tried from a fresh address.
+import argparse
+import asyncio
+import itertools
+import json
+import random
+from scripts.bench_http import Connection, bench, format_result
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+def login_body(email: str, password: str) -> bytes:
+    return json.dumps({"email": email, "password": password}).encode()
+
+def random_ip() -> str:
+    return f"10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}"
+
+async def phase(name: str, args, login_load=None):
+    catalog = bench(
+        f"{args.url}/api/products/", args.connections, args.duration,
+        {"Authorization": f"Bearer {args.token}"}
+    )
+    if login_load is None:
+        results = [await catalog]
+    else:
+        results = await asyncio.gather(catalog, login_load)
+    print(f"== {name}")
+    print(f"   catalog: {format_result(results[0])}")
+    if len(results) > 1:
+        print(f"   login:   {format_result(results[1])}")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Catalog latency under a login flood")
+    parser.add_argument("url", help="Base URL, e.g. http://localhost:8001")
+    parser.add_argument("--token", required=True, help="Any valid JWT, for the catalog requests")
+    parser.add_argument("--email", required=True, help="Existing account targeted by the single-IP flood")
+    parser.add_argument("--password", help="Its real password, to check it can still log in afterwards")
+    parser.add_argument("--spread-emails", help="Pattern of existing accounts for the many-IPs flood, e.g. 'user{}@example.com'")
+    parser.add_argument("--spread-count", type=int, default=100)
+    parser.add_argument("--connections", type=int, default=16, help="Per load (catalog and login)")
+    parser.add_argument("--duration", type=float, default=15)
+    args = parser.parse_args()
+    args.url = args.url.rstrip("/")
+    login_url = f"{args.url}/api/auth/login"
+
+    await phase("baseline", args)
+
+    await phase("single-ip", args, bench(
+        login_url, args.connections, args.duration, JSON_HEADERS, "POST",
+        login_body(args.email, "wrong-password")
+    ))
+
+    if args.spread_emails:
+        emails = itertools.cycle([args.spread_emails.format(i) for i in range(args.spread_count)])
+    else:
+        emails = itertools.repeat(args.email)
+    await phase("many-ips", args, bench(
+        login_url, args.connections, args.duration, JSON_HEADERS, "POST",
+        vary=lambda: ({"X-Forwarded-For": random_ip()}, login_body(next(emails), "wrong-password"))
+    ))
+
+    if args.password:
+        conn = Connection(login_url, JSON_HEADERS, "POST", login_body(args.email, args.password))
+        try:
+            status = await conn.send({"X-Forwarded-For": random_ip()})
+        finally:
+            conn.close()
+        print(f"== real password for {args.email} from a fresh address: {status}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
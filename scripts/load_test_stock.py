@@ -0,0 +1,71 @@
+# Compares booking reservation throughput on one hot product with a single
+# products.stock counter against the same product with sharded counters
+# (utils.stock_counters). Uses a scratch database that is dropped afterwards.
+#
+#   python -m scripts.load_test_stock [--stock 20000] [--concurrency 500] [--shards 1 8 32]
+#
+# Run it against the same kind of deployment as production (a replica set);
+# contention on a standalone laptop server looks very different.
+import argparse
+import asyncio
+import time
+from bson import ObjectId
+from dotenv import load_dotenv
+from utils.db import connect
+from utils.stock_counters import enable_sharding, reserve_stock, sum_shards
+
+load_dotenv()
+
+SCRATCH_DB = "outdoorcamp_loadtest"
+
+async def run(db, stock: int, concurrency: int, shards: int):
+    product_id = ObjectId()
+    await db.products.insert_one({"_id": product_id, "name": "Load test", "stock": stock, "status": "available"})
+    if shards > 1:
+        await enable_sharding(db, product_id, shards)
+    product = await db.products.find_one({"_id": product_id})
+
+    reserved = 0
+    rejected = 0
+
+    async def worker():
+        nonlocal reserved, rejected
+        # Keep booking one item until the shards run dry
+        while True:
+            if await reserve_stock(db, product, 1):
+                reserved += 1
+            else:
+                rejected += 1
+                return
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    remaining = await sum_shards(db, product_id) if shards > 1 else (await db.products.find_one({"_id": product_id}))["stock"]
+    label = "single counter" if shards <= 1 else f"{shards} shards"
+    print(
+        f"{label:>16}: {reserved} reserved in {elapsed:.2f}s "
+        f"({reserved / elapsed:.0f}/s), {rejected} rejected, {remaining} left"
+    )
+    if reserved + remaining != stock:
+        print(f"⚠️ Stock mismatch: {reserved} + {remaining} != {stock}")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Reservation throughput: single vs sharded stock counters")
+    parser.add_argument("--stock", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    client = connect("default")
+    db = client[SCRATCH_DB]
+    try:
+        for shards in args.shards:
+            await run(db, args.stock, args.concurrency, shards)
+    finally:
+        await client.drop_database(SCRATCH_DB)
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,179 @@
+# Converts string references and free-form dates to ObjectIds and BSON dates:
+#
+#   bookings.user_id, bookings.product_id  -> ObjectId
+#   bookings.start_date, bookings.end_date -> datetime
+#   payments.booking_id                    -> ObjectId
+#
+# Run with:
+#
+#   python -m scripts.migrate_typed_storage [--batch-size 500] [--dry-run]
+#
+# Documents are processed in _id order and progress is checkpointed in the
+# `migrations` collection after every batch, so an interrupted run picks up
+# where it stopped. Each write is guarded on the old value, so documents
+# changed by the API meanwhile are left alone and running it twice is safe.
+# Set TYPED_STORAGE=true once it has finished so new documents are typed too.
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+from utils.db import DB_NAME, connect
+from utils.ids import parse_date, ref_query
+
+load_dotenv()
+
+# Timed runs of the date-range query in the before/after report
+BENCH_RUNS = 20
+
+REF_FIELDS = {
+    "bookings": ["user_id", "product_id"],
+    "payments": ["booking_id"]
+}
+DATE_FIELDS = {
+    "bookings": ["start_date", "end_date"],
+    "payments": []
+}
+
+def to_object_id(value):
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+def converted_fields(collection: str, doc: dict) -> dict:
+    changes = {}
+    for field in REF_FIELDS[collection]:
+        value = doc.get(field)
+        if isinstance(value, str) and to_object_id(value) is not None:
+            changes[field] = to_object_id(value)
+    for field in DATE_FIELDS[collection]:
+        value = doc.get(field)
+        if isinstance(value, str) and isinstance(parse_date(value), datetime):
+            changes[field] = parse_date(value)
+    return changes
+
+async def migrate_collection(db, collection: str, batch_size: int, dry_run: bool):
+    checkpoint_id = f"typed_storage:{collection}"
+    checkpoint = await db.migrations.find_one({"_id": checkpoint_id}) or {}
+    last_id = checkpoint.get("last_id")
+    converted = checkpoint.get("converted", 0)
+    skipped = checkpoint.get("skipped", 0)
+    fields = REF_FIELDS[collection] + DATE_FIELDS[collection]
+    projection = {field: 1 for field in fields}
+
+    if last_id is not None:
+        print(f"↪️  Resuming {collection} after {last_id}")
+
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        docs = await db[collection].find(query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+
+        operations = []
+        for doc in docs:
+            changes = converted_fields(collection, doc)
+            if changes:
+                # Only rewrite values nobody has touched since we read them
+                guard = {"_id": doc["_id"], **{field: doc[field] for field in changes}}
+                operations.append(UpdateOne(guard, {"$set": changes}))
+            elif any(isinstance(doc.get(field), str) for field in fields):
+                # Unparseable leftovers stay as they are; reads accept both
+                skipped += 1
+
+        if operations and not dry_run:
+            result = await db[collection].bulk_write(operations, ordered=False)
+            converted += result.modified_count
+        else:
+            converted += len(operations)
+
+        last_id = docs[-1]["_id"]
+        if not dry_run:
+            await db.migrations.update_one(
+                {"_id": checkpoint_id},
+                {"$set": {
+                    "last_id": last_id,
+                    "converted": converted,
+                    "skipped": skipped,
+                    "updated_at": datetime.utcnow()
+                }},
+                upsert=True
+            )
+        print(f"   {collection}: {converted} converted, {skipped} skipped (up to {last_id})")
+
+    if not dry_run:
+        await db.migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"completed_at": datetime.utcnow()}}
+        )
+    print(f"✅ {collection}: {converted} converted, {skipped} skipped")
+
+def plan_stages(plan: dict) -> list:
+    # Stage names of the winning plan, outermost first (e.g. FETCH, IXSCAN)
+    stages = []
+    stage = plan.get("queryPlanner", {}).get("winningPlan", {})
+    # Slot-based engine plans (MongoDB 7+) nest the classic tree one level down
+    stage = stage.get("queryPlan", stage)
+    while stage:
+        stages.append(stage.get("stage"))
+        stage = stage.get("inputStage")
+    return stages
+
+async def report(db, label: str):
+    # Index sizes plus the latency of a 30-day date-range query for one
+    # product, which the (product_id, start_date) index serves once dates
+    # are BSON dates (string dates never match a datetime range)
+    print(f"📊 {label}")
+    for collection in REF_FIELDS:
+        stats = await db.command("collStats", collection)
+        print(f"   {collection}: totalIndexSize={stats.get('totalIndexSize', 0)} indexSizes={stats.get('indexSizes', {})}")
+
+    sample = await db.bookings.find_one({}, {"product_id": 1})
+    if sample is None:
+        print("   no bookings to query")
+        return
+    since = datetime.utcnow() - timedelta(days=30)
+    query = {
+        "product_id": ref_query(sample["product_id"]),
+        "start_date": {"$gte": since, "$lt": since + timedelta(days=30)}
+    }
+
+    timings = []
+    for _ in range(BENCH_RUNS):
+        start = time.perf_counter()
+        matched = len(await db.bookings.find(query, {"_id": 1}).to_list(None))
+        timings.append((time.perf_counter() - start) * 1000)
+    plan = await db.bookings.find(query, {"_id": 1}).explain()
+    examined = plan.get("executionStats", {}).get("totalDocsExamined")
+    print(
+        f"   bookings date-range query: {matched} matched, median {statistics.median(timings):.1f}ms "
+        f"over {BENCH_RUNS} runs, plan {' > '.join(plan_stages(plan))}, {examined} docs examined"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description="Convert string references and dates to typed BSON values")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Count what would change without writing")
+    parser.add_argument("--restart", action="store_true", help="Ignore saved checkpoints and start from the beginning")
+    args = parser.parse_args()
+
+    client = connect("default")
+    db = client[DB_NAME]
+    try:
+        if args.restart and not args.dry_run:
+            await db.migrations.delete_many({"_id": {"$in": [f"typed_storage:{c}" for c in REF_FIELDS]}})
+
+        await report(db, "Before")
+        for collection in REF_FIELDS:
+            await migrate_collection(db, collection, args.batch_size, args.dry_run)
+        await report(db, "After")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
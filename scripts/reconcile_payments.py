@@ -0,0 +1,40 @@
+# Reconciles payments against a bank/PSP settlement file from the command
+# line, the same way POST /api/payments/reconcile does:
+#
+#   python -m scripts.reconcile_payments settlement.csv [--batch-size 1000] [--dry-run]
+#
+# The CSV needs `transaction_id` and `amount` columns; an optional `status`
+# column marks rejected transfers ("failed"). The report is printed as JSON.
+import argparse
+import asyncio
+import json
+import time
+from dotenv import load_dotenv
+from utils.audit import audit_log
+from utils.db import DB_NAME, connect
+from utils.reconciliation import RECONCILE_BATCH_SIZE, reconcile_file
+
+load_dotenv()
+
+async def main():
+    parser = argparse.ArgumentParser(description="Reconcile payments against a settlement CSV")
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=RECONCILE_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    client = connect("default")
+    db = client[DB_NAME]
+    audit_log.start(db)
+    try:
+        start = time.perf_counter()
+        with open(args.path, "rb") as f:
+            report = await reconcile_file(db, f, args.batch_size, args.dry_run)
+        print(json.dumps(report, indent=2, default=str))
+        print(f"✅ {report['rows']} rows in {time.perf_counter() - start:.1f}s")
+    finally:
+        await audit_log.stop()
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,7 +1,10 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi.concurrency import run_in_threadpool
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
 from contextlib import asynccontextmanager
+import asyncio
+import logging
 import os
 from dotenv import load_dotenv
 
@@ -11,46 +14,166 @@ from routes.products import router as products_router
 from routes.bookings import router as bookings_router
 from routes.payments import router as payments_router
 from routes.users import router as users_router
-from routes.reports import router as reports_router
+from routes.reports import router as reports_router, warm_report_cache
+from routes.events import router as events_router
+from routes.jobs import router as jobs_router
+from routes.audit import router as audit_router
+from routes.profiles import router as profiles_router
+from utils.change_stream import ChangeStreamListener
+from utils.auth_utils import BCRYPT_TARGET_MS, calibrate_bcrypt_rounds, set_bcrypt_rounds, require_admin
+from utils.load_shedding import LoadSheddingMiddleware
+from utils.access_log import APP_LOGGER, AccessLogMiddleware, setup_logging, stop_logging
+from utils.profiling import PROFILING_ENABLED, ProfilingMiddleware
+from utils.deadline import DeadlineMiddleware, timeout_handler
+from utils.idempotency import IDEMPOTENCY_TTL_SECONDS
+from utils.sweeper import SWEEPER_ENABLED, run_sweeper
+from utils.stock_counters import run_stock_rebalancer
+from utils.archive import ARCHIVER_ENABLED, run_archiver
+from utils.cleanup import run_cleanup_worker
+from utils.audit import audit_log
+from utils.db import DB_NAME, connect
+from utils import metrics
 
 load_dotenv()
 
-# Database client
+logger = logging.getLogger(APP_LOGGER)
+
+# Database clients
 db_client = None
 db = None
+report_client = None
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Startup
-    global db_client, db
-    db_client = AsyncIOMotorClient(os.getenv('MONGO_URI'))
-    db = db_client.outdoorcamp
-    app.state.db = db
-    print("✅ Connected to MongoDB")
+async def create_payment_booking_index(db):
+    # One payment per booking, enforced by the index instead of a read in create_payment
+    try:
+        await db.payments.create_index("booking_id", unique=True)
+        return
+    except OperationFailure as e:
+        if e.code in (85, 86):
+            # Replace the old non-unique index of the same name
+            await db.payments.drop_index("booking_id_1")
+            try:
+                await db.payments.create_index("booking_id", unique=True)
+                return
+            except OperationFailure as e2:
+                e = e2
+        if e.code != 11000:
+            raise
+    
+    logger.warning("Duplicate payments exist, payments.booking_id index left non-unique")
+    await db.payments.create_index("booking_id")
+
+async def bootstrap(db):
+    # One-time startup work; safe to run concurrently from several workers
+    
+    # Pick the bcrypt cost for this hardware
+    if BCRYPT_TARGET_MS:
+        rounds = await run_in_threadpool(calibrate_bcrypt_rounds, float(BCRYPT_TARGET_MS))
+        set_bcrypt_rounds(rounds)
+        logger.info("bcrypt cost calibrated to %d rounds", rounds)
     
     # Create indexes
     await db.users.create_index("email", unique=True)
     await db.products.create_index("name")
+    await db.products.create_index([("name", "text"), ("description", "text")], name="products_text")
+    await db.products.create_index([("category", 1), ("price", 1)])
+    await db.products.create_index([("status", 1), ("price", 1)])
+    await db.products.create_index([("created_at", -1)])
+    # Sharded products, for in_stock searches and the rebalancer
+    await db.products.create_index("stock_shards", sparse=True)
     await db.bookings.create_index("user_id")
-    await db.payments.create_index("booking_id")
+    await db.bookings.create_index([("status", 1), ("created_at", 1)])
+    await create_payment_booking_index(db)
+    
+    # Idempotency keys expire on their own
+    await db.payments.create_index("transaction_id")
+    await db.idempotency_keys.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS)
+    await db.stock_shards.create_index("product_id")
+    await db.bookings_archive.create_index("user_id")
+    await db.bookings_archive.create_index("created_at")
+    await db.payments_archive.create_index("booking_id")
+    await db.payments_archive.create_index([("status", 1), ("created_at", 1)])
+    await db.bookings_archive.create_index("archived_early", sparse=True)
+    await db.payments_archive.create_index("archived_early", sparse=True)
+    # A product's bookings, optionally in a date range (also serves the
+    # product_id-only lookups of cleanup jobs)
+    await db.bookings.create_index([("product_id", 1), ("start_date", 1)])
+    await db.cleanup_jobs.create_index([("status", 1), ("created_at", 1)])
+    await db.audit_log.create_index([("entity_id", 1), ("ts", -1)])
     
     # Create default admin if not exists
     admin = await db.users.find_one({"email": "admin@outdoorcamp.id"})
     if not admin:
         from utils.auth_utils import hash_password
-        await db.users.insert_one({
-            "email": "admin@outdoorcamp.id",
-            "name": "Admin",
-            "password": hash_password("password123"),
-            "role": "admin"
-        })
-        print("✅ Default admin created")
+        try:
+            await db.users.insert_one({
+                "email": "admin@outdoorcamp.id",
+                "name": "Admin",
+                "password": hash_password("password123"),
+                "role": "admin"
+            })
+            logger.info("Default admin created")
+        except DuplicateKeyError:
+            # Another worker created it first
+            pass
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup
+    global db_client, db, report_client
+    # Logs are written by a background thread so the event loop never blocks on stdout
+    setup_logging()
+    db_client = connect("default")
+    db = db_client[DB_NAME]
+    app.state.db = db
+    
+    # Report scans get their own pool and may read from secondaries
+    report_client = connect("reports")
+    app.state.report_db = report_client[DB_NAME]
+    logger.info("Connected to MongoDB")
+    
+    # The production launcher (gunicorn_conf.py) bootstraps once before forking workers
+    if os.getenv("SKIP_BOOTSTRAP") != "1":
+        await bootstrap(db)
+    
+    # Clear local caches when other workers write
+    change_listener = ChangeStreamListener(db)
+    change_listener.start()
+    app.state.change_listener = change_listener
+    
+    # Batch audit entries into insert_many calls off the request path
+    audit_log.start(db)
+    
+    # Fill the report cache without holding up startup
+    warm_task = asyncio.create_task(warm_report_cache(app.state.report_db))
+    
+    # Expire unpaid pending bookings (one worker at a time, see utils.leader)
+    background_tasks = [warm_task]
+    if SWEEPER_ENABLED:
+        background_tasks.append(asyncio.create_task(run_sweeper(db)))
+    
+    # Even out sharded stock counters (also one worker at a time)
+    background_tasks.append(asyncio.create_task(run_stock_rebalancer(db)))
+    
+    # Move old finished bookings and their payments to the archive collections
+    if ARCHIVER_ENABLED:
+        background_tasks.append(asyncio.create_task(run_archiver(db)))
+    
+    # Cancel and archive the bookings of deleted products and users
+    background_tasks.append(asyncio.create_task(run_cleanup_worker(db)))
     
     yield
     
     # Shutdown
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await change_listener.stop()
+    await audit_log.stop()
+    report_client.close()
     db_client.close()
-    print("❌ Disconnected from MongoDB")
+    logger.info("Disconnected from MongoDB")
+    stop_logging()
 
 app = FastAPI(
     title="OutdoorCamp API",
@@ -59,6 +182,20 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Innermost, so a profile covers the handler rather than queueing time.
+# Not installed at all unless enabled.
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# Per-route concurrency limits (added first so CORS headers wrap its 503s)
+app.add_middleware(LoadSheddingMiddleware)
+
+# Request deadlines, counted from before any load shedding queue wait
+app.add_middleware(DeadlineMiddleware)
+
+# Database timeouts (past the request deadline or server selection) are 504s
+app.add_exception_handler(PyMongoError, timeout_handler)
+
 # CORS Configuration
 app.add_middleware(
     CORSMiddleware,
@@ -68,6 +205,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so shed (503) and CORS-rejected requests are logged too
+app.add_middleware(AccessLogMiddleware)
+
 # Include routers
 app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(products_router, prefix="/api/products", tags=["Products"])
@@ -75,6 +215,10 @@ app.include_router(bookings_router, prefix="/api/bookings", tags=["Bookings"])
 app.include_router(payments_router, prefix="/api/payments", tags=["Payments"])
 app.include_router(users_router, prefix="/api/users", tags=["Users"])
 app.include_router(reports_router, prefix="/api/reports", tags=["Reports"])
+app.include_router(events_router, prefix="/api/events", tags=["Events"])
+app.include_router(jobs_router, prefix="/api/jobs", tags=["Jobs"])
+app.include_router(audit_router, prefix="/api/audit", tags=["Audit"])
+app.include_router(profiles_router, prefix="/api/profiles", tags=["Profiles"])
 
 @app.get("/")
 async def root():
@@ -91,6 +235,11 @@ async def health_check():
         "database": "connected" if db is not None else "disconnected"
     }
 
+@app.get("/api/metrics")
+async def get_metrics(admin: dict = Depends(require_admin)):
+    # Metrics of the worker that served this request
+    return metrics.snapshot()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("server:app", host="0.0.0.0", port=8001, reload=True)
@@ -0,0 +1,55 @@
+import os
+
+# Settings are read at import time, so set them before the app is imported
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+# Keep tests off the database configured in .env
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+
+import pytest
+from bson import ObjectId
+from httpx import ASGITransport, AsyncClient
+from mongomock_motor import AsyncMongoMockClient
+from motor.motor_asyncio import AsyncIOMotorClient
+import server
+from utils.auth_utils import create_access_token
+
+# Tests that need transactions or change streams run against a replica set
+# given here (e.g. mongodb://localhost:27017/?replicaSet=rs0), and are
+# skipped without one. Everything else runs on mongomock.
+MONGO_TEST_URI = os.getenv("MONGO_TEST_URI")
+
+def auth_headers(role: str = "user", user_id: str = None) -> dict:
+    token = create_access_token({
+        "user_id": user_id or str(ObjectId()),
+        "email": f"{role}@example.com",
+        "role": role
+    })
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()["outdoorcamp_test"]
+
+@pytest.fixture
+async def replica_db():
+    if not MONGO_TEST_URI:
+        pytest.skip("MONGO_TEST_URI (a replica set) is not set")
+    client = AsyncIOMotorClient(MONGO_TEST_URI)
+    name = f"outdoorcamp_test_{ObjectId()}"
+    try:
+        yield client[name]
+    finally:
+        await client.drop_database(name)
+        client.close()
+
+def make_client(db):
+    # The app without its lifespan: no bootstrap, background jobs or log thread
+    server.app.state.db = db
+    server.app.state.report_db = db
+    return AsyncClient(transport=ASGITransport(app=server.app), base_url="http://test")
+
+@pytest.fixture
+async def client(db):
+    async with make_client(db) as client:
+        yield client
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import queue
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from utils import access_log, metrics
+from utils.access_log import AccessLogMiddleware, DroppingQueueHandler, command_counter, note_user
+
+app = FastAPI()
+app.add_middleware(AccessLogMiddleware)
+
+@app.get("/items/{item_id}")
+async def get_item(item_id: str):
+    note_user("u1")
+    # Motor runs pymongo in executor threads with a copy of the context
+    await asyncio.to_thread(command_counter.started, None)
+    await asyncio.to_thread(command_counter.started, None)
+    return {"id": item_id}
+
+@app.get("/slow")
+async def slow():
+    await asyncio.sleep(0.03)
+    return {}
+
+@app.get("/boom")
+async def boom():
+    raise RuntimeError("boom")
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record.fields)
+
+@pytest.fixture
+def logged(monkeypatch):
+    monkeypatch.setattr(access_log, "ACCESS_LOG_SAMPLE_RATE", 0)
+    monkeypatch.setattr(access_log, "ACCESS_LOG_SLOW_MS", 1000)
+    handler = ListHandler()
+    logger = logging.getLogger(access_log.ACCESS_LOGGER)
+    monkeypatch.setattr(logger, "handlers", [handler])
+    monkeypatch.setattr(logger, "level", logging.INFO)
+    return handler.records
+
+@pytest.fixture
+async def client():
+    transport = ASGITransport(app=app, raise_app_exceptions=False)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+async def test_fast_successful_requests_are_not_logged_at_rate_zero(client, logged):
+    assert (await client.get("/items/1")).status_code == 200
+    assert (await client.get("/missing")).status_code == 404
+    assert logged == []
+
+async def test_errors_are_always_logged(client, logged):
+    assert (await client.get("/boom")).status_code == 500
+    assert logged[0]["status"] == 500
+    assert logged[0]["route"] == "/boom"
+
+async def test_slow_requests_are_always_logged(client, logged, monkeypatch):
+    monkeypatch.setattr(access_log, "ACCESS_LOG_SLOW_MS", 20)
+    await client.get("/slow")
+    await client.get("/items/1")
+    assert [entry["path"] for entry in logged] == ["/slow"]
+    assert logged[0]["latency_ms"] >= 20
+
+async def test_other_requests_are_sampled(client, logged, monkeypatch):
+    monkeypatch.setattr(access_log, "ACCESS_LOG_SAMPLE_RATE", 0.5)
+    monkeypatch.setattr(access_log.random, "random", lambda: 0.6)
+    await client.get("/items/1")
+    assert logged == []
+
+    monkeypatch.setattr(access_log.random, "random", lambda: 0.4)
+    await client.get("/items/1")
+    assert len(logged) == 1
+
+async def test_entries_group_by_route_and_carry_request_details(client, logged, monkeypatch):
+    monkeypatch.setattr(access_log, "ACCESS_LOG_SAMPLE_RATE", 1)
+    await client.get("/items/42")
+    entry = logged[0]
+    assert entry["method"] == "GET"
+    assert entry["route"] == "/items/{item_id}"
+    assert entry["path"] == "/items/42"
+    assert entry["user_id"] == "u1"
+    assert entry["db_calls"] == 2
+
+def test_full_log_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    record = logging.LogRecord("x", logging.INFO, __file__, 1, "m", None, None)
+    before = metrics.snapshot()["counters"].get("logging.dropped", 0)
+    handler.emit(record)
+    handler.emit(record)
+    assert metrics.snapshot()["counters"]["logging.dropped"] == before + 1
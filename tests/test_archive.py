@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+import pytest
+from utils import archive
+from utils.archive import archive_old_records, archived_before, count_with_archive, find_with_archive
+
+@pytest.fixture(autouse=True)
+def no_waiting(monkeypatch):
+    # mongomock has no sessions, and there are no other workers to wait for
+    monkeypatch.setattr(archive, "_use_transactions", False)
+    monkeypatch.setattr(archive, "ARCHIVE_HORIZON_CACHE_SECONDS", 0)
+    archive._horizons.clear()
+
+async def booking(db, status: str, age_days: int):
+    return (await db.bookings.insert_one({
+        "user_id": "u1", "status": status, "created_at": datetime.utcnow() - timedelta(days=age_days)
+    })).inserted_id
+
+async def payment(db, booking_id, age_days: int):
+    return (await db.payments.insert_one({
+        "booking_id": booking_id, "status": "completed", "amount": 100,
+        "created_at": datetime.utcnow() - timedelta(days=age_days)
+    })).inserted_id
+
+async def payment_ids(db, since=None):
+    return {doc["_id"] async for doc in find_with_archive(db, "payments", {"status": "completed"}, since=since)}
+
+async def test_old_finished_bookings_move_with_their_payments(db):
+    old = await booking(db, "completed", 400)
+    old_payment = await payment(db, old, 400)
+    late_payment = await payment(db, old, 1)
+    await booking(db, "pending", 400)
+    recent = await booking(db, "completed", 10)
+    recent_payment = await payment(db, recent, 10)
+
+    assert await archive_old_records(db) == (1, 2)
+    assert await db.bookings_archive.count_documents({}) == 1
+    assert await db.bookings.count_documents({}) == 2
+    assert await db.payments.count_documents({}) == 1
+
+    # The horizon is the cutoff used, not the time of the run
+    horizon = await archived_before(db, "payments")
+    assert horizon == await archived_before(db, "bookings")
+    assert datetime.utcnow() - timedelta(days=361) < horizon < datetime.utcnow() - timedelta(days=359)
+
+    # Recent ranges skip the archive, except for the payment made after the cutoff
+    assert await payment_ids(db, since=datetime.utcnow() - timedelta(days=30)) == {recent_payment, late_payment}
+    assert await payment_ids(db) == {recent_payment, late_payment, old_payment}
+    assert await count_with_archive(db, "bookings", {"user_id": "u1"}, since=datetime.utcnow() - timedelta(days=30)) == 2
+    assert await count_with_archive(db, "bookings", {"user_id": "u1"}) == 3
+
+async def test_nothing_to_archive_leaves_the_horizon(db):
+    await booking(db, "completed", 10)
+
+    assert await archive_old_records(db) == (0, 0)
+    assert await archived_before(db, "payments") is None
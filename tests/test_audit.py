@@ -0,0 +1,171 @@
+import asyncio
+from bson.errors import InvalidDocument
+from pymongo.errors import AutoReconnect
+from utils import audit, metrics
+from utils.audit import AuditLog
+
+class FlakyCollection:
+    # insert_many fails while `down` is set and waits while `gate` is clear
+    def __init__(self):
+        self.batches = []
+        self.down = False
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def insert_many(self, batch, ordered=True):
+        await self.gate.wait()
+        if self.down:
+            raise AutoReconnect("connection refused")
+        for entry in batch:
+            self.check(entry)
+        self.batches.append(list(batch))
+
+    async def insert_one(self, entry):
+        self.check(entry)
+        self.batches.append([entry])
+
+    def check(self, entry):
+        # Like bson: a set can't be encoded
+        if any(isinstance(value, set) for value in entry["data"].values()):
+            raise InvalidDocument("cannot encode object: set()")
+
+class FakeDatabase:
+    def __init__(self):
+        self.audit_log = FlakyCollection()
+
+def dropped() -> int:
+    return metrics.snapshot()["counters"].get("audit.dropped", 0)
+
+async def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+async def test_entries_are_written_in_batches_off_the_request_path(db):
+    log = AuditLog(max_size=100, flush_size=3, flush_seconds=60)
+    log.start(db)
+    for i in range(3):
+        await log.record("booking", f"b{i}", "created", "u1", {"quantity": i})
+
+    # The third entry fills a batch, which is written without waiting for the interval
+    await wait_for(lambda: not log._buffer)
+    entries = await db.audit_log.find({}, {"_id": 0, "ts": 0}).sort("entity_id", 1).to_list(None)
+    assert entries[0] == {"entity": "booking", "entity_id": "b0", "action": "created", "actor": "u1", "data": {"quantity": 0}}
+    assert len(entries) == 3
+    await log.stop()
+
+async def test_small_batches_are_written_after_the_interval(db):
+    log = AuditLog(max_size=100, flush_size=100, flush_seconds=0.05)
+    log.start(db)
+    await log.record("payment", "p1", "updated")
+
+    await wait_for(lambda: not log._buffer)
+    entry = await db.audit_log.find_one({"entity_id": "p1"})
+    # Background jobs record without an actor
+    assert entry["actor"] == audit.SYSTEM_ACTOR
+    await log.stop()
+
+async def test_stop_drains_the_buffer(db):
+    log = AuditLog(max_size=100, flush_size=100, flush_seconds=60)
+    log.start(db)
+    await log.record("user", "u1", "registered")
+    await log.record("user", "u2", "registered")
+
+    await log.stop()
+    assert await db.audit_log.count_documents({}) == 2
+
+async def test_failed_writes_are_retried():
+    fake = FakeDatabase()
+    fake.audit_log.down = True
+    log = AuditLog(max_size=100, flush_size=100, flush_seconds=60)
+    log.db = fake
+
+    await log.record("booking", "b1", "created")
+    await log.flush()
+    assert len(log._buffer) == 1
+
+    fake.audit_log.down = False
+    await log.flush()
+    assert [entry["entity_id"] for entry in fake.audit_log.batches[0]] == ["b1"]
+
+async def test_full_buffer_makes_writers_wait_for_the_next_flush():
+    fake = FakeDatabase()
+    fake.audit_log.gate.clear()
+    log = AuditLog(max_size=2, flush_size=100, flush_seconds=60)
+    log.start(fake)
+    await log.record("booking", "b1", "created")
+    await log.record("booking", "b2", "created")
+
+    # The buffer is full: the writer waits (a flush is started) instead of growing it
+    writer = asyncio.create_task(log.record("booking", "b3", "created"))
+    await asyncio.sleep(0.05)
+    assert not writer.done()
+
+    # Once the database accepts the batch, there is room again
+    fake.audit_log.gate.set()
+    await asyncio.wait_for(writer, 1)
+    assert [entry["entity_id"] for entry in log._buffer] == ["b3"]
+    await log.stop()
+    assert [entry["entity_id"] for batch in fake.audit_log.batches for entry in batch] == ["b1", "b2", "b3"]
+
+async def test_writers_give_up_and_count_the_drop(monkeypatch):
+    monkeypatch.setattr(audit, "AUDIT_MAX_WAIT_SECONDS", 0.05)
+    fake = FakeDatabase()
+    fake.audit_log.gate.clear()
+    log = AuditLog(max_size=1, flush_size=100, flush_seconds=60)
+    log.start(fake)
+    await log.record("booking", "b1", "created")
+
+    before = dropped()
+    await asyncio.wait_for(log.record("booking", "b2", "created"), 1)
+    assert dropped() == before + 1
+
+    fake.audit_log.gate.set()
+    await log.stop()
+    assert [entry["entity_id"] for batch in fake.audit_log.batches for entry in batch] == ["b1"]
+
+async def test_unencodable_entry_is_dropped_and_the_flusher_keeps_running():
+    fake = FakeDatabase()
+    log = AuditLog(max_size=100, flush_size=3, flush_seconds=60)
+    log.start(fake)
+
+    before = dropped()
+    await log.record("booking", "b1", "created")
+    await log.record("booking", "b2", "created", data={"tags": {"x"}})
+    await log.record("booking", "b3", "created")
+    await wait_for(lambda: not log._buffer)
+
+    assert [entry["entity_id"] for batch in fake.audit_log.batches for entry in batch] == ["b1", "b3"]
+    assert dropped() == before + 1
+
+    # Later entries are still written by the same task
+    for i in range(3):
+        await log.record("booking", f"c{i}", "created")
+    await wait_for(lambda: not log._buffer)
+    assert fake.audit_log.batches[-1][-1]["entity_id"] == "c2"
+    assert not log._task.done()
+    await log.stop()
+
+async def test_flusher_survives_unexpected_errors(monkeypatch):
+    fake = FakeDatabase()
+    log = AuditLog(max_size=100, flush_size=1, flush_seconds=60)
+    log.start(fake)
+    flush = log.flush
+    failures = [RuntimeError("boom")]
+
+    async def flaky_flush():
+        if failures:
+            raise failures.pop()
+        await flush()
+
+    monkeypatch.setattr(log, "flush", flaky_flush)
+    await log.record("booking", "b1", "created")
+    await wait_for(lambda: not failures)
+    assert not log._task.done()
+
+    await log.record("booking", "b2", "created")
+    await wait_for(lambda: not log._buffer)
+    assert [entry["entity_id"] for batch in fake.audit_log.batches for entry in batch] == ["b1", "b2"]
+    await log.stop()
@@ -0,0 +1,58 @@
+from bson import ObjectId
+from tests.conftest import auth_headers, make_client
+
+def batch(*lines):
+    return {"items": [
+        {"product_id": str(product_id), "start_date": "2026-07-01", "end_date": "2026-07-03", "quantity": quantity}
+        for product_id, quantity in lines
+    ]}
+
+async def seed_products(db, *stocks):
+    result = await db.products.insert_many([
+        {"name": f"Tent {i}", "price": 100, "stock": stock, "status": "available"}
+        for i, stock in enumerate(stocks)
+    ])
+    return result.inserted_ids
+
+async def test_oversold_line_rolls_back_the_whole_batch(replica_db):
+    tent, stove = await seed_products(replica_db, 5, 1)
+    async with make_client(replica_db) as client:
+        response = await client.post("/api/bookings/batch", json=batch((tent, 2), (stove, 2)), headers=auth_headers())
+
+    assert response.status_code == 400
+    # The first line's reservation was undone with the rest of the transaction
+    assert (await replica_db.products.find_one({"_id": tent}))["stock"] == 5
+    assert (await replica_db.products.find_one({"_id": stove}))["stock"] == 1
+    assert await replica_db.bookings.count_documents({}) == 0
+
+async def test_batch_reserves_every_line(replica_db):
+    tent, stove = await seed_products(replica_db, 5, 3)
+    async with make_client(replica_db) as client:
+        response = await client.post(
+            "/api/bookings/batch", json=batch((tent, 2), (stove, 1), (tent, 1)), headers=auth_headers()
+        )
+
+    assert response.status_code == 200
+    assert [line["quantity"] for line in response.json()] == [2, 1, 1]
+    assert (await replica_db.products.find_one({"_id": tent}))["stock"] == 2
+    assert (await replica_db.products.find_one({"_id": stove}))["stock"] == 2
+    assert await replica_db.bookings.count_documents({"status": "pending"}) == 3
+
+async def test_missing_product_aborts_the_batch(replica_db):
+    (tent,) = await seed_products(replica_db, 5)
+    async with make_client(replica_db) as client:
+        response = await client.post("/api/bookings/batch", json=batch((tent, 1), (ObjectId(), 1)), headers=auth_headers())
+
+    assert response.status_code == 404
+    assert (await replica_db.products.find_one({"_id": tent}))["stock"] == 5
+    assert await replica_db.bookings.count_documents({}) == 0
+
+async def test_invalid_lines_are_rejected_before_the_transaction(client):
+    response = await client.post("/api/bookings/batch", json=batch(("not-an-id", 1)), headers=auth_headers())
+    assert response.status_code == 400
+
+    response = await client.post("/api/bookings/batch", json=batch((ObjectId(), 0)), headers=auth_headers())
+    assert response.status_code == 400
+
+    response = await client.post("/api/bookings/batch", json={"items": []}, headers=auth_headers())
+    assert response.status_code == 400
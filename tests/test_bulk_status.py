@@ -0,0 +1,58 @@
+from datetime import datetime
+from bson import ObjectId
+from tests.conftest import auth_headers
+from utils import transitions
+
+async def seed_bookings(db, *statuses):
+    result = await db.bookings.insert_many([
+        {"user_id": "u1", "product_id": ObjectId(), "quantity": 1, "status": status, "created_at": datetime.utcnow()}
+        for status in statuses
+    ])
+    return [str(booking_id) for booking_id in result.inserted_ids]
+
+async def test_booking_results_per_id(client, db):
+    pending, confirmed, expired = await seed_bookings(db, "pending", "confirmed", "expired")
+    missing = str(ObjectId())
+
+    response = await client.post("/api/bookings/status", json={
+        "status": "confirmed", "ids": [pending, confirmed, expired, missing, "not-an-id"]
+    }, headers=auth_headers("admin"))
+    assert response.status_code == 200
+    body = response.json()
+    assert body["updated"] == 1
+    assert body["has_more"] is False
+    assert [result["result"] for result in body["results"]] == [
+        "updated", "unchanged", "invalid_transition", "not_found", "invalid_id"
+    ]
+    assert await db.bookings.count_documents({"status": "confirmed"}) == 2
+
+async def test_filters_past_the_limit_report_has_more(client, db, monkeypatch):
+    monkeypatch.setattr(transitions, "BULK_STATUS_LIMIT", 2)
+    await seed_bookings(db, "pending", "pending", "pending")
+    request = {"status": "confirmed", "from_status": "pending"}
+
+    body = (await client.post("/api/bookings/status", json=request, headers=auth_headers("admin"))).json()
+    assert (body["updated"], body["has_more"]) == (2, True)
+
+    body = (await client.post("/api/bookings/status", json=request, headers=auth_headers("admin"))).json()
+    assert (body["updated"], body["has_more"]) == (1, False)
+    assert await db.bookings.count_documents({"status": "pending"}) == 0
+
+async def test_completed_payments_confirm_their_bookings(client, db):
+    pending, cancelled = await seed_bookings(db, "pending", "cancelled")
+    result = await db.payments.insert_many([
+        {"booking_id": ObjectId(booking_id), "amount": 100, "method": "transfer", "status": "failed", "created_at": datetime.utcnow()}
+        for booking_id in (pending, cancelled)
+    ])
+
+    response = await client.post("/api/payments/status", json={
+        "status": "completed", "ids": [str(payment_id) for payment_id in result.inserted_ids]
+    }, headers=auth_headers("admin"))
+    body = response.json()
+    assert (body["updated"], body["bookings_confirmed"]) == (2, 1)
+    assert [result["booking_confirmed"] for result in body["results"]] == [True, False]
+    assert (await db.bookings.find_one({"_id": ObjectId(cancelled)}))["status"] == "cancelled"
+
+async def test_bulk_status_is_admin_only(client, db):
+    response = await client.post("/api/bookings/status", json={"status": "confirmed", "from_status": "pending"}, headers=auth_headers())
+    assert response.status_code == 403
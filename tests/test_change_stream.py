@@ -0,0 +1,158 @@
+import asyncio
+import pytest
+from pymongo.errors import OperationFailure
+from utils import cache, change_stream
+from utils.cache import TTLCache, register_cache
+from utils.change_stream import ChangeStreamListener, notify_change
+
+class FakeStream:
+    # Yields the changes put on its queue, like a Motor change stream
+    def __init__(self, changes: asyncio.Queue):
+        self.changes = changes
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        change = await self.changes.get()
+        self.resume_token = change["_id"]
+        return change
+
+class FakeDatabase:
+    # A mongomock database plus watch(); errors are raised by watch() in turn
+    def __init__(self, db, errors=()):
+        self.db = db
+        self.changes = asyncio.Queue()
+        self.errors = list(errors)
+        self.watch_calls = []
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def watch(self, pipeline, full_document=None, resume_after=None):
+        self.watch_calls.append(resume_after)
+        if self.errors:
+            raise self.errors.pop(0)
+        return FakeStream(self.changes)
+
+def change(collection: str, token: str) -> dict:
+    return {"_id": {"_data": token}, "ns": {"coll": collection}, "operationType": "update", "documentKey": {"_id": 1}}
+
+@pytest.fixture
+def caches(monkeypatch):
+    monkeypatch.setattr(cache, "_registry", {})
+    monkeypatch.setattr(change_stream, "CHANGE_STREAM_RETRY_SECONDS", 0)
+    products = register_cache("products", TTLCache(ttl=60))
+    users = register_cache("users", TTLCache(ttl=60))
+    return products, users
+
+@pytest.fixture
+def handled(monkeypatch):
+    changes = []
+    monkeypatch.setattr(change_stream, "_change_handlers", [changes.append])
+    return changes
+
+async def wait_for(condition, timeout: float = 1):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+async def test_change_event_clears_only_that_collections_caches(db, caches, handled):
+    products, users = caches
+    fake = FakeDatabase(db)
+    listener = ChangeStreamListener(fake, name="test")
+    listener.start()
+    await wait_for(lambda: listener.active)
+
+    products.set("all", ["cached"])
+    users.set("all", ["cached"])
+    await fake.changes.put(change("products", "t1"))
+    await wait_for(lambda: handled)
+
+    assert products.get("all") is None
+    assert users.get("all") == ["cached"]
+    assert handled[0]["ns"]["coll"] == "products"
+
+    await listener.stop()
+    assert not listener.active
+    saved = await db.change_stream_tokens.find_one({"_id": "test"})
+    assert saved["token"] == {"_data": "t1"}
+
+async def test_listener_resumes_from_the_saved_token(db, caches, handled):
+    await db.change_stream_tokens.insert_one({"_id": "test", "token": {"_data": "t9"}})
+    fake = FakeDatabase(db)
+    listener = ChangeStreamListener(fake, name="test")
+
+    products, _ = caches
+    products.set("all", ["cached before start"])
+    listener.start()
+    await wait_for(lambda: listener.active)
+
+    assert fake.watch_calls == [{"_data": "t9"}]
+    # Writes made while nobody was listening may be cached, so start clears everything
+    assert products.get("all") is None
+    await listener.stop()
+
+async def test_expired_resume_token_starts_from_now(db, caches, handled):
+    await db.change_stream_tokens.insert_one({"_id": "test", "token": {"_data": "old"}})
+    fake = FakeDatabase(db, errors=[OperationFailure("token gone", code=286)])
+    listener = ChangeStreamListener(fake, name="test")
+    listener.start()
+    await wait_for(lambda: listener.active)
+
+    assert fake.watch_calls == [{"_data": "old"}, None]
+    assert await db.change_stream_tokens.find_one({"_id": "test"}) is None
+    await listener.stop()
+
+async def test_standalone_server_falls_back_to_local_notifications(db, caches, handled):
+    fake = FakeDatabase(db, errors=[OperationFailure("not a replica set", code=40573)])
+    listener = ChangeStreamListener(fake, name="test")
+    listener.start()
+    await listener._task
+    assert not listener.active
+
+    products, _ = caches
+    products.set("all", ["cached"])
+    notify_change("products", "update", 1, {"stock": 3})
+
+    # Without a running stream, this worker's own writes feed the handlers
+    assert products.get("all") is None
+    assert handled[0]["fullDocument"] == {"stock": 3}
+
+async def test_local_notifications_defer_to_a_running_stream(db, caches, handled):
+    fake = FakeDatabase(db)
+    listener = ChangeStreamListener(fake, name="test")
+    listener.start()
+    await wait_for(lambda: listener.active)
+
+    products, _ = caches
+    products.set("all", ["cached"])
+    notify_change("products", "update", 1)
+
+    # The cache is cleared at once; handlers wait for the event from MongoDB
+    assert products.get("all") is None
+    assert handled == []
+    await listener.stop()
+
+async def test_write_in_another_client_clears_the_cache(replica_db, caches, handled):
+    products, _ = caches
+    listener = ChangeStreamListener(replica_db, name="test")
+    listener.start()
+    await wait_for(lambda: listener.active, timeout=10)
+
+    products.set("all", ["cached"])
+    await replica_db.products.insert_one({"name": "Tent"})
+    await wait_for(lambda: handled, timeout=10)
+
+    assert products.get("all") is None
+    assert handled[0]["operationType"] == "insert"
+    await listener.stop()
@@ -0,0 +1,68 @@
+from datetime import datetime
+import pytest
+from bson import ObjectId
+from utils import archive
+from utils.archive import count_with_archive, find_with_archive
+from utils.cleanup import enqueue_cleanup, claim_job, run_job
+
+@pytest.fixture(autouse=True)
+def no_transactions(monkeypatch):
+    # mongomock has no sessions: archive the way a standalone server does
+    monkeypatch.setattr(archive, "_use_transactions", False)
+
+async def seed(db, user_id: str, *statuses):
+    product_id = (await db.products.insert_one({"name": "Tent", "price": 100, "stock": 0, "status": "available"})).inserted_id
+    result = await db.bookings.insert_many([
+        {
+            "user_id": user_id, "product_id": product_id, "start_date": "2026-07-01", "end_date": "2026-07-03",
+            "quantity": 2, "total_price": 200, "status": status, "created_at": datetime.utcnow()
+        }
+        for status in statuses
+    ])
+    await db.payments.insert_one({"booking_id": result.inserted_ids[0], "amount": 200, "status": "completed", "created_at": datetime.utcnow()})
+    return product_id, result.inserted_ids
+
+async def test_user_cleanup_releases_stock_and_archives(db):
+    user_id = str(ObjectId())
+    product_id, ids = await seed(db, user_id, "confirmed", "pending", "completed")
+    await enqueue_cleanup(db, "user", user_id)
+
+    job = await claim_job(db)
+    assert job["status"] == "running"
+    assert await claim_job(db) is None
+    await run_job(db, job)
+
+    # Only the two bookings still holding stock give it back
+    assert (await db.products.find_one({"_id": product_id}))["stock"] == 4
+    job = await db.cleanup_jobs.find_one({"_id": job["_id"]})
+    assert job["status"] == "done"
+    assert job["progress"] == {"bookings": 3, "payments": 1, "stock_restored": 4}
+    assert await db.bookings.count_documents({}) == 0
+
+    # Recent records are found in the archive without moving the horizon
+    assert await db.archive_state.count_documents({}) == 0
+    assert await count_with_archive(db, "bookings", {"user_id": user_id}, since=datetime.utcnow()) == 3
+    payments = [payment async for payment in find_with_archive(db, "payments", {"status": "completed"}, since=datetime.utcnow())]
+    assert [payment["booking_id"] for payment in payments] == [ids[0]]
+
+async def test_retried_job_does_not_release_stock_twice(db):
+    user_id = str(ObjectId())
+    product_id, (claimed, unclaimed) = await seed(db, user_id, "confirmed", "confirmed")
+    job_id = await enqueue_cleanup(db, "user", user_id)
+    # An earlier attempt cancelled both and claimed one before crashing
+    await db.bookings.update_many({}, {"$set": {"status": "cancelled", "cleanup_job": job_id}})
+    await db.bookings.update_one({"_id": claimed}, {"$set": {"stock_restoring": ObjectId()}})
+
+    await run_job(db, await claim_job(db))
+
+    assert (await db.products.find_one({"_id": product_id}))["stock"] == 2
+    assert await db.bookings_archive.count_documents({"archived_early": True}) == 2
+
+async def test_product_cleanup_releases_no_stock(db):
+    product_id, _ = await seed(db, str(ObjectId()), "confirmed")
+    await enqueue_cleanup(db, "product", str(product_id))
+
+    await run_job(db, await claim_job(db))
+
+    assert (await db.products.find_one({"_id": product_id}))["stock"] == 0
+    assert await db.bookings_archive.count_documents({"status": "cancelled"}) == 1
@@ -0,0 +1,47 @@
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import ReadPreference
+from routes.reports import report_cache
+from tests.conftest import auth_headers, make_client
+from utils.db import connect, workload_options
+
+def test_default_workload_reads_from_the_primary():
+    options = workload_options("default")
+    assert options["readPreference"] == "primary"
+    # A staleness bound is invalid on primary reads
+    assert "maxStalenessSeconds" not in options
+
+def test_reports_prefer_secondaries_with_a_staleness_bound():
+    options = workload_options("reports")
+    assert options["readPreference"] == "secondaryPreferred"
+    assert options["maxStalenessSeconds"] == 120
+    assert options["maxPoolSize"] < workload_options("default")["maxPoolSize"]
+
+def test_settings_are_overridden_per_workload(monkeypatch):
+    monkeypatch.setenv("MONGO_REPORTS_MAX_POOL_SIZE", "3")
+    monkeypatch.setenv("MONGO_REPORTS_MAX_STALENESS_SECONDS", "30")
+    options = workload_options("reports")
+    assert options["maxPoolSize"] == 3
+    # MongoDB rejects bounds under 90 seconds
+    assert options["maxStalenessSeconds"] == 90
+    assert workload_options("default")["maxPoolSize"] == 100
+
+def test_connect_builds_a_client_per_workload():
+    client = connect("reports")
+    try:
+        assert client.read_preference.mode == ReadPreference.SECONDARY_PREFERRED.mode
+        assert client.read_preference.max_staleness == 120
+    finally:
+        client.close()
+
+async def test_reports_read_through_the_report_client(db):
+    report_db = AsyncMongoMockClient()["outdoorcamp_test"]
+    await report_db.users.insert_many([{"email": f"u{i}@example.com", "role": "user"} for i in range(2)])
+    report_cache.clear()
+
+    async with make_client(db) as client:
+        client._transport.app.state.report_db = report_db
+        response = await client.get("/api/reports/stats", headers=auth_headers("admin"))
+    report_cache.clear()
+
+    assert response.status_code == 200
+    assert response.json()["users"]["total"] == 2
@@ -0,0 +1,96 @@
+import asyncio
+from contextvars import ContextVar
+import pymongo
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from pymongo import _csot
+from pymongo.errors import ExecutionTimeout, OperationFailure, PyMongoError, ServerSelectionTimeoutError
+import server
+from utils import deadline
+from utils.deadline import DeadlineMiddleware, detached_task, timeout_handler
+
+request_id: ContextVar = ContextVar("request_id", default=None)
+ERRORS = {
+    "execution": ExecutionTimeout("operation exceeded time limit", 50),
+    "selection": ServerSelectionTimeoutError("no servers"),
+    "failure": OperationFailure("bad query", 2)
+}
+
+async def error(kind: str):
+    raise ERRORS[kind]
+
+async def remaining():
+    return {"remaining": _csot.remaining()}
+
+async def shared():
+    request_id.set("caller")
+
+    async def work():
+        return {"remaining": _csot.remaining(), "request_id": request_id.get()}
+
+    return await detached_task(work)
+
+def client(raise_app_exceptions: bool = True) -> AsyncClient:
+    # A new app per client: DeadlineMiddleware reads REQUEST_TIMEOUT_* when built
+    app = FastAPI()
+    app.add_middleware(DeadlineMiddleware)
+    app.add_exception_handler(PyMongoError, timeout_handler)
+    app.add_api_route("/api/errors/{kind}", error)
+    for path in ("/api/deadline", "/api/reports/deadline", "/api/events/deadline", "/deadline"):
+        app.add_api_route(path, remaining)
+    app.add_api_route("/api/shared", shared)
+    transport = ASGITransport(app=app, raise_app_exceptions=raise_app_exceptions)
+    return AsyncClient(transport=transport, base_url="http://test")
+
+def test_server_maps_database_errors():
+    assert server.app.exception_handlers[PyMongoError] is timeout_handler
+
+async def test_database_timeouts_become_504():
+    async with client() as http:
+        for kind in ("execution", "selection"):
+            response = await http.get(f"/api/errors/{kind}")
+            assert response.status_code == 504
+            assert response.json() == {"detail": "Database did not respond in time"}
+
+async def test_other_database_errors_stay_500():
+    async with client(raise_app_exceptions=False) as http:
+        assert (await http.get("/api/errors/failure")).status_code == 500
+
+async def test_requests_run_under_their_groups_deadline():
+    async with client() as http:
+        default = (await http.get("/api/deadline")).json()["remaining"]
+        reports = (await http.get("/api/reports/deadline")).json()["remaining"]
+        assert 9 < default <= 10
+        assert 29 < reports <= 30
+
+        # Event streams and non-API paths have none
+        assert (await http.get("/api/events/deadline")).json()["remaining"] is None
+        assert (await http.get("/deadline")).json()["remaining"] is None
+
+async def test_deadlines_are_configurable(monkeypatch):
+    monkeypatch.setenv("REQUEST_TIMEOUT_DEFAULT", "2")
+    async with client() as http:
+        assert 1 < (await http.get("/api/deadline")).json()["remaining"] <= 2
+
+async def test_shared_work_gets_its_own_deadline_and_context(monkeypatch):
+    monkeypatch.setenv("REQUEST_TIMEOUT_DEFAULT", "0.5")
+    async with client() as http:
+        result = (await http.get("/api/shared")).json()
+
+    # Not the caller's 0.5 s, and none of the caller's context variables
+    assert result["remaining"] > 0.5
+    assert result["remaining"] <= deadline.SHARED_TIMEOUT
+    assert result["request_id"] is None
+
+async def test_shared_work_outlives_a_caller_that_times_out():
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    with pymongo.timeout(0.01):
+        task = detached_task(work)
+        try:
+            await asyncio.wait_for(asyncio.shield(task), _csot.remaining())
+        except asyncio.TimeoutError:
+            pass
+    assert await task == "done"
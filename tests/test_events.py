@@ -0,0 +1,75 @@
+import asyncio
+import json
+import pytest
+import routes.events
+import utils.events
+from routes.events import stream_events
+from utils.events import broadcaster, publish_change
+
+@pytest.fixture(autouse=True)
+def fast_keepalive(monkeypatch):
+    monkeypatch.setattr(routes.events, "SSE_KEEPALIVE_SECONDS", 0.05)
+
+async def open_stream(user_id: str = "u1", role: str = "user"):
+    response = await stream_events(None, {"user_id": user_id, "role": role})
+    stream = response.body_iterator
+    assert await anext(stream) == "retry: 5000\n\n"
+    return stream
+
+def subscribers() -> int:
+    return len(broadcaster._subscribers)
+
+async def test_idle_stream_sends_keepalives_and_stays_open():
+    before = subscribers()
+    stream = await open_stream()
+
+    # Nothing happens for several keep-alive intervals
+    for _ in range(3):
+        assert await asyncio.wait_for(anext(stream), 1) == ": keep-alive\n\n"
+    assert subscribers() == before + 1
+
+    # An event after the idle period still arrives
+    publish_change({
+        "ns": {"coll": "products"}, "operationType": "update",
+        "documentKey": {"_id": "p1"}, "fullDocument": {"stock": 4, "status": "available"}
+    })
+    chunk = await asyncio.wait_for(anext(stream), 1)
+    assert chunk.startswith("event: stock\n")
+    assert json.loads(chunk.split("data: ")[1]) == {"type": "stock", "product_id": "p1", "stock": 4, "status": "available"}
+
+    # Closing the connection unsubscribes the client
+    await stream.aclose()
+    assert subscribers() == before
+
+async def test_booking_events_only_reach_their_owner_and_admins():
+    owner = await open_stream("owner")
+    other = await open_stream("other")
+    admin = await open_stream("admin", "admin")
+
+    publish_change({
+        "ns": {"coll": "bookings"}, "operationType": "update",
+        "documentKey": {"_id": "b1"}, "fullDocument": {"user_id": "owner", "status": "confirmed"}
+    })
+
+    assert (await anext(owner)).startswith("event: booking\n")
+    assert (await anext(admin)).startswith("event: booking\n")
+    assert await anext(other) == ": keep-alive\n\n"
+    for stream in (owner, other, admin):
+        await stream.aclose()
+
+async def test_slow_client_is_dropped_instead_of_blocking_publishers(monkeypatch):
+    monkeypatch.setattr(utils.events, "SSE_QUEUE_SIZE", 2)
+    before = subscribers()
+    stream = await open_stream()
+
+    for stock in range(3):
+        broadcaster.publish({"type": "stock", "product_id": "p1", "stock": stock})
+
+    assert subscribers() == before
+    assert await anext(stream) == "event: dropped\ndata: {}\n\n"
+    with pytest.raises(StopAsyncIteration):
+        await anext(stream)
+
+async def test_stream_needs_a_token(client):
+    response = await client.get("/api/events/")
+    assert response.status_code == 401
@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from bson import ObjectId
+from tests.conftest import auth_headers
+from utils import idempotency
+from utils.idempotency import run_idempotent
+
+@pytest.fixture(autouse=True)
+def no_memory(monkeypatch):
+    monkeypatch.setattr(idempotency, "_completed", idempotency.TTLCache(ttl=600))
+
+async def test_retry_gets_the_stored_response(db):
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        return {"id": len(calls)}
+
+    assert await run_idempotent(db, "k1", "test", {"a": 1}, handler) == {"id": 1}
+    # From the database as well as from memory
+    for _ in range(2):
+        response = await run_idempotent(db, "k1", "test", {"a": 1}, handler)
+        assert response.headers["Idempotent-Replayed"] == "true"
+        assert response.body == b'{"id":1}'
+        idempotency._completed.clear()
+    assert len(calls) == 1
+
+async def test_key_reused_for_another_request_is_rejected(db):
+    async def handler():
+        return {}
+
+    await run_idempotent(db, "k1", "test", {"a": 1}, handler)
+    with pytest.raises(HTTPException) as error:
+        await run_idempotent(db, "k1", "test", {"a": 2}, handler)
+    assert error.value.status_code == 422
+    # Scopes do not share keys
+    assert await run_idempotent(db, "k1", "other", {"a": 2}, handler) == {}
+
+async def test_concurrent_duplicate_gets_409(db):
+    release = asyncio.Event()
+
+    async def handler():
+        await release.wait()
+        return {}
+
+    first = asyncio.create_task(run_idempotent(db, "k1", "test", {}, handler))
+    await asyncio.sleep(0.01)
+    with pytest.raises(HTTPException) as error:
+        await run_idempotent(db, "k1", "test", {}, handler)
+    assert error.value.status_code == 409
+
+    release.set()
+    assert await first == {}
+
+async def test_failed_attempt_can_be_retried(db):
+    async def failing():
+        raise HTTPException(status_code=400, detail="Not enough stock")
+
+    async def handler():
+        return {"ok": True}
+
+    with pytest.raises(HTTPException):
+        await run_idempotent(db, "k1", "test", {}, failing)
+    assert await run_idempotent(db, "k1", "test", {}, handler) == {"ok": True}
+
+async def test_booking_retry_books_once(client, db):
+    product_id = (await db.products.insert_one({"name": "Tent", "price": 100, "stock": 5, "status": "available"})).inserted_id
+    headers = {**auth_headers(user_id=str(ObjectId())), "Idempotency-Key": "booking-1"}
+    body = {"product_id": str(product_id), "start_date": "2026-07-01", "end_date": "2026-07-03", "quantity": 2}
+
+    first = await client.post("/api/bookings/", json=body, headers=headers)
+    retry = await client.post("/api/bookings/", json=body, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert await db.bookings.count_documents({}) == 1
+    assert (await db.products.find_one({"_id": product_id}))["stock"] == 3
+
+    changed = await client.post("/api/bookings/", json={**body, "quantity": 1}, headers=headers)
+    assert changed.status_code == 422
@@ -0,0 +1,72 @@
+import asyncio
+import time
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from utils.load_shedding import (
+    PRIORITY_READ, PRIORITY_REPORT, PRIORITY_WRITE, ConcurrencyLimiter, LoadSheddingMiddleware
+)
+
+async def test_queued_requests_are_served_by_priority():
+    limiter = ConcurrencyLimiter("test", limit=1, max_queue=8, deadline=5)
+    deadline_at = time.monotonic() + 5
+    assert await limiter.acquire(PRIORITY_READ, deadline_at)
+
+    served = []
+
+    async def request(name: str, priority: int):
+        assert await limiter.acquire(priority, deadline_at)
+        served.append(name)
+        limiter.release(0.01)
+
+    tasks = []
+    for name, priority in (("report", PRIORITY_REPORT), ("write", PRIORITY_WRITE), ("read", PRIORITY_READ)):
+        tasks.append(asyncio.create_task(request(name, priority)))
+        await asyncio.sleep(0)
+    assert limiter.waiting == 3
+
+    limiter.release(0.01)
+    await asyncio.gather(*tasks)
+    assert served == ["read", "write", "report"]
+    assert limiter.in_flight == 0
+
+async def test_full_queue_is_rejected_at_once():
+    limiter = ConcurrencyLimiter("test", limit=1, max_queue=0, deadline=5)
+    deadline_at = time.monotonic() + 5
+    assert await limiter.acquire(PRIORITY_READ, deadline_at)
+    assert not await limiter.acquire(PRIORITY_READ, deadline_at)
+
+async def test_waiters_give_up_at_the_deadline():
+    limiter = ConcurrencyLimiter("test", limit=1, max_queue=8, deadline=0.05)
+    assert await limiter.acquire(PRIORITY_READ, time.monotonic() + 0.05)
+    assert not await limiter.acquire(PRIORITY_READ, time.monotonic() + 0.05)
+    assert limiter.waiting == 0
+
+async def test_shed_requests_get_503_with_retry_after(monkeypatch):
+    monkeypatch.setenv("LOAD_SHED_REPORTS", "1:0:5")
+    started = asyncio.Event()
+    finish = asyncio.Event()
+
+    async def slow():
+        started.set()
+        await finish.wait()
+        return {}
+
+    app = FastAPI()
+    app.add_middleware(LoadSheddingMiddleware)
+    app.add_api_route("/api/reports/slow", slow)
+    app.add_api_route("/api/health", slow)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        first = asyncio.create_task(client.get("/api/reports/slow"))
+        await started.wait()
+
+        response = await client.get("/api/reports/slow")
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
+
+        # Exempt routes are never shed
+        health = asyncio.create_task(client.get("/api/health"))
+        await asyncio.sleep(0.01)
+        finish.set()
+        assert (await first).status_code == 200
+        assert (await health).status_code == 200
@@ -0,0 +1,72 @@
+import os
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from tests.conftest import auth_headers
+from utils import profiling
+from utils.profiling import ProfilingMiddleware, find_profile, list_profiles
+
+app = FastAPI()
+app.add_middleware(ProfilingMiddleware)
+
+@app.get("/api/products/")
+async def products():
+    return [{"name": "Tent"}]
+
+@app.get("/api/events/")
+async def events():
+    return {}
+
+@pytest.fixture
+async def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+def profile_request(role: str = "admin") -> dict:
+    return {**auth_headers(role), "X-Profile": "1"}
+
+async def test_admin_request_is_profiled_and_saved(client):
+    response = await client.get("/api/products/", headers=profile_request())
+
+    assert response.status_code == 200
+    assert response.json() == [{"name": "Tent"}]
+    profile_id = response.headers["x-profile-id"]
+    assert os.path.exists(find_profile(profile_id))
+    (meta,) = list_profiles()
+    assert meta["id"] == profile_id
+    assert meta["path"] == "/api/products/"
+    assert meta["status"] == 200
+
+async def test_profile_header_is_ignored_for_other_users(client):
+    response = await client.get("/api/products/", headers=profile_request("user"))
+    assert "x-profile-id" not in response.headers
+    assert list_profiles() == []
+
+async def test_event_streams_are_never_profiled(client, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", 1)
+    response = await client.get("/api/events/", headers=profile_request())
+    assert "x-profile-id" not in response.headers
+    assert list_profiles() == []
+
+async def test_failed_save_sends_the_response_without_an_id(client, monkeypatch):
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(profiling, "save_profile", fail)
+    response = await client.get("/api/products/", headers=profile_request())
+    assert response.status_code == 200
+    assert response.json() == [{"name": "Tent"}]
+    assert "x-profile-id" not in response.headers
+
+async def test_oldest_profiles_are_rotated_out(client, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_MAX_FILES", 2)
+    ids = [
+        (await client.get("/api/products/", headers=profile_request())).headers["x-profile-id"]
+        for _ in range(3)
+    ]
+    assert [meta["id"] for meta in list_profiles()] == [ids[2], ids[1]]
+    assert find_profile(ids[0]) is None
+
+def test_only_profile_ids_are_looked_up():
+    assert find_profile("../../etc/passwd") is None
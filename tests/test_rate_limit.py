@@ -0,0 +1,83 @@
+import pytest
+from types import SimpleNamespace
+from utils import rate_limit
+from utils.rate_limit import TokenBucketLimiter
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Only this module's clock: the event loop keeps the real one
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+@pytest.fixture(autouse=True)
+def fresh_limiters(monkeypatch):
+    monkeypatch.setattr(rate_limit, "auth_ip_limiter", TokenBucketLimiter(60, 3))
+    monkeypatch.setattr(rate_limit, "auth_email_limiter", TokenBucketLimiter(6, 2))
+
+def take(limiter, key) -> bool:
+    if limiter.retry_after(key):
+        return False
+    limiter.consume(key)
+    return True
+
+def test_bucket_refills_at_its_rate(clock):
+    limiter = TokenBucketLimiter(rate_per_min=60, burst=2)
+    assert take(limiter, "a") and take(limiter, "a")
+    assert not take(limiter, "a")
+    assert limiter.retry_after("a") == pytest.approx(1)
+
+    clock.now += 0.5
+    assert limiter.retry_after("a") == pytest.approx(0.5)
+    clock.now += 0.5
+    assert take(limiter, "a")
+    # Other keys have their own bucket
+    assert take(limiter, "b")
+
+def test_idle_buckets_are_evicted(clock):
+    limiter = TokenBucketLimiter(rate_per_min=60, burst=2, max_keys=2)
+    take(limiter, "a")
+    take(limiter, "b")
+    take(limiter, "c")
+    assert len(limiter) == 2
+
+    clock.now += 2
+    take(limiter, "d")
+    assert len(limiter) == 1
+
+async def login(client, email: str, ip: str = "10.0.0.1"):
+    return await client.post(
+        "/api/auth/login", json={"email": email, "password": "wrong-password"},
+        headers={"X-Forwarded-For": ip}
+    )
+
+async def test_login_returns_429_with_retry_after(client, clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "TRUST_PROXY_HEADERS", True)
+    assert (await login(client, "a@example.com")).status_code == 401
+    assert (await login(client, "a@example.com")).status_code == 401
+
+    # The email bucket (6/min, burst 2) is empty: a token is 10s away
+    response = await login(client, "a@example.com")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "10"
+
+    clock.now += 10
+    assert (await login(client, "a@example.com")).status_code == 401
+
+async def test_ip_rejections_do_not_use_up_the_email(client, clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "TRUST_PROXY_HEADERS", True)
+    for email in ("a@example.com", "b@example.com", "c@example.com"):
+        assert (await login(client, email)).status_code == 401
+    for _ in range(5):
+        assert (await login(client, "victim@example.com")).status_code == 429
+
+    # The victim can still log in from another address
+    assert (await login(client, "victim@example.com", ip="10.0.0.2")).status_code == 401
+    assert (await login(client, "victim@example.com", ip="10.0.0.3")).status_code == 401
@@ -0,0 +1,87 @@
+import io
+from bson import ObjectId
+from utils.reconciliation import reconcile_file
+
+def settlement(*rows) -> io.BytesIO:
+    lines = ["transaction_id,amount,status"] + [",".join(row) for row in rows]
+    return io.BytesIO("\n".join(lines).encode())
+
+async def seed_payment(db, transaction_id: str, amount: float, status: str = "pending"):
+    booking_id = (await db.bookings.insert_one({"user_id": "u1", "status": "pending"})).inserted_id
+    await db.payments.insert_one({"booking_id": booking_id, "transaction_id": transaction_id, "amount": amount, "status": status})
+    return booking_id
+
+async def status_of(db, transaction_id: str) -> str:
+    return (await db.payments.find_one({"transaction_id": transaction_id}))["status"]
+
+async def test_rows_are_matched_or_reported(db):
+    booking_id = await seed_payment(db, "TRX-1", 100)
+    await seed_payment(db, "TRX-2", 50)
+    await seed_payment(db, "TRX-3", 75)
+
+    report = await reconcile_file(db, settlement(
+        ("TRX-1", "100.00", ""),
+        ("TRX-2", "55", ""),
+        ("TRX-3", "nan", ""),
+        ("TRX-9", "10", ""),
+        ("TRX-4", "abc", ""),
+        ("TRX-1", "100", "")
+    ))
+
+    assert {kind: report[kind] for kind in ("rows", "matched", "mismatched", "invalid", "unmatched", "duplicate")} == {
+        "rows": 6, "matched": 1, "mismatched": 1, "invalid": 2, "unmatched": 1, "duplicate": 1
+    }
+    assert {issue["transaction_id"]: issue["reason"] for issue in report["issues"]} == {
+        "TRX-2": "mismatched", "TRX-3": "invalid", "TRX-9": "unmatched", "TRX-4": "invalid", "TRX-1": "duplicate"
+    }
+    assert await status_of(db, "TRX-1") == "completed"
+    # A nan amount must not settle the payment
+    assert await status_of(db, "TRX-3") == "pending"
+    assert (await db.bookings.find_one({"_id": booking_id}))["status"] == "confirmed"
+
+async def test_repeat_in_a_later_batch_is_already_reconciled(db):
+    await seed_payment(db, "TRX-1", 100)
+
+    report = await reconcile_file(db, settlement(("TRX-1", "100", ""), ("TRX-1", "100", "")), batch_size=1)
+
+    assert report["matched"] == 1
+    assert report["already_reconciled"] == 1
+    assert report["duplicate"] == 0
+
+async def test_failed_payments_follow_the_file(db):
+    await seed_payment(db, "TRX-1", 100)
+    await seed_payment(db, "TRX-2", 100, status="failed")
+    await seed_payment(db, "TRX-3", 100, status="failed")
+
+    report = await reconcile_file(db, settlement(
+        ("TRX-1", "100", "rejected"),
+        ("TRX-2", "100", "settled"),
+        ("TRX-3", "100", "failed")
+    ))
+
+    assert await status_of(db, "TRX-1") == "failed"
+    # Failed earlier, settled since
+    assert await status_of(db, "TRX-2") == "completed"
+    assert (report["failed"], report["matched"], report["already_reconciled"]) == (1, 1, 1)
+
+async def test_dry_run_changes_nothing(db):
+    await seed_payment(db, "TRX-1", 100)
+
+    report = await reconcile_file(db, settlement(("TRX-1", "100", "")), dry_run=True)
+
+    assert report["matched"] == 1
+    assert await status_of(db, "TRX-1") == "pending"
+
+async def test_concurrent_update_is_not_counted_as_matched(db, monkeypatch):
+    await seed_payment(db, "TRX-1", 100)
+    collection_type = type(db.payments)
+    bulk_write = collection_type.bulk_write
+
+    async def settle_first(self, ops, **kwargs):
+        # Another reconciliation settles the payment after it was read
+        await db.payments.update_one({"transaction_id": "TRX-1"}, {"$set": {"status": "completed"}})
+        return await bulk_write(self, ops, **kwargs)
+
+    monkeypatch.setattr(collection_type, "bulk_write", settle_first)
+    report = await reconcile_file(db, settlement(("TRX-1", "100", "")))
+    assert (report["matched"], report["already_reconciled"]) == (0, 1)
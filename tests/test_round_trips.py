@@ -0,0 +1,103 @@
+from datetime import datetime
+from bson import ObjectId
+from tests.conftest import auth_headers, make_client
+
+class Calls:
+    # Records every collection method a handler calls, as "collection.method"
+    # (a find() counts once however many batches the cursor fetches)
+
+    def __init__(self, db):
+        self.db = db
+        self.log = []
+
+    def __getattr__(self, name):
+        return CountedCollection(getattr(self.db, name), name, self.log)
+
+    def __getitem__(self, name):
+        return self.__getattr__(name)
+
+class CountedCollection:
+    def __init__(self, collection, name, log):
+        self.collection = collection
+        self.name = name
+        self.log = log
+
+    def __getattr__(self, method):
+        attr = getattr(self.collection, method)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            self.log.append(f"{self.name}.{method}")
+            return attr(*args, **kwargs)
+        return call
+
+async def test_update_product_is_one_round_trip(db):
+    product_id = (await db.products.insert_one({
+        "name": "Tent", "description": "2p", "category": "tents", "price": 100,
+        "stock": 5, "status": "available", "created_at": datetime.utcnow()
+    })).inserted_id
+    calls = Calls(db)
+    async with make_client(calls) as client:
+        response = await client.put(f"/api/products/{product_id}", json={"price": 120}, headers=auth_headers("admin"))
+
+    assert response.status_code == 200
+    assert response.json()["price"] == 120
+    assert calls.log == ["products.find_one_and_update"]
+
+async def test_update_user_is_one_round_trip(db):
+    user_id = (await db.users.insert_one({
+        "email": "a@example.com", "name": "A", "role": "user", "password": "x", "created_at": datetime.utcnow()
+    })).inserted_id
+    calls = Calls(db)
+    async with make_client(calls) as client:
+        response = await client.put(f"/api/users/{user_id}", json={"name": "B"}, headers=auth_headers("admin"))
+
+    assert response.status_code == 200
+    assert response.json()["name"] == "B"
+    assert calls.log == ["users.find_one_and_update"]
+
+async def test_update_booking_checks_ownership_in_the_same_round_trip(db):
+    owner = str(ObjectId())
+    product_id = (await db.products.insert_one({"name": "Tent", "price": 100, "stock": 5, "status": "available"})).inserted_id
+    booking_id = (await db.bookings.insert_one({
+        "user_id": owner, "product_id": str(product_id), "start_date": "2026-07-01", "end_date": "2026-07-03",
+        "quantity": 1, "total_price": 100, "status": "pending", "created_at": datetime.utcnow()
+    })).inserted_id
+
+    calls = Calls(db)
+    async with make_client(calls) as client:
+        response = await client.put(f"/api/bookings/{booking_id}", json={"notes": "late"}, headers=auth_headers(user_id=owner))
+        assert response.status_code == 200
+        assert response.json()["notes"] == "late"
+        # The update itself, then the product name for the response
+        assert calls.log == ["bookings.find_one_and_update", "products.find_one"]
+
+        # Only a miss pays for the lookup that tells 403 from 404
+        calls.log.clear()
+        response = await client.put(f"/api/bookings/{booking_id}", json={"notes": "x"}, headers=auth_headers())
+        assert response.status_code == 403
+        assert calls.log == ["bookings.find_one_and_update", "bookings.find_one"]
+
+async def test_update_missing_payment_is_404_after_one_round_trip(db):
+    calls = Calls(db)
+    async with make_client(calls) as client:
+        response = await client.put(f"/api/payments/{ObjectId()}", json={"notes": "x"}, headers=auth_headers("admin"))
+
+    assert response.status_code == 404
+    assert calls.log == ["payments.find_one_and_update"]
+
+async def test_create_payment_relies_on_the_unique_index_once_typed(db, monkeypatch):
+    import routes.payments
+    monkeypatch.setattr(routes.payments, "TYPED_STORAGE", True)
+    owner = str(ObjectId())
+    booking_id = (await db.bookings.insert_one({"user_id": owner, "status": "pending"})).inserted_id
+
+    calls = Calls(db)
+    async with make_client(calls) as client:
+        response = await client.post("/api/payments/", json={
+            "booking_id": str(booking_id), "amount": 100, "method": "transfer"
+        }, headers=auth_headers(user_id=owner))
+
+    assert response.status_code == 200
+    # No duplicate lookup before the insert
+    assert calls.log == ["bookings.find_one", "payments.insert_one"]
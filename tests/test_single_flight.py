@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from utils import metrics
+from utils.single_flight import SingleFlight
+
+def counter(name: str) -> int:
+    return metrics.snapshot()["counters"].get(name, 0)
+
+async def test_concurrent_calls_share_one_computation():
+    flight = SingleFlight()
+    calls = 0
+    release = asyncio.Event()
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return ["result"]
+
+    executed, shared = counter("single_flight.executed"), counter("single_flight.shared")
+    waiters = [asyncio.create_task(flight.do("key", load)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters)
+
+    assert calls == 1
+    assert all(result is results[0] for result in results)
+    assert counter("single_flight.executed") == executed + 1
+    assert counter("single_flight.shared") == shared + 4
+
+async def test_different_keys_and_later_calls_run_again():
+    flight = SingleFlight()
+    calls = []
+
+    async def load(key):
+        calls.append(key)
+        return key
+
+    assert await asyncio.gather(flight.do("a", lambda: load("a")), flight.do("b", lambda: load("b"))) == ["a", "b"]
+    # Nothing is cached once the computation is done
+    assert await flight.do("a", lambda: load("a")) == "a"
+    assert calls == ["a", "b", "a"]
+
+async def test_failure_reaches_every_waiter_and_is_not_kept():
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def fail():
+        await release.wait()
+        raise ValueError("boom")
+
+    waiters = [asyncio.create_task(flight.do("key", fail)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+
+    async def succeed():
+        return "ok"
+
+    assert await flight.do("key", succeed) == "ok"
+
+async def test_cancelled_caller_does_not_cancel_the_others():
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def load():
+        await release.wait()
+        return "done"
+
+    first = asyncio.create_task(flight.do("key", load))
+    second = asyncio.create_task(flight.do("key", load))
+    await asyncio.sleep(0)
+
+    # e.g. the client of the first request disconnected
+    first.cancel()
+    release.set()
+    assert await second == "done"
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+def test_flight_key_ignores_query_order_but_not_scope():
+    from starlette.requests import Request
+    from utils.single_flight import flight_key
+
+    def request(query: bytes) -> Request:
+        return Request({"type": "http", "method": "GET", "path": "/api/bookings/", "query_string": query, "headers": []})
+
+    assert flight_key(request(b"a=1&b=2"), "all") == flight_key(request(b"b=2&a=1"), "all")
+    assert flight_key(request(b"a=1"), "user-1") != flight_key(request(b"a=1"), "user-2")
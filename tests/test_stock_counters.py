@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from tests.conftest import auth_headers
+from utils import stock_counters
+from utils.stock_counters import (
+    disable_sharding, enable_sharding, live_stock, rebalance, release_stock, reserve_stock, shard_id
+)
+
+@pytest.fixture(autouse=True)
+def no_cached_totals(monkeypatch):
+    monkeypatch.setattr(stock_counters, "_totals", stock_counters.TTLCache(ttl=0))
+
+async def sharded_product(db, stock: int, shards: int) -> dict:
+    product_id = (await db.products.insert_one({"name": "Tent", "description": "2 person", "category": "tents", "price": 100, "stock": stock, "status": "available"})).inserted_id
+    assert await enable_sharding(db, product_id, shards) == stock
+    return await db.products.find_one({"_id": product_id})
+
+async def shard_stock(db, product: dict) -> list:
+    shards = await db.stock_shards.find({"product_id": product["_id"]}).sort("_id", 1).to_list(None)
+    return [shard["stock"] for shard in shards]
+
+async def test_stock_is_split_over_the_shards(db):
+    product = await sharded_product(db, 10, 4)
+    assert await shard_stock(db, product) == [3, 3, 2, 2]
+    assert await live_stock(db, product) == 10
+
+async def test_reservation_collects_from_several_shards(db):
+    product = await sharded_product(db, 10, 4)
+    assert await reserve_stock(db, product, 7)
+    assert sum(await shard_stock(db, product)) == 3
+    assert min(await shard_stock(db, product)) >= 0
+
+async def test_reservation_that_falls_short_is_rolled_back(db):
+    product = await sharded_product(db, 10, 4)
+    await db.stock_shards.update_one({"_id": shard_id(product["_id"], 0)}, {"$set": {"stock": 0}})
+
+    assert not await reserve_stock(db, product, 8)
+    assert await shard_stock(db, product) == [0, 3, 2, 2]
+
+async def test_concurrent_reservations_never_oversell(db):
+    product = await sharded_product(db, 10, 4)
+    results = await asyncio.gather(*[reserve_stock(db, product, 1) for _ in range(15)])
+    assert results.count(True) == 10
+    assert await shard_stock(db, product) == [0, 0, 0, 0]
+
+async def test_released_stock_is_rebalanced_and_published(db):
+    product = await sharded_product(db, 8, 4)
+    assert await reserve_stock(db, product, 2)
+    await release_stock(db, product["_id"], 6)
+    assert sum(await shard_stock(db, product)) == 12
+
+    await rebalance(db, product["_id"])
+    assert await shard_stock(db, product) == [3, 3, 3, 3]
+    assert (await db.products.find_one({"_id": product["_id"]}))["stock"] == 12
+
+async def test_disabling_folds_the_shards_back(db):
+    product = await sharded_product(db, 10, 4)
+    assert await reserve_stock(db, product, 3)
+
+    assert await disable_sharding(db, product["_id"]) == 7
+    assert await db.stock_shards.count_documents({}) == 0
+    product = await db.products.find_one({"_id": product["_id"]})
+    assert "stock_shards" not in product
+    assert await reserve_stock(db, product, 7)
+    assert not await reserve_stock(db, product, 1)
+
+async def test_in_stock_search_uses_the_shard_totals(client, db):
+    # The products.stock snapshots say the opposite of the shards
+    sold_out = await sharded_product(db, 4, 2)
+    assert await reserve_stock(db, sold_out, 4)
+    restocked = await sharded_product(db, 0, 2)
+    await release_stock(db, restocked["_id"], 3)
+    plain = (await db.products.insert_one({"name": "Stove", "description": "Gas", "category": "cooking", "price": 50, "stock": 1, "status": "available"})).inserted_id
+
+    async def search(in_stock: bool) -> set:
+        response = await client.get("/api/products/search", params={"in_stock": in_stock}, headers=auth_headers())
+        assert response.status_code == 200
+        return {product["id"] for product in response.json()["items"]}
+
+    assert await search(True) == {str(restocked["_id"]), str(plain)}
+    assert await search(False) == {str(sold_out["_id"])}
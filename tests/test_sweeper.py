@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+import pytest
+from bson import ObjectId
+from tests.conftest import auth_headers
+from utils import sweeper
+from utils.sweeper import expire_pending_bookings
+
+@pytest.fixture(autouse=True)
+def no_hold(monkeypatch):
+    monkeypatch.setattr(sweeper, "BOOKING_HOLD_MINUTES", 0)
+
+async def seed(db, stock: int, *bookings):
+    # bookings: (user_id, quantity) pairs, all pending and already past the hold
+    product_id = (await db.products.insert_one({"name": "Tent", "price": 100, "stock": stock, "status": "available"})).inserted_id
+    created_at = datetime.utcnow() - timedelta(minutes=5)
+    result = await db.bookings.insert_many([
+        {
+            "user_id": user_id, "product_id": product_id, "start_date": "2026-07-01", "end_date": "2026-07-03",
+            "quantity": quantity, "total_price": 100 * quantity, "status": "pending", "created_at": created_at
+        }
+        for user_id, quantity in bookings
+    ])
+    return product_id, result.inserted_ids
+
+async def test_unpaid_bookings_expire_and_release_their_stock(db):
+    product_id, (first, second) = await seed(db, 0, ("u1", 2), ("u2", 1))
+
+    assert await expire_pending_bookings(db) == (2, 3)
+    assert (await db.products.find_one({"_id": product_id}))["stock"] == 3
+    assert await db.bookings.count_documents({"status": "expired"}) == 2
+
+    # A second sweep finds nothing left to release
+    assert await expire_pending_bookings(db) == (0, 0)
+    assert (await db.products.find_one({"_id": product_id}))["stock"] == 3
+
+async def test_bookings_with_a_payment_are_kept(db):
+    product_id, (paid, unpaid) = await seed(db, 0, ("u1", 1), ("u2", 1))
+    await db.payments.insert_one({"booking_id": paid, "amount": 100, "status": "pending"})
+
+    assert await expire_pending_bookings(db) == (1, 1)
+    assert (await db.bookings.find_one({"_id": paid}))["status"] == "pending"
+    assert (await db.bookings.find_one({"_id": unpaid}))["status"] == "expired"
+
+async def test_expired_booking_cannot_be_paid_or_confirmed(client, db):
+    owner = str(ObjectId())
+    product_id, (booking_id,) = await seed(db, 0, (owner, 1))
+    await expire_pending_bookings(db)
+
+    # Someone else books the released unit
+    response = await client.post("/api/bookings/", json={
+        "product_id": str(product_id), "start_date": "2026-07-01", "end_date": "2026-07-03", "quantity": 1
+    }, headers=auth_headers())
+    assert response.status_code == 200
+    assert (await db.products.find_one({"_id": product_id}))["stock"] == 0
+
+    response = await client.post("/api/payments/", json={
+        "booking_id": str(booking_id), "amount": 100, "method": "transfer"
+    }, headers=auth_headers(user_id=owner))
+    assert response.status_code == 409
+
+    # A payment that slipped in between the sweeper's payment check and its
+    # update still completes, but does not bring the booking back
+    payment_id = (await db.payments.insert_one({
+        "booking_id": booking_id, "amount": 100, "method": "transfer", "status": "pending", "created_at": datetime.utcnow()
+    })).inserted_id
+    response = await client.put(f"/api/payments/{payment_id}", json={"status": "completed"}, headers=auth_headers("admin"))
+    assert response.status_code == 200
+    assert (await db.bookings.find_one({"_id": booking_id}))["status"] == "expired"
+
+async def test_completing_a_payment_confirms_a_pending_booking(client, db):
+    owner = str(ObjectId())
+    product_id, (booking_id,) = await seed(db, 0, (owner, 1))
+
+    response = await client.post("/api/payments/", json={
+        "booking_id": str(booking_id), "amount": 100, "method": "transfer"
+    }, headers=auth_headers(user_id=owner))
+    assert response.status_code == 200
+
+    response = await client.put(f"/api/payments/{response.json()['id']}", json={"status": "completed"}, headers=auth_headers("admin"))
+    assert response.status_code == 200
+    assert (await db.bookings.find_one({"_id": booking_id}))["status"] == "confirmed"
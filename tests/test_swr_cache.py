@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from utils import cache
+from utils.cache import StaleWhileRevalidateCache
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Only this module's clock: the event loop keeps the real one
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+class Report:
+    # Returns how many times it ran; later runs wait for `release`
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return self.calls
+
+async def test_stale_value_is_served_while_one_refresh_runs(clock):
+    swr = StaleWhileRevalidateCache("test", fresh_ttl=10, stale_ttl=60)
+    report = Report()
+    assert await swr.get_or_compute("k", report) == 1
+
+    clock.now += 5
+    assert await swr.get_or_compute("k", report) == 1
+    assert report.calls == 1
+
+    # Stale: every caller gets the old value at once, one refresh starts
+    clock.now += 10
+    report.release.clear()
+    assert await asyncio.gather(*[swr.get_or_compute("k", report) for _ in range(5)]) == [1] * 5
+    await asyncio.sleep(0)
+    assert report.calls == 2
+
+    report.release.set()
+    await asyncio.sleep(0.01)
+    assert await swr.get_or_compute("k", report) == 2
+    assert report.calls == 2
+
+async def test_expired_entries_are_recomputed_in_the_request(clock):
+    swr = StaleWhileRevalidateCache("test", fresh_ttl=10, stale_ttl=60)
+    report = Report()
+    await swr.get_or_compute("k", report)
+
+    clock.now += 71
+    assert await swr.get_or_compute("k", report) == 2
+
+async def test_failed_refresh_keeps_the_stale_value(clock):
+    swr = StaleWhileRevalidateCache("test", fresh_ttl=10, stale_ttl=60)
+    await swr.get_or_compute("k", Report())
+
+    async def broken():
+        raise RuntimeError("database down")
+
+    clock.now += 15
+    assert await swr.get_or_compute("k", broken) == 1
+    await asyncio.sleep(0.01)
+    assert await swr.get_or_compute("k", broken) == 1
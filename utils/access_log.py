@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from pymongo import monitoring
+from dotenv import load_dotenv
+from utils import metrics
+
+load_dotenv()
+
+# Every request that errors (5xx) or takes ACCESS_LOG_SLOW_MS or longer is
+# logged; of the rest only ACCESS_LOG_SAMPLE_RATE (0..1) are
+ACCESS_LOG_ENABLED = os.getenv("ACCESS_LOG_ENABLED", "true").lower() == "true"
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", 0.1))
+ACCESS_LOG_SLOW_MS = float(os.getenv("ACCESS_LOG_SLOW_MS", 500))
+# Records waiting for the writer thread; more than this are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+APP_LOGGER = "outdoorcamp"
+ACCESS_LOGGER = "outdoorcamp.access"
+
+access_logger = logging.getLogger(ACCESS_LOGGER)
+
+# Per-request counters, shared with the executor threads Motor runs
+# pymongo on (Motor copies the context into them)
+_request_stats: ContextVar = ContextVar("request_stats", default=None)
+
+_queue = queue.Queue(LOG_QUEUE_SIZE)
+_listener = None
+
+metrics.register_gauge("logging.queued", _queue.qsize)
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class DroppingQueueHandler(QueueHandler):
+    # Never blocks the event loop: a full queue drops the record
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens on the writer thread, not here
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("logging.dropped")
+
+class DrainingQueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room so stop() still ends the thread with a full queue
+        self.queue.put(self._sentinel)
+
+def setup_logging():
+    # App and access logs go through the queue to one writer thread. Call it
+    # in each process (threads do not survive gunicorn's fork).
+    global _listener
+    if _listener is not None:
+        return
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    queue_handler = DroppingQueueHandler(_queue)
+    for name in (APP_LOGGER, ACCESS_LOGGER):
+        logger = logging.getLogger(name)
+        logger.handlers = [queue_handler]
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
+
+    _listener = DrainingQueueListener(_queue, handler)
+    _listener.start()
+
+def stop_logging():
+    # Writes out what is still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def note_user(user_id):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats["user_id"] = user_id
+
+class CommandCounter(monitoring.CommandListener):
+    # Passed to every client (utils.db.connect) to count DB calls per request
+
+    def started(self, event):
+        stats = _request_stats.get()
+        if stats is not None:
+            stats["db_calls"] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+command_counter = CommandCounter()
+
+class AccessLogMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.route_paths = None
+
+    def route_path(self, scope):
+        # The route template ("/api/bookings/{booking_id}") rather than the
+        # raw path, so entries group by route
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return None
+        if self.route_paths is None:
+            self.route_paths = {
+                route.endpoint: route.path
+                for route in scope["app"].routes
+                if hasattr(route, "endpoint")
+            }
+        return self.route_paths.get(endpoint)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ACCESS_LOG_ENABLED:
+            return await self.app(scope, receive, send)
+
+        stats = {"db_calls": 0, "user_id": None}
+        token = _request_stats.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            latency_ms = (time.perf_counter() - start) * 1000
+            _request_stats.reset(token)
+            if status >= 500 or latency_ms >= ACCESS_LOG_SLOW_MS or random.random() < ACCESS_LOG_SAMPLE_RATE:
+                access_logger.info("request", extra={"fields": {
+                    "method": scope["method"],
+                    "route": self.route_path(scope),
+                    "path": scope["path"],
+                    "status": status,
+                    "latency_ms": round(latency_ms, 2),
+                    "user_id": stats["user_id"],
+                    "db_calls": stats["db_calls"]
+                }})
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne
+from pymongo.errors import OperationFailure, PyMongoError
+from dotenv import load_dotenv
+from utils import metrics
+from utils.access_log import APP_LOGGER
+from utils.cache import TTLCache, invalidate
+from utils.ids import refs_query
+from utils.leader import acquire_lease, release_lease
+
+load_dotenv()
+
+logger = logging.getLogger(APP_LOGGER)
+
+# Finished bookings older than this move to bookings_archive, together with
+# their payments (payments_archive)
+ARCHIVE_AFTER_MONTHS = float(os.getenv("ARCHIVE_AFTER_MONTHS", 12))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 500))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", 3600))
+ARCHIVER_ENABLED = os.getenv("ARCHIVER_ENABLED", "true").lower() == "true"
+
+ARCHIVABLE_STATUSES = ["completed", "cancelled", "expired"]
+ARCHIVER_LEASE = "archiver"
+
+# archive_state.archived_before per collection: older records may be in the
+# archive, newer ones never are. Workers cache it this long, so the archiver
+# publishes a new horizon and waits that long before moving anything.
+ARCHIVE_HORIZON_CACHE_SECONDS = 60
+_horizons = TTLCache(ttl=ARCHIVE_HORIZON_CACHE_SECONDS, max_entries=16)
+_use_transactions = True
+
+def archive_collection(collection: str) -> str:
+    return f"{collection}_archive"
+
+async def archived_before(db, collection: str):
+    horizon = _horizons.get(collection)
+    if horizon is None:
+        state = await db.archive_state.find_one({"_id": collection})
+        horizon = state["archived_before"] if state else False
+        _horizons.set(collection, horizon)
+    return horizon or None
+
+async def includes_archive(db, collection: str, since: datetime = None) -> bool:
+    # True when records from `since` onwards (all time if None) may be archived
+    horizon = await archived_before(db, collection)
+    return horizon is not None and (since is None or since < horizon)
+
+async def archive_query(db, collection: str, query: dict, since: datetime = None) -> dict:
+    # The whole archive when the range reaches the horizon, otherwise only the
+    # records archived ahead of it (sparse index on archived_early)
+    if await includes_archive(db, collection, since):
+        return query
+    return {**query, "archived_early": True}
+
+async def find_with_archive(db, collection: str, query: dict, projection: dict = None, since: datetime = None):
+    # Hot documents, followed by the archived ones in range
+    async for doc in db[collection].find(query, projection):
+        yield doc
+    archived = await archive_query(db, collection, query, since)
+    async for doc in db[archive_collection(collection)].find(archived, projection):
+        yield doc
+
+async def count_with_archive(db, collection: str, query: dict, since: datetime = None) -> int:
+    count = await db[collection].count_documents(query)
+    archived = await archive_query(db, collection, query, since)
+    return count + await db[archive_collection(collection)].count_documents(archived)
+
+async def advance_horizon(db, collection: str, archived_before: datetime):
+    await db.archive_state.update_one(
+        {"_id": collection},
+        {"$max": {"archived_before": archived_before}, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+    _horizons.delete(collection)
+
+def archived(doc: dict, now: datetime, horizon: datetime = None) -> dict:
+    # Records newer than the horizon (all of them without one) are marked, so
+    # lookups still find them before the horizon reaches them
+    created_at = doc.get("created_at")
+    if horizon is not None and created_at is not None and created_at < horizon:
+        return {**doc, "archived_at": now}
+    return {**doc, "archived_at": now, "archived_early": True}
+
+async def move_batch(db, bookings: list, session=None, horizon: datetime = None):
+    # Upserting by _id makes a retried or resumed batch harmless
+    now = datetime.utcnow()
+    ids = [booking["_id"] for booking in bookings]
+    payments = await db.payments.find({"booking_id": refs_query(ids)}, session=session).to_list(None)
+
+    if payments:
+        await db.payments_archive.bulk_write([
+            ReplaceOne({"_id": payment["_id"]}, archived(payment, now, horizon), upsert=True)
+            for payment in payments
+        ], ordered=False, session=session)
+        await db.payments.delete_many({"_id": {"$in": [payment["_id"] for payment in payments]}}, session=session)
+
+    await db.bookings_archive.bulk_write([
+        ReplaceOne({"_id": booking["_id"]}, archived(booking, now, horizon), upsert=True)
+        for booking in bookings
+    ], ordered=False, session=session)
+    await db.bookings.delete_many({"_id": {"$in": ids}, "status": {"$in": ARCHIVABLE_STATUSES}}, session=session)
+    return len(payments)
+
+async def archive_batch(db, bookings: list, horizon: datetime = None) -> int:
+    # One transaction per batch where the deployment supports it; without
+    # one an interrupted batch is simply redone by the next run
+    global _use_transactions
+    if _use_transactions:
+        try:
+            async with await db.client.start_session() as session:
+                return await session.with_transaction(lambda session: move_batch(db, bookings, session, horizon))
+        except OperationFailure as e:
+            # 20: transactions need a replica set
+            if e.code != 20:
+                raise
+            _use_transactions = False
+            logger.warning("Transactions unavailable, archiving without them")
+    return await move_batch(db, bookings, horizon=horizon)
+
+async def archive_old_records(db):
+    cutoff = datetime.utcnow() - timedelta(days=30 * ARCHIVE_AFTER_MONTHS)
+    query = {"status": {"$in": ARCHIVABLE_STATUSES}, "created_at": {"$lt": cutoff}}
+    total_bookings = 0
+    total_payments = 0
+
+    # Archived records drop out of the query, so every pass (and a run cut
+    # short by a restart) simply continues with whatever is left
+    while True:
+        bookings = await db.bookings.find(query).sort("created_at", 1).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not bookings:
+            break
+        if total_bookings == 0:
+            # Payments newer than the cutoff (a booking can be paid much later)
+            # are marked archived_early by move_batch instead
+            for collection in ("bookings", "payments"):
+                await advance_horizon(db, collection, cutoff)
+            await asyncio.sleep(ARCHIVE_HORIZON_CACHE_SECONDS)
+
+        total_payments += await archive_batch(db, bookings, cutoff)
+        total_bookings += len(bookings)
+
+    if total_bookings:
+        invalidate("bookings")
+        invalidate("payments")
+        await db.archive_state.update_one(
+            {"_id": "bookings"},
+            {"$set": {"last_run_at": datetime.utcnow()}, "$inc": {"archived": total_bookings}}
+        )
+    metrics.inc("archiver.bookings_archived", total_bookings)
+    metrics.inc("archiver.payments_archived", total_payments)
+    return total_bookings, total_payments
+
+async def run_archiver(db):
+    # Runs in every worker; the lease makes sure only one of them archives
+    lease_ttl = ARCHIVE_INTERVAL_SECONDS * 3
+    try:
+        while True:
+            try:
+                if await acquire_lease(db, ARCHIVER_LEASE, lease_ttl):
+                    bookings, payments = await archive_old_records(db)
+                    if bookings:
+                        logger.info("Archived %d bookings and %d payments", bookings, payments)
+            except PyMongoError as e:
+                logger.warning("Archiving failed: %s", e)
+
+            await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+    finally:
+        try:
+            await release_lease(db, ARCHIVER_LEASE)
+        except PyMongoError:
+            pass
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from dotenv import load_dotenv
+from utils import metrics
+from utils.access_log import APP_LOGGER
+
+load_dotenv()
+
+logger = logging.getLogger(APP_LOGGER)
+
+# Entries are buffered in memory and written with insert_many once
+# AUDIT_FLUSH_SIZE are waiting or every AUDIT_FLUSH_SECONDS. When
+# AUDIT_BUFFER_SIZE entries are waiting (the database is slow or down),
+# writers wait up to AUDIT_MAX_WAIT_SECONDS for room before the entry is
+# dropped and counted in audit.dropped.
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", 10000))
+AUDIT_FLUSH_SIZE = int(os.getenv("AUDIT_FLUSH_SIZE", 500))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", 1))
+AUDIT_MAX_WAIT_SECONDS = float(os.getenv("AUDIT_MAX_WAIT_SECONDS", 5))
+
+SYSTEM_ACTOR = "system"
+
+class AuditLog:
+    def __init__(self, max_size: int, flush_size: int, flush_seconds: float):
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.db = None
+        self._buffer = []
+        self._task = None
+        self._stopping = False
+        self._flush_now = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+
+        metrics.register_gauge("audit.buffered", lambda: len(self._buffer))
+
+    def start(self, db):
+        self.db = db
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Write out whatever is still buffered before the client closes. The
+        # loop is woken rather than cancelled so a flush is never cut short.
+        if self._task:
+            self._stopping = True
+            self._flush_now.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.db is not None:
+            await self.flush()
+
+    async def record(self, entity: str, entity_id, action: str, actor: str = None, data: dict = None):
+        entry = {
+            "entity": entity,
+            "entity_id": str(entity_id),
+            "action": action,
+            "actor": actor or SYSTEM_ACTOR,
+            "data": data or {},
+            "ts": datetime.utcnow()
+        }
+
+        # Backpressure: a full buffer makes writers wait for the next flush
+        if len(self._buffer) >= self.max_size:
+            self._flush_now.set()
+            deadline = asyncio.get_running_loop().time() + AUDIT_MAX_WAIT_SECONDS
+            while len(self._buffer) >= self.max_size:
+                self._space.clear()
+                timeout = deadline - asyncio.get_running_loop().time()
+                try:
+                    await asyncio.wait_for(self._space.wait(), timeout=max(timeout, 0))
+                except asyncio.TimeoutError:
+                    metrics.inc("audit.dropped")
+                    return
+
+        self._buffer.append(entry)
+        if len(self._buffer) >= self.flush_size:
+            self._flush_now.set()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        try:
+            await self.db.audit_log.insert_many(batch, ordered=False)
+            metrics.inc("audit.written", len(batch))
+        except BulkWriteError as e:
+            # Entries that made it on an earlier attempt come back as duplicates
+            failed = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+            if failed:
+                self.requeue([batch[error["index"]] for error in failed], e)
+        except PyMongoError as e:
+            self.requeue(batch, e)
+        except Exception as e:
+            # Not a database problem, e.g. a value bson can't encode
+            # (InvalidDocument) failing the whole batch
+            await self.write_each(batch, e)
+        finally:
+            if len(self._buffer) < self.max_size:
+                self._space.set()
+
+    async def write_each(self, batch: list, error: Exception):
+        # Writes the entries one at a time so only the ones that can't be
+        # written are dropped; requeues the rest if the database goes away
+        logger.warning("Audit batch rejected (%s), writing entries one by one", error)
+        for i, entry in enumerate(batch):
+            try:
+                await self.db.audit_log.insert_one(entry)
+                metrics.inc("audit.written")
+            except DuplicateKeyError:
+                pass
+            except PyMongoError as e:
+                self.requeue(batch[i:], e)
+                return
+            except Exception as e:
+                logger.warning("Dropping audit entry for %s %s: %s", entry["entity"], entry["entity_id"], e)
+                metrics.inc("audit.dropped")
+
+    def requeue(self, batch: list, error: Exception):
+        # Keep the oldest entries for the next attempt, as far as they fit
+        logger.warning("Audit log flush failed: %s", error)
+        room = max(self.max_size - len(self._buffer), 0)
+        metrics.inc("audit.dropped", max(len(batch) - room, 0))
+        self._buffer[:0] = batch[:room]
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # The flusher must outlive any one bad batch, or every
+                # writer ends up waiting on a full buffer
+                logger.exception("Audit log flush failed")
+
+audit_log = AuditLog(AUDIT_BUFFER_SIZE, AUDIT_FLUSH_SIZE, AUDIT_FLUSH_SECONDS)
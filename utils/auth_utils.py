@@ -5,11 +5,27 @@ from fastapi import HTTPException, Security, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional
 import os
+import time
 from dotenv import load_dotenv
+from utils.access_log import note_user
 
 load_dotenv()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# If set, pick the cost at startup so one hash takes about this long
+BCRYPT_TARGET_MS = os.getenv("BCRYPT_TARGET_MS")
+
+def build_pwd_context(rounds: int) -> CryptContext:
+    # min == max == default, so needs_update() flags hashes of any other cost
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds
+    )
+
+pwd_context = build_pwd_context(BCRYPT_ROUNDS)
 security = HTTPBearer()
 
 JWT_SECRET = os.getenv("JWT_SECRET")
@@ -22,6 +38,29 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    return pwd_context.needs_update(hashed_password)
+
+def set_bcrypt_rounds(rounds: int):
+    global pwd_context, BCRYPT_ROUNDS
+    BCRYPT_ROUNDS = rounds
+    pwd_context = build_pwd_context(rounds)
+    # Inherited by forked workers so they all agree on the cost
+    os.environ["BCRYPT_ROUNDS"] = str(rounds)
+
+def calibrate_bcrypt_rounds(target_ms: float, min_rounds: int = 10, max_rounds: int = 16) -> int:
+    # Highest cost whose hash still fits in target_ms on this machine
+    rounds = min_rounds
+    for candidate in range(min_rounds, max_rounds + 1):
+        context = build_pwd_context(candidate)
+        start = time.perf_counter()
+        context.hash("calibration")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms > target_ms:
+            break
+        rounds = candidate
+    return rounds
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -43,6 +82,7 @@ def decode_token(token: str):
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Security(security)):
     token = credentials.credentials
     payload = decode_token(token)
+    note_user(payload.get("user_id"))
     return payload
 
 async def require_admin(current_user: dict = Depends(get_current_user)):
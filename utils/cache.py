@@ -0,0 +1,141 @@
+import logging
+import time
+from collections import OrderedDict
+from utils import metrics
+from utils.access_log import APP_LOGGER
+from utils.deadline import detached_task
+from utils.single_flight import single_flight
+
+logger = logging.getLogger(APP_LOGGER)
+
+class TTLCache:
+    # In-process cache with per-entry expiry and LRU eviction. Not shared
+    # between workers: register it with register_cache() so writes seen by
+    # the change stream listener clear it everywhere.
+
+    def __init__(self, ttl: float, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return default
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class StaleWhileRevalidateCache:
+    # Entries are fresh for fresh_ttl, then served stale for up to
+    # stale_ttl more while a background task recomputes them. Each entry
+    # keeps its compute function so refresh_all() can rebuild every cached
+    # parameter combination. Least recently used entries are evicted.
+
+    def __init__(self, name: str, fresh_ttl: float, stale_ttl: float, max_entries: int = 128):
+        self.name = name
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._refreshing = {}
+
+        metrics.register_gauge(f"cache.{name}.entries", lambda: len(self._entries))
+
+    async def get_or_compute(self, key, fn):
+        entry = self._entries.get(key)
+        now = time.monotonic()
+
+        if entry is not None:
+            value, fresh_until, stale_until, _ = entry
+            if now < fresh_until:
+                self._entries.move_to_end(key)
+                metrics.inc(f"cache.{self.name}.fresh_hits")
+                return value
+            if now < stale_until:
+                self._entries.move_to_end(key)
+                metrics.inc(f"cache.{self.name}.stale_hits")
+                self._refresh_in_background(key, fn)
+                return value
+
+        metrics.inc(f"cache.{self.name}.misses")
+        return await self.refresh(key, fn)
+
+    async def refresh(self, key, fn):
+        # Concurrent misses and refreshes of one key share a computation
+        value = await single_flight.do((self.name, key), fn)
+        self.set(key, value, fn)
+        return value
+
+    async def refresh_all(self):
+        keys = list(self._entries)
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None:
+                await self.refresh(key, entry[3])
+        return keys
+
+    def set(self, key, value, fn):
+        now = time.monotonic()
+        self._entries[key] = (value, now + self.fresh_ttl, now + self.fresh_ttl + self.stale_ttl, fn)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def _refresh_in_background(self, key, fn):
+        if key in self._refreshing:
+            return
+
+        async def run():
+            try:
+                await self.refresh(key, fn)
+            except Exception as e:
+                # Keep serving the stale value; the next stale hit retries
+                logger.warning("Background refresh of %s cache failed: %s", self.name, e)
+            finally:
+                self._refreshing.pop(key, None)
+
+        # Keep a reference so the task isn't garbage collected mid-flight;
+        # detached from the request that noticed the stale entry
+        self._refreshing[key] = detached_task(run)
+
+    def __len__(self):
+        return len(self._entries)
+
+# Collection name -> local caches built from that collection
+_registry = {}
+
+def register_cache(collection: str, cache):
+    _registry.setdefault(collection, []).append(cache)
+    return cache
+
+def invalidate(collection: str):
+    for cache in _registry.get(collection, []):
+        cache.clear()
+
+def invalidate_all():
+    for collection in _registry:
+        invalidate(collection)
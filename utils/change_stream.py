@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from pymongo.errors import OperationFailure, PyMongoError
+from dotenv import load_dotenv
+from utils.access_log import APP_LOGGER
+from utils.cache import invalidate, invalidate_all
+
+load_dotenv()
+
+logger = logging.getLogger(APP_LOGGER)
+
+WATCHED_COLLECTIONS = ["products", "users", "bookings", "payments"]
+
+# Resume tokens are stored under this name in the change_stream_tokens collection
+CHANGE_STREAM_NAME = os.getenv("CHANGE_STREAM_NAME", "cache-invalidation")
+CHANGE_STREAM_RETRY_SECONDS = float(os.getenv("CHANGE_STREAM_RETRY_SECONDS", 5))
+RESUME_TOKEN_SAVE_SECONDS = float(os.getenv("RESUME_TOKEN_SAVE_SECONDS", 5))
+
+# Callbacks run for every change, after local caches are cleared
+_change_handlers = []
+# Listeners currently receiving events from MongoDB
+_active_listeners = set()
+
+def on_change(handler):
+    _change_handlers.append(handler)
+    return handler
+
+def run_change_handlers(change: dict):
+    for handler in _change_handlers:
+        try:
+            handler(change)
+        except Exception:
+            logger.exception("Change handler failed")
+
+def notify_change(collection: str, operation: str, doc_id, document: dict = None):
+    # Write paths report their own changes. Local caches are cleared right
+    # away; while a change stream is running, handlers get the change from
+    # MongoDB (in every worker) instead of from here.
+    invalidate(collection)
+    if _active_listeners:
+        return
+    run_change_handlers({
+        "ns": {"coll": collection},
+        "operationType": operation,
+        "documentKey": {"_id": doc_id},
+        "fullDocument": document
+    })
+
+# Standalone servers don't support change streams
+CHANGE_STREAM_UNSUPPORTED = {40573}
+# The stored resume token can no longer be used
+RESUME_TOKEN_INVALID = {260, 280, 286}
+
+class ChangeStreamListener:
+    # Watches the app collections and clears the registered local caches
+    # (and runs the on_change handlers) when any worker or replica writes
+    # to them. Without a replica set caches fall back to their TTL and
+    # handlers are fed by notify_change() from this worker's writes.
+
+    def __init__(self, db, name: str = CHANGE_STREAM_NAME):
+        self.db = db
+        self.name = name
+        self._task = None
+        self._resume_token = None
+        self._saved_at = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self in _active_listeners
+
+    @active.setter
+    def active(self, value: bool):
+        if value:
+            _active_listeners.add(self)
+        else:
+            _active_listeners.discard(self)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self.active = False
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+        await self._save_resume_token(force=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAM_UNSUPPORTED:
+                    logger.warning("Change streams not available, caches fall back to TTL only")
+                    return
+                if e.code in RESUME_TOKEN_INVALID:
+                    logger.warning("Change stream resume token expired, starting from now")
+                    self._resume_token = None
+                    await self.db.change_stream_tokens.delete_one({"_id": self.name})
+                    invalidate_all()
+                    continue
+                logger.warning("Change stream error: %s", e)
+            except PyMongoError as e:
+                logger.warning("Change stream error: %s", e)
+
+            await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+
+    async def _watch(self):
+        if self._resume_token is None:
+            saved = await self.db.change_stream_tokens.find_one({"_id": self.name})
+            if saved:
+                self._resume_token = saved["token"]
+
+        pipeline = [{"$match": {"ns.coll": {"$in": WATCHED_COLLECTIONS}}}]
+        async with self.db.watch(pipeline, full_document="updateLookup", resume_after=self._resume_token) as stream:
+            self.active = True
+            # Writes made while we were not listening may already be cached
+            invalidate_all()
+
+            try:
+                async for change in stream:
+                    invalidate(change["ns"]["coll"])
+                    run_change_handlers(change)
+                    self._resume_token = stream.resume_token
+                    await self._save_resume_token()
+            finally:
+                self.active = False
+
+    async def _save_resume_token(self, force: bool = False):
+        # Throttled so a busy stream doesn't turn into a write per event
+        if self._resume_token is None:
+            return
+        if not force and time.monotonic() - self._saved_at < RESUME_TOKEN_SAVE_SECONDS:
+            return
+
+        self._saved_at = time.monotonic()
+        try:
+            await self.db.change_stream_tokens.update_one(
+                {"_id": self.name},
+                {"$set": {"token": self._resume_token, "updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+        except PyMongoError as e:
+            logger.warning("Could not save change stream resume token: %s", e)
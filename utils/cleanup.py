@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from dotenv import load_dotenv
+from utils import metrics
+from utils.access_log import APP_LOGGER
+from utils.audit import audit_log
+from utils.archive import ARCHIVABLE_STATUSES, archive_batch
+from utils.ids import ref_query
+from utils.leader import worker_id
+from utils.stock_counters import release_stock
+
+load_dotenv()
+
+logger = logging.getLogger(APP_LOGGER)
+
+# Deleting a product or user queues a cleanup job; a background worker then
+# cancels, and archives, their bookings and payments in bounded batches
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", 200))
+CLEANUP_POLL_SECONDS = float(os.getenv("CLEANUP_POLL_SECONDS", 5))
+# A job whose worker stopped renewing this long ago is picked up again
+CLEANUP_LEASE_SECONDS = float(os.getenv("CLEANUP_LEASE_SECONDS", 120))
+
+# Booking field that references the deleted document
+CLEANUP_KINDS = {
+    "product": "product_id",
+    "user": "user_id"
+}
+
+# Set by enqueue_cleanup so this worker starts right away
+_wakeup = asyncio.Event()
+
+async def enqueue_cleanup(db, kind: str, target_id: str):
+    now = datetime.utcnow()
+    result = await db.cleanup_jobs.insert_one({
+        "kind": kind,
+        "target_id": target_id,
+        "status": "queued",
+        "progress": {"bookings": 0, "payments": 0, "stock_restored": 0},
+        "created_at": now,
+        "updated_at": now
+    })
+    _wakeup.set()
+    return result.inserted_id
+
+async def claim_job(db):
+    now = datetime.utcnow()
+    return await db.cleanup_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued"},
+            # Left behind by a worker that died
+            {"status": "running", "lease_until": {"$lt": now}}
+        ]},
+        {"$set": {
+            "status": "running",
+            "worker": worker_id(),
+            "lease_until": now + timedelta(seconds=CLEANUP_LEASE_SECONDS),
+            "updated_at": now
+        }},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def cleanup_batch(db, job: dict, bookings: list) -> tuple:
+    job_id = job["_id"]
+    ids = [booking["_id"] for booking in bookings]
+
+    # Cancel the ones still holding stock, marked with the job so a retried
+    # batch can tell which bookings still owe their stock back
+    await db.bookings.update_many(
+        {"_id": {"$in": ids}, "status": {"$nin": ARCHIVABLE_STATUSES}},
+        {"$set": {"status": "cancelled", "cleanup_job": job_id, "updated_at": datetime.utcnow()}}
+    )
+    # Claim the bookings still owed their stock with a marker unique to this
+    # attempt before any stock moves. A retry after a crash leaves bookings an
+    # earlier attempt claimed alone: their stock may stay out, but it is never
+    # given back twice.
+    attempt = ObjectId()
+    await db.bookings.update_many(
+        {"_id": {"$in": ids}, "cleanup_job": job_id, "stock_restored": {"$ne": True}, "stock_restoring": {"$exists": False}},
+        {"$set": {"stock_restoring": attempt}}
+    )
+    owed = await db.bookings.find(
+        {"_id": {"$in": ids}, "stock_restoring": attempt},
+        {"product_id": 1, "quantity": 1}
+    ).to_list(None)
+
+    # Stock goes back to surviving products only, one write per product
+    restored = 0
+    if job["kind"] != "product":
+        released = {}
+        for booking in owed:
+            product_id = str(booking["product_id"])
+            released[product_id] = released.get(product_id, 0) + booking["quantity"]
+        for product_id, quantity in released.items():
+            await release_stock(db, ObjectId(product_id), quantity)
+            restored += quantity
+    for booking in owed:
+        await audit_log.record("booking", booking["_id"], "cancelled", data={"cleanup_job": str(job_id)})
+    if owed:
+        await db.bookings.update_many({"_id": {"$in": [booking["_id"] for booking in owed]}}, {"$set": {"stock_restored": True}})
+
+    # Archived without a horizon: every record is marked archived_early, so
+    # lookups find them without moving the horizon for all reports
+    bookings = await db.bookings.find({"_id": {"$in": ids}}).to_list(None)
+    payments = await archive_batch(db, bookings)
+    return len(bookings), payments, restored
+
+async def run_job(db, job: dict):
+    field = CLEANUP_KINDS[job["kind"]]
+    query = {field: ref_query(job["target_id"])}
+
+    while True:
+        bookings = await db.bookings.find(query, {"_id": 1}).limit(CLEANUP_BATCH_SIZE).to_list(CLEANUP_BATCH_SIZE)
+        if not bookings:
+            break
+
+        count, payments, restored = await cleanup_batch(db, job, bookings)
+        metrics.inc("cleanup.bookings", count)
+        await db.cleanup_jobs.update_one(
+            {"_id": job["_id"]},
+            {
+                "$inc": {
+                    "progress.bookings": count,
+                    "progress.payments": payments,
+                    "progress.stock_restored": restored
+                },
+                "$set": {
+                    "lease_until": datetime.utcnow() + timedelta(seconds=CLEANUP_LEASE_SECONDS),
+                    "updated_at": datetime.utcnow()
+                }
+            }
+        )
+
+    await db.cleanup_jobs.update_one(
+        {"_id": job["_id"]},
+        {"$set": {"status": "done", "finished_at": datetime.utcnow(), "updated_at": datetime.utcnow()}}
+    )
+
+async def run_cleanup_worker(db):
+    while True:
+        try:
+            job = await claim_job(db)
+            while job is not None:
+                try:
+                    await run_job(db, job)
+                except PyMongoError as e:
+                    # Stays "running" until the lease runs out, then is retried
+                    logger.warning("Cleanup job %s failed: %s", job["_id"], e)
+                    await db.cleanup_jobs.update_one({"_id": job["_id"]}, {"$set": {"error": str(e)}})
+                    break
+                job = await claim_job(db)
+        except PyMongoError as e:
+            logger.warning("Cleanup worker failed: %s", e)
+
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=CLEANUP_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
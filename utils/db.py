@@ -0,0 +1,61 @@
+import os
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+from utils.access_log import command_counter
+
+load_dotenv()
+
+DB_NAME = "outdoorcamp"
+
+# Each workload class gets its own client, so its own connection pool,
+# read preference and timeouts. Checkouts and other writes stay on the
+# primary; report scans go to secondaries when the deployment has them.
+# Every setting can be overridden with MONGO_<WORKLOAD>_<SETTING>, e.g.
+# MONGO_REPORTS_MAX_STALENESS_SECONDS=120.
+WORKLOAD_DEFAULTS = {
+    "default": {
+        "READ_PREFERENCE": "primary",
+        "MAX_STALENESS_SECONDS": "0",
+        "MAX_POOL_SIZE": "100",
+        "TIMEOUT_MS": "10000",
+        "SERVER_SELECTION_TIMEOUT_MS": "5000",
+        "SOCKET_TIMEOUT_MS": "20000"
+    },
+    "reports": {
+        "READ_PREFERENCE": "secondaryPreferred",
+        "MAX_STALENESS_SECONDS": "120",
+        "MAX_POOL_SIZE": "10",
+        "TIMEOUT_MS": "30000",
+        "SERVER_SELECTION_TIMEOUT_MS": "5000",
+        "SOCKET_TIMEOUT_MS": "60000"
+    }
+}
+
+def workload_options(workload: str) -> dict:
+    settings = {
+        name: os.getenv(f"MONGO_{workload.upper()}_{name}", default)
+        for name, default in WORKLOAD_DEFAULTS[workload].items()
+    }
+    options = {
+        "readPreference": settings["READ_PREFERENCE"],
+        "maxPoolSize": int(settings["MAX_POOL_SIZE"]),
+        # Bounds every operation, including server selection and pool waits;
+        # inside a request the request deadline (utils.deadline) applies instead
+        "timeoutMS": int(settings["TIMEOUT_MS"]),
+        # Give up on an unreachable cluster quickly instead of queueing work
+        "serverSelectionTimeoutMS": int(settings["SERVER_SELECTION_TIMEOUT_MS"]),
+        # Only used when TIMEOUT_MS is 0 (no deadline): a stuck socket still fails
+        "socketTimeoutMS": int(settings["SOCKET_TIMEOUT_MS"])
+    }
+    # MongoDB rejects a staleness bound on primary reads and anything under 90s
+    staleness = int(settings["MAX_STALENESS_SECONDS"])
+    if settings["READ_PREFERENCE"] != "primary" and staleness > 0:
+        options["maxStalenessSeconds"] = max(staleness, 90)
+    return options
+
+def connect(workload: str = "default") -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(
+        os.getenv("MONGO_URI"),
+        event_listeners=[command_counter],
+        **workload_options(workload)
+    )
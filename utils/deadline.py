@@ -0,0 +1,79 @@
+import asyncio
+import contextvars
+import os
+import pymongo
+from fastapi.responses import JSONResponse
+from dotenv import load_dotenv
+from utils import metrics
+
+load_dotenv()
+
+# Seconds a request may take, per group, e.g. REQUEST_TIMEOUT_REPORTS=60.
+# Every MongoDB call made while handling the request gets what is left as
+# its maxTimeMS / socket timeout (pymongo.timeout), and fails with a 504
+# instead of hanging once the deadline has passed.
+DEFAULT_TIMEOUTS = {
+    "reports": 30,
+    "reconcile": 300,
+    "default": 10
+}
+
+# Path prefix -> group, first match wins; anything else under /api is "default"
+ROUTE_GROUPS = [
+    ("/api/reports", "reports"),
+    ("/api/payments/reconcile", "reconcile")
+]
+
+# Long-lived event streams have no deadline
+EXEMPT_PREFIXES = ("/api/events",)
+
+# Deadline for work shared between requests (see detached_task)
+SHARED_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT_SHARED", 30))
+
+def detached_task(fn) -> asyncio.Task:
+    # Runs fn() as a task that does not inherit the current request's
+    # context: a computation other requests join (single-flight, background
+    # cache refreshes) must not die at the first caller's deadline, nor count
+    # towards its access log. It gets its own deadline instead.
+    async def run():
+        with pymongo.timeout(SHARED_TIMEOUT):
+            return await fn()
+    return contextvars.Context().run(asyncio.create_task, run())
+
+async def timeout_handler(request, exc: pymongo.errors.PyMongoError):
+    # Registered for PyMongoError: deadline/timeouts become 504, anything
+    # else stays a 500
+    if not exc.timeout:
+        raise exc
+    metrics.inc("deadline.timeouts")
+    return JSONResponse(status_code=504, content={"detail": "Database did not respond in time"})
+
+class DeadlineMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.timeouts = {
+            group: float(os.getenv(f"REQUEST_TIMEOUT_{group.upper()}", default))
+            for group, default in DEFAULT_TIMEOUTS.items()
+        }
+
+    def route_group(self, path: str):
+        if not path.startswith("/api") or path.startswith(EXEMPT_PREFIXES):
+            return None
+        for prefix, group in ROUTE_GROUPS:
+            if path.startswith(prefix):
+                return group
+        return "default"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        group = self.route_group(scope["path"])
+        if group is None:
+            return await self.app(scope, receive, send)
+
+        # pymongo keeps the deadline in a context variable, and Motor copies
+        # the context into its executor threads, so every call the handler
+        # makes (cursor getMores included) runs against what is left of it
+        with pymongo.timeout(self.timeouts[group]):
+            await self.app(scope, receive, send)
@@ -0,0 +1,93 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+from utils import metrics
+from utils.change_stream import on_change
+
+load_dotenv()
+
+# Events buffered per client before it is considered too slow and dropped
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", 100))
+
+# Audience for events only admins may see
+ADMINS = "admins"
+
+class Subscriber:
+    __slots__ = ("user_id", "is_admin", "queue")
+
+    def __init__(self, user_id: str, is_admin: bool):
+        self.user_id = user_id
+        self.is_admin = is_admin
+        self.queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+
+class Broadcaster:
+    # One per worker. Publishing never blocks: a client whose queue is
+    # full gets a None sentinel (its stream then closes) and is removed.
+
+    def __init__(self):
+        self._subscribers = set()
+        metrics.register_gauge("events.subscribers", lambda: len(self._subscribers))
+
+    def subscribe(self, user_id: str, is_admin: bool) -> Subscriber:
+        subscriber = Subscriber(user_id, is_admin)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, event: dict, audience=None):
+        # audience: None for everyone, ADMINS, or a user id (admins see all)
+        for subscriber in list(self._subscribers):
+            if audience is not None and not subscriber.is_admin and subscriber.user_id != audience:
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+
+        metrics.inc("events.published")
+
+    def _drop(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+        metrics.inc("events.dropped_subscribers")
+
+broadcaster = Broadcaster()
+
+@on_change
+def publish_change(change: dict):
+    collection = change["ns"]["coll"]
+    operation = change["operationType"]
+    doc_id = str(change["documentKey"]["_id"])
+    doc = change.get("fullDocument") or {}
+
+    if collection == "products":
+        if operation == "delete":
+            broadcaster.publish({"type": "product_deleted", "product_id": doc_id})
+        elif "stock" in doc:
+            broadcaster.publish({
+                "type": "stock",
+                "product_id": doc_id,
+                "stock": doc["stock"],
+                "status": doc.get("status")
+            })
+
+    elif collection == "bookings":
+        # Deletes from the change stream carry no document, so no owner
+        audience = str(doc["user_id"]) if "user_id" in doc else ADMINS
+        broadcaster.publish({
+            "type": "booking",
+            "booking_id": doc_id,
+            "status": "cancelled" if operation == "delete" else doc.get("status")
+        }, audience)
+
+    elif collection == "payments" and operation != "delete":
+        broadcaster.publish({
+            "type": "payment",
+            "payment_id": doc_id,
+            "booking_id": str(doc.get("booking_id")),
+            "status": doc.get("status")
+        }, ADMINS)
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo.errors import DuplicateKeyError
+from dotenv import load_dotenv
+from utils.cache import TTLCache
+
+load_dotenv()
+
+# Keys are remembered this long (TTL index on idempotency_keys.created_at)
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 86400))
+
+# Completed responses kept in memory so most replays skip the database
+_completed = TTLCache(ttl=min(IDEMPOTENCY_TTL_SECONDS, 600), max_entries=10000)
+
+def request_fingerprint(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(jsonable_encoder(payload), sort_keys=True).encode()).hexdigest()
+
+def replay(record: dict) -> JSONResponse:
+    return JSONResponse(content=record["response"], headers={"Idempotent-Replayed": "true"})
+
+def check_fingerprint(record: dict, fingerprint: str):
+    if record["fingerprint"] != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+
+async def run_idempotent(db, key, scope: str, payload: dict, handler):
+    # Runs handler() once per (scope, key). Retries get the stored response
+    # without running it again; failed attempts are forgotten so they can
+    # be retried.
+    if not key:
+        return await handler()
+
+    record_id = f"{scope}:{key}"
+    fingerprint = request_fingerprint(payload)
+
+    record = _completed.get(record_id)
+    if record is not None:
+        check_fingerprint(record, fingerprint)
+        return replay(record)
+
+    try:
+        # The unique _id makes concurrent retries race for one insert
+        await db.idempotency_keys.insert_one({
+            "_id": record_id,
+            "fingerprint": fingerprint,
+            "state": "in_progress",
+            "created_at": datetime.utcnow()
+        })
+    except DuplicateKeyError:
+        record = await db.idempotency_keys.find_one({"_id": record_id})
+        if record is None or record["state"] != "done":
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        check_fingerprint(record, fingerprint)
+        _completed.set(record_id, record)
+        return replay(record)
+
+    try:
+        response = await handler()
+    except BaseException:
+        await db.idempotency_keys.delete_one({"_id": record_id})
+        raise
+
+    record = {"fingerprint": fingerprint, "state": "done", "response": jsonable_encoder(response)}
+    await db.idempotency_keys.update_one({"_id": record_id}, {"$set": record})
+    _completed.set(record_id, record)
+    return response
@@ -0,0 +1,58 @@
+import os
+from datetime import datetime, timezone
+from bson import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# During the typed-storage rollout (scripts/migrate_typed_storage.py) reads
+# accept both the old string references/dates and the new ObjectId/BSON
+# date ones. Turn TYPED_STORAGE on once every worker runs this code so new
+# documents are written in the typed format too.
+TYPED_STORAGE = os.getenv("TYPED_STORAGE", "false").lower() == "true"
+
+def ref_variants(value) -> list:
+    # Both stored forms of a reference, for matching either format
+    value = str(value)
+    try:
+        return [value, ObjectId(value)]
+    except (InvalidId, TypeError):
+        return [value]
+
+def ref_query(value) -> dict:
+    return {"$in": ref_variants(value)}
+
+def refs_query(values) -> dict:
+    return {"$in": [variant for value in values for variant in ref_variants(value)]}
+
+def to_ref(value):
+    if TYPED_STORAGE:
+        try:
+            return ObjectId(str(value))
+        except (InvalidId, TypeError):
+            pass
+    return str(value)
+
+def parse_date(value):
+    # Free-form date strings become datetimes where they can be parsed
+    if isinstance(value, datetime) or not isinstance(value, str):
+        return value
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return value
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def to_date(value):
+    return parse_date(value) if TYPED_STORAGE else value
+
+def date_str(value):
+    # API responses keep returning dates as strings
+    if isinstance(value, datetime):
+        if value.hour == value.minute == value.second == value.microsecond == 0:
+            return value.strftime("%Y-%m-%d")
+        return value.isoformat()
+    return value
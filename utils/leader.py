@@ -0,0 +1,27 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+
+def worker_id() -> str:
+    # Evaluated on each call so forked workers get their own pid
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+async def acquire_lease(db, name: str, ttl_seconds: float) -> bool:
+    # Take or renew the named lease. Only one worker across all processes
+    # and replicas holds it; an expired lease can be taken over.
+    now = datetime.utcnow()
+    owner = worker_id()
+    try:
+        await db.leases.update_one(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl_seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # Held by someone else: the upsert tried to insert the same _id
+        return False
+
+async def release_lease(db, name: str):
+    await db.leases.delete_one({"_id": name, "owner": worker_id()})
@@ -0,0 +1,171 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from fastapi.responses import JSONResponse
+from dotenv import load_dotenv
+from utils import metrics
+
+load_dotenv()
+
+# "concurrency:queue:deadline_seconds" per group, e.g. LOAD_SHED_REPORTS=4:64:10
+DEFAULT_LIMITS = {
+    "global": "256:1024:5",
+    "reports": "4:64:10",
+    "bookings": "64:256:5",
+    "products": "128:512:3",
+    "default": "64:256:5"
+}
+
+# Path prefix -> group; anything else under /api falls into "default"
+ROUTE_GROUPS = [
+    ("/api/reports", "reports"),
+    ("/api/bookings", "bookings"),
+    ("/api/products", "products")
+]
+
+# Never shed the health check, long-lived event streams or non-API routes
+EXEMPT_PREFIXES = ("/api/health", "/api/events")
+
+# Lower is served first when requests are queued
+PRIORITY_READ = 0
+PRIORITY_WRITE = 1
+PRIORITY_REPORT = 2
+
+def parse_limits(value: str):
+    limit, max_queue, deadline = value.split(":")
+    return int(limit), int(max_queue), float(deadline)
+
+class ConcurrencyLimiter:
+    # At most `limit` requests run at once; up to `max_queue` more wait in
+    # priority order for at most `deadline` seconds. A request whose
+    # estimated wait already exceeds the deadline is rejected immediately.
+
+    def __init__(self, name: str, limit: int, max_queue: int, deadline: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.in_flight = 0
+        self.waiting = 0
+        self.avg_latency = 0.0
+        self._waiters = []
+        self._seq = itertools.count()
+
+        metrics.register_gauge(f"load_shedding.{name}.in_flight", lambda: self.in_flight)
+        metrics.register_gauge(f"load_shedding.{name}.waiting", lambda: self.waiting)
+        metrics.register_gauge(f"load_shedding.{name}.limit", lambda: self.limit)
+        metrics.register_gauge(f"load_shedding.{name}.avg_latency_ms", lambda: round(self.avg_latency * 1000, 2))
+
+    def estimated_wait(self) -> float:
+        return (self.waiting + 1) / self.limit * self.avg_latency
+
+    async def acquire(self, priority: int, deadline_at: float) -> bool:
+        if self.in_flight < self.limit and not self.waiting:
+            self.in_flight += 1
+            return True
+
+        timeout = deadline_at - time.monotonic()
+        if self.waiting >= self.max_queue or timeout <= 0 or self.estimated_wait() > timeout:
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self.waiting += 1
+        try:
+            await asyncio.wait({future}, timeout=timeout)
+        except asyncio.CancelledError:
+            # Client went away; give back a slot handed over meanwhile
+            if future.done():
+                self.release(0)
+            else:
+                future.cancel()
+                self.waiting -= 1
+            raise
+
+        if future.done():
+            return True
+
+        future.cancel()
+        self.waiting -= 1
+        return False
+
+    def release(self, latency: float):
+        if latency:
+            self.avg_latency = latency if not self.avg_latency else 0.9 * self.avg_latency + 0.1 * latency
+
+        # Hand the slot straight to the best waiter
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.waiting -= 1
+                future.set_result(True)
+                return
+
+        self.in_flight -= 1
+
+class LoadSheddingMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.limiters = {
+            group: ConcurrencyLimiter(group, *parse_limits(os.getenv(f"LOAD_SHED_{group.upper()}", default)))
+            for group, default in DEFAULT_LIMITS.items()
+        }
+
+    def route_group(self, path: str):
+        if not path.startswith("/api") or path.startswith(EXEMPT_PREFIXES):
+            return None
+        for prefix, group in ROUTE_GROUPS:
+            if path.startswith(prefix):
+                return group
+        return "default"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        group = self.route_group(scope["path"])
+        if group is None:
+            return await self.app(scope, receive, send)
+
+        if group == "reports":
+            priority = PRIORITY_REPORT
+        elif scope["method"] in ("GET", "HEAD"):
+            priority = PRIORITY_READ
+        else:
+            priority = PRIORITY_WRITE
+
+        group_limiter = self.limiters[group]
+        global_limiter = self.limiters["global"]
+        deadline_at = time.monotonic() + group_limiter.deadline
+
+        if not await group_limiter.acquire(priority, deadline_at):
+            return await self.reject(group_limiter, scope, receive, send)
+        try:
+            if not await global_limiter.acquire(priority, deadline_at):
+                group_limiter.release(0)
+                return await self.reject(global_limiter, scope, receive, send)
+        except asyncio.CancelledError:
+            group_limiter.release(0)
+            raise
+
+        metrics.inc(f"load_shedding.{group}.admitted")
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            latency = time.monotonic() - start
+            global_limiter.release(latency)
+            group_limiter.release(latency)
+
+    async def reject(self, limiter: ConcurrencyLimiter, scope, receive, send):
+        metrics.inc(f"load_shedding.{limiter.name}.shed")
+        retry_after = max(1, math.ceil(limiter.estimated_wait()))
+        response = JSONResponse(
+            status_code=503,
+            content={"detail": "Server busy, please try again later"},
+            headers={"Retry-After": str(retry_after)}
+        )
+        await response(scope, receive, send)
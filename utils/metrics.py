@@ -0,0 +1,18 @@
+from collections import defaultdict
+
+# Per-worker, in-process metrics exposed at GET /api/metrics
+_counters = defaultdict(int)
+_gauges = {}
+
+def inc(name: str, value=1):
+    _counters[name] += value
+
+def register_gauge(name: str, fn):
+    # fn is called when metrics are read, so gauges cost nothing in between
+    _gauges[name] = fn
+
+def snapshot() -> dict:
+    return {
+        "counters": dict(_counters),
+        "gauges": {name: fn() for name, fn in _gauges.items()}
+    }
@@ -0,0 +1,175 @@
+import asyncio
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from datetime import datetime
+from dotenv import load_dotenv
+from utils import metrics
+from utils.access_log import APP_LOGGER
+from utils.auth_utils import decode_token
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+load_dotenv()
+
+logger = logging.getLogger(APP_LOGGER)
+
+# Off by default: the middleware is then not installed at all. When on, an
+# admin request with "X-Profile: 1" is profiled, as is PROFILE_SAMPLE_RATE
+# (0..1) of all requests.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Oldest profiles are deleted beyond this many
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 50))
+
+# Long-lived event streams would hold the profiler for the whole connection
+EXEMPT_PREFIXES = ("/api/events",)
+
+PROFILE_ID = re.compile(r"^[0-9T]{21}-[0-9a-f]{8}$")
+
+# Only one profiler can hook the event loop thread at a time; requests
+# arriving meanwhile simply run unprofiled
+_active = False
+
+def new_profile_id() -> str:
+    return f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+
+def profile_path(profile_id: str, ext: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{profile_id}.{ext}")
+
+def list_profiles() -> list:
+    # Newest first, from the metadata written next to each profile
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if name.endswith(".json"):
+            try:
+                with open(os.path.join(PROFILE_DIR, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return profiles
+
+def find_profile(profile_id: str):
+    # Path of the profile file, or None (also for anything that is not an id)
+    if not PROFILE_ID.match(profile_id):
+        return None
+    for ext in ("html", "prof"):
+        path = profile_path(profile_id, ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+def is_admin_request(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer":
+                return False
+            try:
+                return decode_token(token).get("role") == "admin"
+            except Exception:
+                return False
+    return False
+
+def wants_profile(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"x-profile":
+            return value == b"1" and is_admin_request(scope)
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def save_profile(profile_id: str, profiler, meta: dict):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    if Profiler is not None and isinstance(profiler, Profiler):
+        ext = "html"
+        with open(profile_path(profile_id, ext), "w") as f:
+            f.write(profiler.output_html())
+    else:
+        # Open with snakeviz or `python -m pstats`
+        ext = "prof"
+        profiler.dump_stats(profile_path(profile_id, ext))
+
+    with open(profile_path(profile_id, "json"), "w") as f:
+        json.dump({**meta, "id": profile_id, "format": ext}, f)
+
+    # Rotate: ids start with the timestamp, so they sort oldest first
+    profile_ids = sorted(name[:-5] for name in os.listdir(PROFILE_DIR) if name.endswith(".json"))
+    for old_id in profile_ids[:-PROFILE_MAX_FILES]:
+        for old_ext in ("json", "html", "prof"):
+            try:
+                os.remove(profile_path(old_id, old_ext))
+            except FileNotFoundError:
+                pass
+
+class ProfilingMiddleware:
+    # pyinstrument samples the stack and, in async mode, attributes time
+    # spent awaiting Motor calls to the awaiting handler line. The cProfile
+    # fallback (pyinstrument not installed) also sees other requests the
+    # event loop runs meanwhile.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _active
+        if (
+            scope["type"] != "http"
+            or _active
+            or scope["path"].startswith(EXEMPT_PREFIXES)
+            or not wants_profile(scope)
+        ):
+            return await self.app(scope, receive, send)
+
+        # The response is held back until the profile is saved, so
+        # X-Profile-Id is only sent for a profile that exists. Event streams,
+        # the only responses that never end, are exempt.
+        messages = []
+
+        async def hold(message):
+            messages.append(message)
+
+        _active = True
+        profiler = Profiler(async_mode="enabled") if Profiler is not None else cProfile.Profile()
+        start = time.perf_counter()
+        if Profiler is not None:
+            profiler.start()
+        else:
+            profiler.enable()
+        try:
+            await self.app(scope, receive, hold)
+        finally:
+            if Profiler is not None:
+                profiler.stop()
+            else:
+                profiler.disable()
+            _active = False
+
+        profile_id = new_profile_id()
+        meta = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": messages[0]["status"] if messages else None,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+            "created_at": datetime.utcnow().isoformat() + "Z"
+        }
+        try:
+            await asyncio.to_thread(save_profile, profile_id, profiler, meta)
+            metrics.inc("profiling.captured")
+        except OSError as e:
+            logger.warning("Saving profile %s failed: %s", profile_id, e)
+            profile_id = None
+
+        for message in messages:
+            if message["type"] == "http.response.start" and profile_id:
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]
+            await send(message)
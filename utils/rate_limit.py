@@ -0,0 +1,102 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, Request
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Requests allowed per minute (sustained) and as an initial burst
+AUTH_IP_RATE_PER_MIN = float(os.getenv("AUTH_IP_RATE_PER_MIN", 20))
+AUTH_IP_BURST = int(os.getenv("AUTH_IP_BURST", 10))
+AUTH_EMAIL_RATE_PER_MIN = float(os.getenv("AUTH_EMAIL_RATE_PER_MIN", 5))
+AUTH_EMAIL_BURST = int(os.getenv("AUTH_EMAIL_BURST", 5))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+
+# Password hashes running at once; more than this is rejected, not queued
+PASSWORD_CONCURRENCY = int(os.getenv("PASSWORD_CONCURRENCY", os.cpu_count() or 1))
+
+# Only trust X-Forwarded-For behind a proxy that sets it (e.g. Railway)
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true"
+
+class TokenBucketLimiter:
+    # One (tokens, updated_at) tuple per key, kept in least-recently-used
+    # order. A bucket left alone for burst / rate seconds is full again,
+    # which is the same as not having one, so it is evicted.
+
+    def __init__(self, rate_per_min: float, burst: int, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate = rate_per_min / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self.idle_seconds = burst / self.rate
+        self._buckets = OrderedDict()
+
+    def _refill(self, key, now: float) -> float:
+        tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        self._buckets[key] = (tokens, now)
+        return tokens
+
+    def retry_after(self, key) -> float:
+        # 0 if a token is available, otherwise seconds until one is; takes nothing
+        now = time.monotonic()
+        self._evict(now)
+        tokens = self._refill(key, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def consume(self, key):
+        # Only after retry_after(key) returned 0
+        tokens, updated_at = self._buckets[key]
+        self._buckets[key] = (tokens - 1, updated_at)
+
+    def _evict(self, now: float):
+        while self._buckets:
+            key, (tokens, updated_at) = next(iter(self._buckets.items()))
+            if now - updated_at < self.idle_seconds and len(self._buckets) < self.max_keys:
+                break
+            self._buckets.popitem(last=False)
+
+    def __len__(self):
+        return len(self._buckets)
+
+auth_ip_limiter = TokenBucketLimiter(AUTH_IP_RATE_PER_MIN, AUTH_IP_BURST)
+auth_email_limiter = TokenBucketLimiter(AUTH_EMAIL_RATE_PER_MIN, AUTH_EMAIL_BURST)
+password_slots = asyncio.Semaphore(PASSWORD_CONCURRENCY)
+
+def client_ip(request: Request) -> str:
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+def enforce_auth_rate_limit(request: Request, email: str):
+    # Called before any DB lookup or hashing so rejected requests stay cheap.
+    # Both buckets are checked before either is charged: requests the IP
+    # limit rejects must not use up the email's tokens (and lock its owner out).
+    ip = client_ip(request)
+    email = email.lower()
+    retry_after = max(auth_ip_limiter.retry_after(ip), auth_email_limiter.retry_after(email))
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many attempts, please try again later",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+    auth_ip_limiter.consume(ip)
+    auth_email_limiter.consume(email)
+
+@asynccontextmanager
+async def password_slot():
+    # Fail fast instead of queueing behind a burst of bcrypt work
+    if password_slots.locked():
+        raise HTTPException(
+            status_code=429,
+            detail="Server busy, please try again later",
+            headers={"Retry-After": "1"}
+        )
+    async with password_slots:
+        yield
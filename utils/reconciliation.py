@@ -0,0 +1,181 @@
+import csv
+import io
+import itertools
+import math
+import os
+from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+from utils.change_stream import notify_change
+from utils.audit import audit_log
+from utils.transitions import confirm_paid_bookings
+
+load_dotenv()
+
+# Rows per database round trip; memory use is bounded by one batch
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", 1000))
+# At most this many problem rows are listed in the report (all are counted)
+RECONCILE_REPORT_LIMIT = int(os.getenv("RECONCILE_REPORT_LIMIT", 1000))
+
+# Settlement files need these columns; an optional `status` column marks
+# rows the bank rejected ("failed"), anything else counts as settled
+REQUIRED_COLUMNS = {"transaction_id", "amount"}
+FAILED_STATUSES = {"failed", "rejected", "declined"}
+AMOUNT_TOLERANCE = 0.005
+
+class ReconciliationError(ValueError):
+    pass
+
+class ReconciliationReport:
+    def __init__(self, limit: int = RECONCILE_REPORT_LIMIT):
+        self.limit = limit
+        self.counts = {
+            "rows": 0,
+            "matched": 0,
+            "failed": 0,
+            "already_reconciled": 0,
+            "unmatched": 0,
+            "mismatched": 0,
+            "duplicate": 0,
+            "invalid": 0
+        }
+        self.issues = []
+
+    def add_issue(self, kind: str, line: int, transaction_id, **details):
+        self.counts[kind] += 1
+        if len(self.issues) < self.limit:
+            self.issues.append({"line": line, "transaction_id": transaction_id, "reason": kind, **details})
+
+    def to_dict(self) -> dict:
+        problems = sum(self.counts[kind] for kind in ("unmatched", "mismatched", "duplicate", "invalid"))
+        return {**self.counts, "issues": self.issues, "truncated": problems > len(self.issues)}
+
+def open_csv(binary_file):
+    # Wraps an open binary file (an upload or a local file) in a CSV reader;
+    # rows are pulled lazily so the file is never loaded as a whole
+    text = io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    columns = {name.strip().lower() for name in reader.fieldnames or []}
+    missing = REQUIRED_COLUMNS - columns
+    if missing:
+        raise ReconciliationError(f"Missing column(s): {', '.join(sorted(missing))}")
+    return reader
+
+def read_batch(reader, size: int) -> list:
+    # (line number, normalized row) pairs; the header is line 1
+    rows = []
+    for row in itertools.islice(reader, size):
+        rows.append((reader.line_num, {
+            (key or "").strip().lower(): (value or "").strip()
+            for key, value in row.items()
+        }))
+    return rows
+
+async def reconcile_batch(db, rows: list, report: ReconciliationReport, dry_run: bool, actor: str = None):
+    entries = {}
+    for line, row in rows:
+        report.counts["rows"] += 1
+        transaction_id = row.get("transaction_id")
+        try:
+            amount = float(row.get("amount", "").replace(",", ""))
+        except ValueError:
+            amount = math.nan
+        # nan would pass the tolerance check below against any amount
+        if not math.isfinite(amount):
+            report.add_issue("invalid", line, transaction_id, detail="Amount is not a number")
+            continue
+        if not transaction_id:
+            report.add_issue("invalid", line, transaction_id, detail="Missing transaction_id")
+            continue
+        # Repeats within the batch; a repeat in a later batch finds the
+        # payment already settled and counts as already_reconciled
+        if transaction_id in entries:
+            report.add_issue("duplicate", line, transaction_id)
+            continue
+        failed = row.get("status", "").lower() in FAILED_STATUSES
+        entries[transaction_id] = (line, amount, failed)
+
+    if not entries:
+        return
+
+    # One query for every payment in the batch (transaction_id index)
+    payments = {}
+    async for payment in db.payments.find(
+        {"transaction_id": {"$in": list(entries)}},
+        {"transaction_id": 1, "amount": 1, "status": 1, "booking_id": 1}
+    ):
+        payments[payment["transaction_id"]] = payment
+
+    # BSON dates keep milliseconds; truncating lets `now` be matched back below
+    now = datetime.utcnow()
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    payment_ops = []
+    settled = []
+    failed_payments = []
+    for transaction_id, (line, amount, failed) in entries.items():
+        payment = payments.get(transaction_id)
+        if payment is None:
+            report.add_issue("unmatched", line, transaction_id, amount=amount)
+            continue
+        if abs(payment["amount"] - amount) > AMOUNT_TOLERANCE:
+            report.add_issue("mismatched", line, transaction_id, expected=payment["amount"], amount=amount)
+            continue
+        # A failed payment the bank has since settled moves on to completed
+        if payment["status"] == "completed" or (payment["status"] == "failed" and failed):
+            report.counts["already_reconciled"] += 1
+            continue
+
+        status = "failed" if failed else "completed"
+        # The status guard keeps a concurrent manual update from being overwritten
+        payment_ops.append(UpdateOne(
+            {"_id": payment["_id"], "status": payment["status"]},
+            {"$set": {"status": status, "reconciled_at": now, "updated_at": now}}
+        ))
+        if failed:
+            failed_payments.append(payment)
+        else:
+            settled.append(payment)
+
+    if dry_run or not payment_ops:
+        report.counts["matched"] += len(settled)
+        report.counts["failed"] += len(failed_payments)
+        return
+
+    result = await db.payments.bulk_write(payment_ops, ordered=False)
+    if result.modified_count < len(payment_ops):
+        # Some payments changed status after they were read (a manual update
+        # or another reconciliation); only the ones this write changed count
+        changed = set()
+        async for payment in db.payments.find(
+            {"_id": {"$in": [payment["_id"] for payment in settled + failed_payments]}, "reconciled_at": now},
+            {"_id": 1}
+        ):
+            changed.add(payment["_id"])
+        report.counts["already_reconciled"] += len(payment_ops) - len(changed)
+        settled = [payment for payment in settled if payment["_id"] in changed]
+        failed_payments = [payment for payment in failed_payments if payment["_id"] in changed]
+    report.counts["matched"] += len(settled)
+    report.counts["failed"] += len(failed_payments)
+
+    for payment in settled:
+        notify_change("payments", "update", payment["_id"], {**payment, "status": "completed"})
+    for payments, status in ((settled, "completed"), (failed_payments, "failed")):
+        for payment in payments:
+            await audit_log.record("payment", payment["_id"], "reconciled", actor, {"from": payment["status"], "to": status})
+
+    # Confirm the bookings of settled payments, as PUT /api/payments/{id} does
+    if settled:
+        await confirm_paid_bookings(db, [payment["booking_id"] for payment in settled], actor)
+
+async def reconcile_file(db, binary_file, batch_size: int = RECONCILE_BATCH_SIZE, dry_run: bool = False, actor: str = None) -> dict:
+    # File reads and CSV parsing run in a thread, one batch at a time, so a
+    # large upload neither blocks the event loop nor fills memory
+    report = ReconciliationReport()
+    reader = await run_in_threadpool(open_csv, binary_file)
+    while True:
+        rows = await run_in_threadpool(read_batch, reader, batch_size)
+        if not rows:
+            break
+        await reconcile_batch(db, rows, report, dry_run, actor)
+    return report.to_dict()
@@ -0,0 +1,39 @@
+import asyncio
+from fastapi import Request
+from utils import metrics
+from utils.deadline import detached_task
+
+class SingleFlight:
+    # Concurrent calls with the same key share one in-flight computation.
+    # The computation runs as its own task, outside any caller's context and
+    # deadline, so a caller that disconnects or times out doesn't fail it for
+    # the others.
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = detached_task(fn)
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+            metrics.inc("single_flight.executed")
+        else:
+            metrics.inc("single_flight.shared")
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved even if every caller went away
+        if not task.cancelled():
+            task.exception()
+
+def flight_key(request: Request, scope: str) -> tuple:
+    # scope must capture everything that changes the result for the caller
+    # (e.g. "all" for public data, the user id for per-user data)
+    return (request.method, request.url.path, tuple(sorted(request.query_params.multi_items())), scope)
+
+single_flight = SingleFlight()
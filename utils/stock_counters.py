@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import os
+import random
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from dotenv import load_dotenv
+from utils import metrics
+from utils.access_log import APP_LOGGER
+from utils.cache import TTLCache
+from utils.change_stream import notify_change
+from utils.leader import acquire_lease, release_lease
+
+load_dotenv()
+
+logger = logging.getLogger(APP_LOGGER)
+
+# Hot products can spread their stock over several `stock_shards` documents
+# so concurrent bookings don't all write the same products document. While
+# a product is sharded, products.stock_shards holds the shard count and
+# products.stock is only a snapshot published by the rebalancer.
+MAX_STOCK_SHARDS = int(os.getenv("MAX_STOCK_SHARDS", 64))
+STOCK_SUM_TTL = float(os.getenv("STOCK_SUM_TTL", 1))
+STOCK_REBALANCE_SECONDS = float(os.getenv("STOCK_REBALANCE_SECONDS", 5))
+
+REBALANCER_LEASE = "stock-rebalancer"
+
+# Summed shard totals, so reads don't aggregate on every request
+_totals = TTLCache(ttl=STOCK_SUM_TTL, max_entries=1000)
+
+def shard_id(product_id, shard: int) -> str:
+    return f"{product_id}:{shard}"
+
+def split(total: int, shards: int) -> list:
+    base, extra = divmod(total, shards)
+    return [base + (1 if shard < extra else 0) for shard in range(shards)]
+
+async def sum_shards(db, product_id: ObjectId, session=None) -> int:
+    result = await db.stock_shards.aggregate([
+        {"$match": {"product_id": product_id}},
+        {"$group": {"_id": None, "stock": {"$sum": "$stock"}}}
+    ], session=session).to_list(length=1)
+    total = result[0]["stock"] if result else 0
+    _totals.set(product_id, total)
+    return total
+
+async def total_stock(db, product_id: ObjectId) -> int:
+    total = _totals.get(product_id)
+    if total is None:
+        total = await sum_shards(db, product_id)
+    return total
+
+async def live_stock(db, product: dict) -> int:
+    if product.get("stock_shards"):
+        return await total_stock(db, product["_id"] if "_id" in product else ObjectId(product["id"]))
+    return product["stock"]
+
+async def with_live_stock(db, products: list) -> list:
+    # Copies sharded entries so cached lists are never modified
+    result = []
+    for product in products:
+        if product.get("stock_shards"):
+            product = {**product, "stock": await live_stock(db, product)}
+        result.append(product)
+    return result
+
+async def in_stock_query(db, in_stock: bool) -> dict:
+    # products.stock is only a snapshot for sharded products, so those (a
+    # handful of hot ones) are matched by id from their summed shards
+    sharded = await db.products.find({"stock_shards": {"$exists": True}}, {"_id": 1}).to_list(None)
+    ids = [product["_id"] for product in sharded if (await total_stock(db, product["_id"]) > 0) == in_stock]
+    return {"$or": [
+        {"stock_shards": {"$exists": False}, "stock": {"$gt": 0} if in_stock else {"$lte": 0}},
+        {"_id": {"$in": ids}}
+    ]}
+
+async def enable_sharding(db, product_id: ObjectId, shards: int):
+    # Seed the shards from the current stock and only flip the flag if no
+    # booking touched products.stock in between; otherwise try again
+    while True:
+        product = await db.products.find_one({"_id": product_id}, {"stock": 1, "stock_shards": 1})
+        if product is None:
+            return None
+        if product.get("stock_shards"):
+            await disable_sharding(db, product_id)
+            continue
+
+        await db.stock_shards.delete_many({"product_id": product_id})
+        await db.stock_shards.insert_many([
+            {"_id": shard_id(product_id, shard), "product_id": product_id, "stock": amount}
+            for shard, amount in enumerate(split(product["stock"], shards))
+        ])
+        result = await db.products.update_one(
+            {"_id": product_id, "stock": product["stock"], "stock_shards": {"$exists": False}},
+            {"$set": {"stock_shards": shards}}
+        )
+        if result.modified_count:
+            _totals.set(product_id, product["stock"])
+            return product["stock"]
+
+async def disable_sharding(db, product_id: ObjectId):
+    # Route bookings back to products.stock, then fold each shard into it
+    result = await db.products.update_one(
+        {"_id": product_id, "stock_shards": {"$exists": True}},
+        {"$unset": {"stock_shards": ""}, "$set": {"stock": 0}}
+    )
+    if result.modified_count == 0:
+        return None
+
+    while True:
+        shard = await db.stock_shards.find_one_and_delete({"product_id": product_id})
+        if shard is None:
+            break
+        await db.products.update_one({"_id": product_id}, {"$inc": {"stock": shard["stock"]}})
+
+    _totals.delete(product_id)
+    product = await db.products.find_one({"_id": product_id}, {"stock": 1})
+    return product["stock"] if product else None
+
+async def reserve_shards(db, product_id: ObjectId, quantity: int, shards: int, session=None) -> bool:
+    # Start from a random shard so concurrent bookings spread their writes
+    order = random.sample(range(shards), shards)
+    for shard in order:
+        result = await db.stock_shards.update_one(
+            {"_id": shard_id(product_id, shard), "stock": {"$gte": quantity}},
+            {"$inc": {"stock": -quantity}},
+            session=session
+        )
+        if result.modified_count:
+            return True
+
+    # No single shard has enough: collect it from several, and give it
+    # back if the shards together still fall short
+    taken = []
+    remaining = quantity
+    for shard in order:
+        doc = await db.stock_shards.find_one({"_id": shard_id(product_id, shard)}, {"stock": 1}, session=session)
+        amount = min(remaining, doc["stock"]) if doc else 0
+        if amount <= 0:
+            continue
+        result = await db.stock_shards.update_one(
+            {"_id": shard_id(product_id, shard), "stock": {"$gte": amount}},
+            {"$inc": {"stock": -amount}},
+            session=session
+        )
+        if result.modified_count:
+            taken.append((shard, amount))
+            remaining -= amount
+            if remaining == 0:
+                return True
+
+    for shard, amount in taken:
+        await db.stock_shards.update_one(
+            {"_id": shard_id(product_id, shard)},
+            {"$inc": {"stock": amount}},
+            session=session
+        )
+    return False
+
+async def reserve_stock(db, product: dict, quantity: int) -> bool:
+    # Take stock for one booking, from the shards or products.stock
+    if product.get("stock_shards"):
+        reserved = await reserve_shards(db, product["_id"], quantity, product["stock_shards"])
+        metrics.inc("stock.sharded_reservations" if reserved else "stock.sharded_rejections")
+        return reserved
+
+    updated = await db.products.find_one_and_update(
+        {"_id": product["_id"], "stock": {"$gte": quantity}, "stock_shards": {"$exists": False}},
+        {"$inc": {"stock": -quantity}},
+        projection={"stock": 1, "status": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated is None:
+        return False
+    notify_change("products", "update", product["_id"], updated)
+    return True
+
+async def release_stock(db, product_id: ObjectId, quantity: int):
+    updated = await db.products.find_one_and_update(
+        {"_id": product_id, "stock_shards": {"$exists": False}},
+        {"$inc": {"stock": quantity}},
+        projection={"stock": 1, "status": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated is not None:
+        notify_change("products", "update", product_id, updated)
+        return
+
+    product = await db.products.find_one({"_id": product_id}, {"stock_shards": 1})
+    if product is None:
+        return
+    await release_shards(db, product_id, quantity, product["stock_shards"])
+
+async def release_shards(db, product_id: ObjectId, quantity: int, shards: int, session=None):
+    result = await db.stock_shards.update_one(
+        {"_id": shard_id(product_id, random.randrange(shards))},
+        {"$inc": {"stock": quantity}},
+        session=session
+    )
+    if result.matched_count == 0:
+        # Sharding was turned off meanwhile
+        await db.products.update_one({"_id": product_id}, {"$inc": {"stock": quantity}}, session=session)
+
+async def adjust_sharded_stock(db, product_id: ObjectId, stock: int) -> bool:
+    # Admin stock updates on a sharded product become a delta on one shard;
+    # the rebalancer spreads it out again
+    product = await db.products.find_one({"_id": product_id}, {"stock_shards": 1})
+    if not product or not product.get("stock_shards"):
+        return False
+    delta = stock - await sum_shards(db, product_id)
+    if delta:
+        await db.stock_shards.update_one({"_id": shard_id(product_id, 0)}, {"$inc": {"stock": delta}})
+        _totals.delete(product_id)
+    return True
+
+async def rebalance(db, product_id: ObjectId):
+    shards = await db.stock_shards.find({"product_id": product_id}).sort("_id", 1).to_list(None)
+    if not shards:
+        return
+
+    # Move stock from shards above the even split to those below it; the
+    # donor is decremented first (guarded) so it never goes negative
+    targets = split(sum(shard["stock"] for shard in shards), len(shards))
+    donors = [[shard["_id"], shard["stock"] - target] for shard, target in zip(shards, targets) if shard["stock"] > target]
+    recipients = [[shard["_id"], target - shard["stock"]] for shard, target in zip(shards, targets) if shard["stock"] < target]
+
+    moved = 0
+    for recipient, need in recipients:
+        while need > 0 and donors:
+            donor = donors[-1]
+            amount = min(need, donor[1])
+            result = await db.stock_shards.update_one(
+                {"_id": donor[0], "stock": {"$gte": amount}},
+                {"$inc": {"stock": -amount}}
+            )
+            if result.modified_count:
+                await db.stock_shards.update_one({"_id": recipient}, {"$inc": {"stock": amount}})
+                need -= amount
+                moved += amount
+                donor[1] -= amount
+            else:
+                # Drained by bookings since we read it
+                donor[1] = 0
+            if donor[1] <= 0:
+                donors.pop()
+    metrics.inc("stock.rebalanced", moved)
+
+    # Publish the total so products.stock, the catalog cache and event
+    # subscribers catch up with the shards
+    total = await sum_shards(db, product_id)
+    updated = await db.products.find_one_and_update(
+        {"_id": product_id, "stock_shards": {"$exists": True}, "stock": {"$ne": total}},
+        {"$set": {"stock": total}},
+        projection={"stock": 1, "status": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated is not None:
+        notify_change("products", "update", product_id, updated)
+
+async def run_stock_rebalancer(db):
+    # Runs in every worker; the lease makes sure only one of them rebalances
+    lease_ttl = STOCK_REBALANCE_SECONDS * 3
+    try:
+        while True:
+            try:
+                if await acquire_lease(db, REBALANCER_LEASE, lease_ttl):
+                    async for product in db.products.find({"stock_shards": {"$exists": True}}, {"_id": 1}):
+                        await rebalance(db, product["_id"])
+            except PyMongoError as e:
+                logger.warning("Stock rebalance failed: %s", e)
+
+            await asyncio.sleep(STOCK_REBALANCE_SECONDS)
+    finally:
+        try:
+            await release_lease(db, REBALANCER_LEASE)
+        except PyMongoError:
+            pass
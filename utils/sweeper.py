@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from dotenv import load_dotenv
+from utils import metrics
+from utils.access_log import APP_LOGGER
+from utils.audit import audit_log
+from utils.change_stream import notify_change
+from utils.leader import acquire_lease, release_lease
+from utils.ids import refs_query
+from utils.stock_counters import release_shards
+
+load_dotenv()
+
+logger = logging.getLogger(APP_LOGGER)
+
+# Unpaid pending bookings older than this are expired and their stock released
+BOOKING_HOLD_MINUTES = float(os.getenv("BOOKING_HOLD_MINUTES", 60))
+SWEEP_INTERVAL_SECONDS = float(os.getenv("SWEEP_INTERVAL_SECONDS", 60))
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", 500))
+SWEEPER_ENABLED = os.getenv("SWEEPER_ENABLED", "true").lower() == "true"
+
+SWEEPER_LEASE = "booking-sweeper"
+
+async def expire_batch(db, bookings: list, now: datetime):
+    ids = [booking["_id"] for booking in bookings]
+    sweep_id = ObjectId()
+
+    # The status guard skips bookings paid or cancelled since we read them
+    result = await db.bookings.update_many(
+        {"_id": {"$in": ids}, "status": "pending"},
+        {"$set": {"status": "expired", "expired_at": now, "sweep_id": sweep_id}}
+    )
+    if result.modified_count == 0:
+        return 0, 0
+    if result.modified_count != len(ids):
+        bookings = await db.bookings.find({"sweep_id": sweep_id}, {"product_id": 1, "quantity": 1, "user_id": 1}).to_list(None)
+
+    # Release stock with one write per product
+    released = {}
+    for booking in bookings:
+        product_id = str(booking["product_id"])
+        released[product_id] = released.get(product_id, 0) + booking["quantity"]
+
+    # Sharded products (see utils.stock_counters) get it back on a shard
+    sharded = {}
+    async for product in db.products.find(
+        {"_id": {"$in": [ObjectId(product_id) for product_id in released]}, "stock_shards": {"$exists": True}},
+        {"stock_shards": 1}
+    ):
+        sharded[str(product["_id"])] = product["stock_shards"]
+
+    single = [
+        UpdateOne({"_id": ObjectId(product_id), "stock_shards": {"$exists": False}}, {"$inc": {"stock": quantity}})
+        for product_id, quantity in released.items()
+        if product_id not in sharded
+    ]
+    if single:
+        await db.products.bulk_write(single, ordered=False)
+    for product_id, shards in sharded.items():
+        await release_shards(db, ObjectId(product_id), released[product_id], shards)
+
+    for booking in bookings:
+        notify_change("bookings", "update", booking["_id"], {"user_id": booking["user_id"], "status": "expired"})
+        await audit_log.record("booking", booking["_id"], "expired", data={"quantity": booking["quantity"]})
+    for product_id in released:
+        if product_id not in sharded:
+            notify_change("products", "update", ObjectId(product_id))
+
+    return len(bookings), sum(released.values())
+
+async def expire_pending_bookings(db):
+    now = datetime.utcnow()
+    cutoff = now - timedelta(minutes=BOOKING_HOLD_MINUTES)
+    total_expired = 0
+    total_released = 0
+
+    # Served by the (status, created_at) index
+    cursor = db.bookings.find(
+        {"status": "pending", "created_at": {"$lt": cutoff}},
+        {"product_id": 1, "quantity": 1, "user_id": 1}
+    ).sort("created_at", 1).batch_size(SWEEP_BATCH_SIZE)
+
+    while True:
+        bookings = await cursor.to_list(SWEEP_BATCH_SIZE)
+        if not bookings:
+            break
+
+        # A booking with a payment on the way is not abandoned
+        with_payment = set()
+        async for payment in db.payments.find(
+            {"booking_id": refs_query(booking["_id"] for booking in bookings)},
+            {"booking_id": 1}
+        ):
+            with_payment.add(str(payment["booking_id"]))
+        bookings = [booking for booking in bookings if str(booking["_id"]) not in with_payment]
+
+        if bookings:
+            expired, released = await expire_batch(db, bookings, now)
+            total_expired += expired
+            total_released += released
+
+    metrics.inc("sweeper.bookings_expired", total_expired)
+    metrics.inc("sweeper.stock_released", total_released)
+    return total_expired, total_released
+
+async def run_sweeper(db):
+    # Runs in every worker; the lease makes sure only one of them sweeps
+    lease_ttl = SWEEP_INTERVAL_SECONDS * 3
+    try:
+        while True:
+            try:
+                if await acquire_lease(db, SWEEPER_LEASE, lease_ttl):
+                    metrics.inc("sweeper.runs")
+                    expired, released = await expire_pending_bookings(db)
+                    if expired:
+                        logger.info("Expired %d unpaid bookings, released %d items", expired, released)
+            except PyMongoError as e:
+                logger.warning("Booking sweep failed: %s", e)
+
+            await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+    finally:
+        # Let another worker take over right away
+        try:
+            await release_lease(db, SWEEPER_LEASE)
+        except PyMongoError:
+            pass
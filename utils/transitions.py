@@ -0,0 +1,117 @@
+import os
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+from utils.change_stream import notify_change
+from utils.audit import audit_log
+from utils.ids import refs_query
+
+load_dotenv()
+
+# Most documents one bulk status request may change
+BULK_STATUS_LIMIT = int(os.getenv("BULK_STATUS_LIMIT", 5000))
+
+# Allowed status changes for the bulk admin endpoints (current -> targets).
+# Cancelling is left to DELETE /api/bookings/{id}, which restores stock.
+BOOKING_TRANSITIONS = {
+    "pending": {"confirmed"},
+    "confirmed": {"completed"}
+}
+PAYMENT_TRANSITIONS = {
+    "pending": {"completed", "failed"},
+    "failed": {"completed"}
+}
+
+def build_query(ids, from_status=None, created_after=None, created_before=None) -> tuple:
+    # (query, per-id results for ids that are not ObjectIds)
+    query = {}
+    results = {}
+    if ids is not None:
+        object_ids = []
+        for value in ids:
+            try:
+                object_ids.append(ObjectId(value))
+            except (InvalidId, TypeError):
+                results[value] = {"id": value, "result": "invalid_id"}
+        query["_id"] = {"$in": object_ids}
+    if from_status:
+        query["status"] = from_status
+    if created_after or created_before:
+        query["created_at"] = {}
+        if created_after:
+            query["created_at"]["$gte"] = created_after
+        if created_before:
+            query["created_at"]["$lt"] = created_before
+    return query, results
+
+async def apply_status_transition(collection, query: dict, target: str, transitions: dict, projection: dict, ids=None) -> tuple:
+    # Moves matching documents to `target` with one bulk_write. Returns
+    # per-id results, the documents that were changed and whether more than
+    # BULK_STATUS_LIMIT matched (only the first ones, by _id, were handled).
+    docs = await collection.find(query, {**projection, "status": 1}).sort("_id", 1).limit(BULK_STATUS_LIMIT + 1).to_list(None)
+    has_more = len(docs) > BULK_STATUS_LIMIT
+    docs = docs[:BULK_STATUS_LIMIT]
+
+    results = {}
+    candidates = []
+    for doc in docs:
+        doc_id = str(doc["_id"])
+        if doc["status"] == target:
+            results[doc_id] = {"id": doc_id, "result": "unchanged", "status": target}
+        elif target not in transitions.get(doc["status"], ()):
+            results[doc_id] = {"id": doc_id, "result": "invalid_transition", "status": doc["status"]}
+        else:
+            candidates.append(doc)
+
+    changed = []
+    if candidates:
+        now = datetime.utcnow()
+        # The status guard skips documents changed since we read them
+        result = await collection.bulk_write([
+            UpdateOne({"_id": doc["_id"], "status": doc["status"]}, {"$set": {"status": target, "updated_at": now}})
+            for doc in candidates
+        ], ordered=False)
+
+        if result.modified_count == len(candidates):
+            changed = candidates
+        else:
+            # Only re-read to find out which ones lost the race
+            moved = {
+                doc["_id"] for doc in await collection.find(
+                    {"_id": {"$in": [doc["_id"] for doc in candidates]}, "updated_at": now, "status": target},
+                    {"_id": 1}
+                ).to_list(None)
+            }
+            changed = [doc for doc in candidates if doc["_id"] in moved]
+            for doc in candidates:
+                if doc["_id"] not in moved:
+                    results[str(doc["_id"])] = {"id": str(doc["_id"]), "result": "conflict", "status": doc["status"]}
+
+        for doc in changed:
+            results[str(doc["_id"])] = {"id": str(doc["_id"]), "result": "updated", "from": doc["status"], "status": target}
+
+    if ids is not None:
+        # Report in request order
+        results = {value: results.get(value, {"id": value, "result": "not_found"}) for value in ids}
+    return results, changed, has_more
+
+async def confirm_paid_bookings(db, booking_ids, actor: str = None) -> list:
+    # Pending bookings whose payment completed become confirmed, in one
+    # bulk_write; returns the ids of the bookings that changed
+    bookings = await db.bookings.find(
+        {"_id": refs_query(booking_ids), "status": "pending"},
+        {"user_id": 1}
+    ).to_list(None)
+    if not bookings:
+        return []
+
+    await db.bookings.bulk_write([
+        UpdateOne({"_id": booking["_id"], "status": "pending"}, {"$set": {"status": "confirmed", "updated_at": datetime.utcnow()}})
+        for booking in bookings
+    ], ordered=False)
+    for booking in bookings:
+        notify_change("bookings", "update", booking["_id"], {"user_id": booking["user_id"], "status": "confirmed"})
+        await audit_log.record("booking", booking["_id"], "status_changed", actor, {"from": "pending", "to": "confirmed"})
+    return [str(booking["_id"]) for booking in bookings]